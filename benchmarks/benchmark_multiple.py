@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark multiple_primer_blast against a local mock primer-BLAST server.
+
+For each batch size, multiple_primer_blast runs in a fresh process against a
+rt_primer_design.mock_server.MockPrimerBlastServer running in this one, so
+that peak RSS and CPU time are measured for the client alone. One JSON line
+is printed per batch size, with:
+
+    genes, seconds, genes_per_hour, requests_per_gene, submissions_per_gene,
+    peak_rss_mb, cpu_seconds, parse_seconds, parse_ms_per_gene, statuses
+
+Usage:
+    python benchmarks/benchmark_multiple.py --genes 100 1000 10000
+"""
+
+
+################
+# DEPENDENCIES #
+################
+
+import argparse
+import collections
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+############
+# PROVIDES #
+############
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--genes', type=int, nargs='+', default=[100, 1000, 10000],
+        help='batch sizes to run (default: 100 1000 10000)')
+    parser.add_argument(
+        '--n-jobs', type=int, default=100,
+        help='genes in flight (default: 100)')
+    parser.add_argument(
+        '--rate', type=float, default=500.0,
+        help='requests per second allowed by the rate limiter (default: 500)')
+    parser.add_argument(
+        '--wait-seconds', type=float, default=0.2,
+        help='minimum time between polls of a job (default: 0.2)')
+    parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='mean latency of the mock server in seconds (default: 0.02)')
+    parser.add_argument(
+        '--error-rate', type=float, default=0.01,
+        help='share of requests that fail with HTTP 503 (default: 0.01)')
+    parser.add_argument(
+        '--job-seconds', type=float, default=0.5,
+        help='time each mock job runs (default: 0.5)')
+    parser.add_argument(
+        '--padding', type=int, default=100000,
+        help='bytes of filler in finished pages (default: 100000)')
+    parser.add_argument(
+        '--pages', help='directory of recorded pages to replay')
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_client(arguments):
+    """Run one batch against the server at arguments.url, and write the
+    client's measurements to arguments.output as JSON."""
+    import rt_primer_design
+    from rt_primer_design import backends
+    from rt_primer_design import metrics
+    from rt_primer_design import rate_limit
+    from rt_primer_design import session
+
+    genes = arguments.genes[0]
+    tracer = metrics.Tracer()
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    blast_records = rt_primer_design.multiple_primer_blast(
+        ('NM_%09d.1' % x for x in range(genes)),
+        {'SPAN_INTRON': 'on', 'GC_CLAMP': '2',
+         'LOW_COMPLEXITY_FILTER': 'on'},
+        wait_seconds=arguments.wait_seconds,
+        n_jobs=arguments.n_jobs,
+        rate_limiter=rate_limit.TokenBucket(
+            rate=arguments.rate, burst=max(1, arguments.rate)),
+        session=session.BlastSession(
+            backoff=0.1, pool_size=arguments.n_jobs),
+        backend=backends.PrimerBlastBackend(arguments.url, name='mock'),
+        tracer=tracer)
+    seconds = time.monotonic() - started
+    stats = tracer.stats()
+    with open(arguments.output, 'w') as output:
+        json.dump({
+            'seconds': seconds,
+            'cpu_seconds': time.process_time() - cpu_started,
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'parse_seconds': stats['phase_seconds']['parse'],
+            'statuses': collections.Counter(
+                x.status for x in blast_records)}, output)
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.url:
+        run_client(arguments)
+        return
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    from rt_primer_design import mock_server
+
+    pages = None
+    if arguments.pages:
+        pages = mock_server.load_pages(arguments.pages, arguments.padding)
+    server = mock_server.MockPrimerBlastServer(
+        latency=arguments.latency,
+        error_rate=arguments.error_rate,
+        job_seconds=arguments.job_seconds,
+        pages=pages,
+        padding=arguments.padding,
+        seed=1)
+    with server, tempfile.TemporaryDirectory() as directory:
+        for genes in arguments.genes:
+            output = os.path.join(directory, '%d.json' % genes)
+            before = server.stats()
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 '--genes', str(genes),
+                 '--n-jobs', str(arguments.n_jobs),
+                 '--rate', str(arguments.rate),
+                 '--wait-seconds', str(arguments.wait_seconds),
+                 '--url', server.url,
+                 '--output', output],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+            after = server.stats()
+            with open(output) as client_output:
+                client = json.load(client_output)
+            print(json.dumps({
+                'genes': genes,
+                'seconds': round(client['seconds'], 2),
+                'genes_per_hour': round(genes / client['seconds'] * 3600),
+                'requests_per_gene': round(
+                    (after['requests'] - before['requests']) / genes, 2),
+                'submissions_per_gene': round(
+                    (after['submissions'] - before['submissions']) / genes,
+                    2),
+                'peak_rss_mb': round(client['peak_rss_mb'], 1),
+                'cpu_seconds': round(client['cpu_seconds'], 2),
+                'parse_seconds': round(client['parse_seconds'], 3),
+                'parse_ms_per_gene': round(
+                    client['parse_seconds'] / genes * 1000, 3),
+                'statuses': client['statuses']}), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+
+############
+# PROVIDES #
+############
+
+CSS_BASE_URL = 'https://www.ncbi.nlm.nih.gov/tools/primer-blast/'
+
+_CSS_HREF = re.compile(
+    rb'''(\bhref\s*=\s*)(["']?)((?!https?:|//)[^"'\s>]*css[^"'\s>]*)\2''',
+    re.IGNORECASE)
+
+
+def rewrite_css_links(content):
+    """Point the relative css links of a result page at NCBI.
+
+    Does the same as PrimerBlastResult.replace_css_links, on the raw page
+    instead of the parsed tree.
+
+    Args:
+        content: the page as bytes.
+
+    Returns:
+        The page as bytes.
+    """
+    return _CSS_HREF.sub(
+        lambda match: (match.group(1) + match.group(2) +
+                       CSS_BASE_URL.encode() + match.group(3) +
+                       match.group(2)),
+        content)
+
+
+def connect(path, **kwargs):
+    """Open a SQLite database that processes on several hosts may share.
+
+    The database uses SQLite's default rollback journal, not WAL, which
+    needs shared memory between the processes and so only works on one
+    host. On NFS, the rollback journal relies on working file locks (lockd),
+    which must be enabled on the mount.
+
+    Args:
+        path: path to the SQLite database.
+        **kwargs: passed to sqlite3.connect, e.g. isolation_level.
+
+    Returns:
+        A sqlite3.Connection that may be used from any thread.
+    """
+    connection = sqlite3.connect(
+        path, timeout=60, check_same_thread=False, **kwargs)
+    connection.execute('PRAGMA journal_mode=DELETE')
+    return connection
+
+
+class HtmlArchive:
+    """Single-file archive of result pages.
+
+    Pages are stored compressed in a SQLite database, keyed by ref_seq and
+    status, instead of one html file per gene. Several processes can write
+    to the same archive, one page at a time. The css links are only
+    rewritten when a page is extracted. The database is opened with
+    connect, so it can be on a shared filesystem.
+
+    HtmlArchive has the same put and get methods as records.MemoryPageStore,
+    so it can be used as the page store of multiple_primer_blast.
+
+    Attributes:
+        path: path to the SQLite database.
+    """
+    def __init__(self, path):
+        """Init HtmlArchive, creating the database if necessary.
+
+        Args:
+            path: path to the SQLite database.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = connect(path)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'ref_seq TEXT NOT NULL, '
+                'status TEXT NOT NULL, '
+                'content BLOB NOT NULL, '
+                'size INTEGER NOT NULL, '
+                'created REAL NOT NULL, '
+                'PRIMARY KEY (ref_seq, status))')
+
+    def put(self, ref_seq, status, content):
+        """Store the page for ref_seq and status, replacing any older one.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set, e.g. 'strict'.
+            content: the page as bytes.
+        """
+        compressed = zlib.compress(content)
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                (ref_seq, status, compressed, len(content), time.time()))
+
+    def get(self, ref_seq, status=None):
+        """Return a page as bytes, or None.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set. If None, return the page
+                stored last for ref_seq.
+        """
+        with self._lock:
+            if status is None:
+                row = self._connection.execute(
+                    'SELECT content FROM pages WHERE ref_seq = ? '
+                    'ORDER BY created DESC LIMIT 1',
+                    (ref_seq,)).fetchone()
+            else:
+                row = self._connection.execute(
+                    'SELECT content FROM pages '
+                    'WHERE ref_seq = ? AND status = ?',
+                    (ref_seq, status)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0])
+
+    def extract(self, ref_seq, status=None, rewrite_css=True):
+        """Return a page ready to be viewed, or None.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set, or None for the page
+                stored last for ref_seq.
+            rewrite_css: if True, point the css links at NCBI.
+
+        Returns:
+            The page as a str.
+        """
+        content = self.get(ref_seq, status)
+        if content is None:
+            return None
+        if rewrite_css:
+            content = rewrite_css_links(content)
+        return content.decode('utf-8', 'replace')
+
+    def print_file(self, ref_seq, output_subdirectory, status=None):
+        """Extract a page to output_subdirectory/<ref_seq>.html, as
+        PrimerBlastResult.print_file does.
+
+        Returns:
+            True if the page was found.
+        """
+        page = self.extract(ref_seq, status)
+        if page is None:
+            return False
+        output_file = os.path.join(output_subdirectory, ref_seq + '.html')
+        with open(output_file, 'w') as file:
+            file.write(page)
+        return True
+
+    def keys(self):
+        """List the (ref_seq, status) of the stored pages."""
+        with self._lock:
+            return self._connection.execute(
+                'SELECT ref_seq, status FROM pages '
+                'ORDER BY ref_seq, created').fetchall()
+
+    def stats(self):
+        """Size of the archive.
+
+        Returns:
+            A dict with keys pages, size (bytes of html) and stored_size
+            (bytes after compression).
+        """
+        with self._lock:
+            pages, size, stored_size = self._connection.execute(
+                'SELECT COUNT(*), TOTAL(size), TOTAL(LENGTH(content)) '
+                'FROM pages').fetchone()
+        return {
+            'pages': pages,
+            'size': int(size),
+            'stored_size': int(stored_size)}
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
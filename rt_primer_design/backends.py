@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+from rt_primer_design import primers
+from rt_primer_design import scanner
+
+
+############
+# PROVIDES #
+############
+
+NCBI_BLAST_URL = ('https://www.ncbi.nlm.nih.gov/tools/'
+                  'primer-blast/primertool.cgi')
+
+
+class PrimerBlastBackend:
+    """A primer-BLAST service, and how to talk to it.
+
+    The backend holds everything PrimerBlastResult needs to know about the
+    server: the URL queries are sent to, the parameters of submits and
+    polls, and how the status markers and primer pairs are read from the
+    pages it returns. The default backend is NCBI. Point blast_url at
+    another server that serves the same pages, e.g. a
+    mock_server.MockPrimerBlastServer, to run without NCBI, or subclass to
+    talk to a service with different pages.
+
+    Attributes:
+        blast_url: URL of the primertool.cgi of the service.
+        name: name of the backend, for messages.
+    """
+    def __init__(self, blast_url=NCBI_BLAST_URL, name='ncbi'):
+        """Init PrimerBlastBackend.
+
+        Args:
+            blast_url: URL of the primertool.cgi of the service.
+            name: name of the backend.
+        """
+        self.blast_url = blast_url
+        self.name = name
+
+    def submit_params(self, blast_parameters):
+        """The GET parameters that submit a query.
+
+        Args:
+            blast_parameters: the parameters of the query, including
+                INPUT_SEQUENCE.
+
+        Returns:
+            A dict of parameters.
+        """
+        return blast_parameters
+
+    def poll_params(self, job_key):
+        """The GET parameters that fetch the page of a submitted job."""
+        return {'job_key': job_key}
+
+    def scan_page(self, content):
+        """Read the status markers of a page.
+
+        Returns:
+            A scanner.PageSummary.
+        """
+        return scanner.scan_page(content)
+
+    def parse_primer_pairs(self, content):
+        """Read the primer pairs of a finished page.
+
+        Returns:
+            A list of primers.PrimerPair, in rank order.
+        """
+        return primers.parse_primer_pairs(content)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (
+            type(self).__name__, self.blast_url, self.name)
+
+
+_default_backend = None
+
+
+def get_backend():
+    """Return the process-wide backend, creating it if necessary.
+
+    The default backend is NCBI primer-BLAST.
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = PrimerBlastBackend()
+    return _default_backend
+
+
+def set_backend(backend):
+    """Replace the process-wide backend.
+
+    Args:
+        backend: the PrimerBlastBackend to use for all queries that aren't
+            given a backend explicitly.
+    """
+    global _default_backend
+    _default_backend = backend
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+############
+# PROVIDES #
+############
+
+def canonical_parameters(blast_parameters):
+    """Serialise blast_parameters in a canonical form.
+
+    INPUT_SEQUENCE is dropped, because results are keyed by ref_seq anyway.
+    Keys are sorted and values are converted to str, so that e.g. 1 and '1'
+    give the same result.
+
+    Args:
+        blast_parameters: a dict of primer-BLAST parameters.
+
+    Returns:
+        A str of JSON.
+    """
+    canonical = {}
+    for key, value in blast_parameters.items():
+        if key == 'INPUT_SEQUENCE':
+            continue
+        if isinstance(value, (list, tuple)):
+            canonical[key] = [str(x) for x in value]
+        else:
+            canonical[key] = str(value)
+    return json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+
+
+def parameter_hash(blast_parameters):
+    """Return the SHA-256 hex digest of canonical_parameters."""
+    return hashlib.sha256(
+        canonical_parameters(blast_parameters).encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of finished primer-BLAST results.
+
+    Results are stored in a SQLite database, keyed by ref_seq, the hash of the
+    canonical blast_parameters and status. Values are the records returned by
+    PrimerBlastResult.to_record. The html, if present, is stored compressed.
+
+    Attributes:
+        path: path to the SQLite database.
+        ttl: entries older than ttl seconds are discarded. None means entries
+            don't expire.
+        max_entries: if the cache grows beyond max_entries, the least recently
+            used entries are evicted. None means no limit.
+        hits: number of lookups that found a result.
+        misses: number of lookups that didn't find a result.
+        expired: number of entries discarded because they were older than ttl.
+        evictions: number of entries evicted because of max_entries.
+    """
+    def __init__(self, path, ttl=None, max_entries=None):
+        """Init ResultCache, creating the database if necessary.
+
+        Args:
+            path: path to the SQLite database.
+            ttl: maximum age of an entry in seconds, or None.
+            max_entries: maximum number of entries, or None.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'ref_seq TEXT NOT NULL, '
+                'parameter_hash TEXT NOT NULL, '
+                'status TEXT NOT NULL, '
+                'record TEXT NOT NULL, '
+                'html BLOB, '
+                'created REAL NOT NULL, '
+                'accessed REAL NOT NULL, '
+                'PRIMARY KEY (ref_seq, parameter_hash, status))')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_accessed '
+                'ON results (accessed)')
+
+    def get(self, ref_seq, blast_parameters, status):
+        """Look up a result.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the result was designed with.
+            status: the status of the primer set, e.g. 'strict'.
+
+        Returns:
+            The cached record, or None.
+        """
+        key = (ref_seq, parameter_hash(blast_parameters), status)
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT record, html, created FROM results '
+                'WHERE ref_seq = ? AND parameter_hash = ? AND status = ?',
+                key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            record, html, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._connection.execute(
+                    'DELETE FROM results '
+                    'WHERE ref_seq = ? AND parameter_hash = ? AND status = ?',
+                    key)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._connection.execute(
+                'UPDATE results SET accessed = ? '
+                'WHERE ref_seq = ? AND parameter_hash = ? AND status = ?',
+                (now,) + key)
+            self.hits += 1
+
+        record = json.loads(record)
+        if html is not None:
+            record['html'] = zlib.decompress(html).decode()
+        return record
+
+    def put(self, ref_seq, blast_parameters, status, record):
+        """Store a result.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the result was designed with.
+            status: the status of the primer set, e.g. 'strict'.
+            record: the record returned by PrimerBlastResult.to_record.
+        """
+        record = dict(record)
+        html = record.pop('html', None)
+        if html is not None:
+            html = zlib.compress(html.encode())
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (ref_seq, parameter_hash(blast_parameters), status,
+                 json.dumps(record), html, now, now))
+            if self.max_entries is not None:
+                evicted = self._connection.execute(
+                    'DELETE FROM results WHERE rowid IN ('
+                    'SELECT rowid FROM results ORDER BY accessed LIMIT '
+                    'max(0, (SELECT COUNT(*) FROM results) - ?))',
+                    (self.max_entries,)).rowcount
+                self.evictions += evicted
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM results')
+
+    def stats(self):
+        """Hit/miss statistics.
+
+        Returns:
+            A dict with keys entries, hits, misses, expired and evictions.
+        """
+        with self._lock:
+            entries = self._connection.execute(
+                'SELECT COUNT(*) FROM results').fetchone()[0]
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions}
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
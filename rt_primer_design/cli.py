@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import argparse
+import configparser
+import contextlib
+import math
+import os
+import sys
+
+
+############
+# PROVIDES #
+############
+
+# Only the standard library is imported at module level, so that --help and
+# argument errors return without importing the engine and its dependencies.
+
+DESCRIPTION = '''Design real-time PCR primers with NCBI primer-BLAST.
+
+RefSeq IDs are read one per line from IDS (a file, or - for stdin), and a CSV
+line is written to stdout as soon as each gene is done. Blank lines, lines
+starting with # and anything after the first word of a line are ignored.
+
+Primer-BLAST parameters are taken from a section of an INI file given with
+--config, e.g.
+
+    [strict]
+    PRIMER_PRODUCT_MIN = 70
+    PRIMER_PRODUCT_MAX = 200
+    SPAN_INTRON = on
+    GC_CLAMP = 2
+
+and from --set, which overrides the file. Messages go to stderr.'''
+
+
+def read_ids(lines):
+    """Read RefSeq IDs from lines, lazily.
+
+    Args:
+        lines: an iterable of str, e.g. an open file.
+
+    Yields:
+        The first word of each line that isn't blank or a comment.
+    """
+    for line in lines:
+        words = line.replace(',', ' ').split()
+        if words and not words[0].startswith('#'):
+            yield words[0]
+
+
+def read_preset(config_file, preset):
+    """Read the primer-BLAST parameters of preset from an INI file.
+
+    Parameter names keep their case. Keys in the [DEFAULT] section apply to
+    every preset.
+
+    Args:
+        config_file: path to the INI file.
+        preset: name of the section.
+
+    Returns:
+        A dict of parameters as str.
+
+    Raises:
+        ValueError: if there is no section named preset.
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.optionxform = str
+    with open(config_file) as config_input:
+        config.read_file(config_input)
+    if preset == configparser.DEFAULTSECT:
+        return dict(config.defaults())
+    if not config.has_section(preset):
+        raise ValueError(
+            'No preset [%s] in %s. Presets: %s' %
+            (preset, config_file, ', '.join(config.sections()) or 'none'))
+    return dict(config.items(preset))
+
+
+def _parameter(text):
+    """Parse a KEY=VALUE argument of --set."""
+    name, separator, value = text.partition('=')
+    if not separator or not name:
+        raise argparse.ArgumentTypeError(
+            'expected NAME=VALUE, got %r' % text)
+    return name.strip(), value.strip()
+
+
+async def _read_in_thread(ids):
+    """Yield the items of ids, read in a daemon thread so that waiting for
+    input, e.g. on a pipe, doesn't hold up the genes in flight."""
+    import asyncio
+    import threading
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def read():
+        try:
+            for ref_seq in ids:
+                loop.call_soon_threadsafe(queue.put_nowait, ref_seq)
+        except BaseException as error:
+            loop.call_soon_threadsafe(queue.put_nowait, error)
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    threading.Thread(target=read, daemon=True).start()
+    while True:
+        ref_seq = await queue.get()
+        if ref_seq is done:
+            return
+        if isinstance(ref_seq, BaseException):
+            raise ref_seq
+        yield ref_seq
+
+
+def _number(type_, check, description):
+    """An argparse type for finite numbers of type_ that pass check."""
+    def parse(text):
+        try:
+            value = type_(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid number %r' % text)
+        if not math.isfinite(value):
+            raise argparse.ArgumentTypeError('must be finite, got %r' % text)
+        if not check(value):
+            raise argparse.ArgumentTypeError(
+                'must be %s, got %r' % (description, text))
+        return value
+    return parse
+
+
+def _positive(type_):
+    """An argparse type for positive numbers of type_."""
+    return _number(type_, lambda value: value > 0, 'positive')
+
+
+def _non_negative(type_):
+    """An argparse type for numbers of type_ that are 0 or more."""
+    return _number(type_, lambda value: value >= 0, 'non-negative')
+
+
+def build_parser():
+    """The argparse.ArgumentParser of the command line interface."""
+    parser = argparse.ArgumentParser(
+        prog='rt-primer-design',
+        description=DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'ids', metavar='IDS', nargs='?', default='-',
+        help='file of RefSeq IDs, or - for stdin (default: -)')
+
+    parameters = parser.add_argument_group('parameters')
+    parameters.add_argument(
+        '-c', '--config', help='INI file of parameter presets')
+    parameters.add_argument(
+        '-p', '--preset', default=configparser.DEFAULTSECT,
+        help='section of --config to use (default: DEFAULT)')
+    parameters.add_argument(
+        '-s', '--set', metavar='NAME=VALUE', dest='parameters',
+        type=_parameter, action='append', default=[],
+        help='set a primer-BLAST parameter. Can be repeated.')
+
+    run = parser.add_argument_group('run')
+    run.add_argument(
+        '-j', '--n-jobs', type=_positive(int), default=10,
+        help='genes in flight, or to start with if --adaptive (default: 10)')
+    run.add_argument(
+        '--adaptive', action='store_true',
+        help='raise and lower the genes in flight as the server copes')
+    run.add_argument(
+        '--rate', type=_positive(float), default=1 / 3,
+        help='requests per second (default: 1/3, as per NCBI guidelines)')
+    run.add_argument(
+        '--rate-state', metavar='FILE',
+        help='file to share the request budget with other processes on '
+             'this host')
+    run.add_argument(
+        '--blast-url', metavar='URL',
+        help='primer-BLAST URL to use instead of NCBI, e.g. a mirror')
+    run.add_argument(
+        '--wait-seconds', type=_positive(float), default=60,
+        help='minimum time between polls of a job (default: 60)')
+    run.add_argument(
+        '--speculation', type=_non_negative(int), default=0,
+        help='extra relaxation steps to submit ahead (default: 0)')
+    run.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='print stepwise status messages to stderr')
+
+    storage = parser.add_argument_group('storage')
+    storage.add_argument(
+        '--cache', metavar='DB', help='SQLite cache of results')
+    storage.add_argument(
+        '--journal', metavar='FILE',
+        help='journal to resume an interrupted run from')
+    storage.add_argument(
+        '--archive', metavar='DB',
+        help='SQLite archive to store the result pages in')
+    storage.add_argument(
+        '--html-directory', metavar='DIR',
+        help='directory to write the result pages to')
+    storage.add_argument(
+        '--trace', metavar='FILE',
+        help='JSON-lines file of per-step timings')
+    storage.add_argument(
+        '--no-header', action='store_true',
+        help="don't write the CSV header")
+
+    local = parser.add_argument_group('local checks')
+    local.add_argument(
+        '--templates', metavar='FASTA',
+        help='template sequences to pre-screen relaxation levels with. '
+             'Genes that no level can meet are not submitted, and get '
+             'status prescreen_infeasible (needs numpy)')
+    local.add_argument(
+        '--specificity-index', metavar='DIR',
+        help='k-mer index to check primers that NCBI finds may not be '
+             'specific. Pairs without off-target products in the index are '
+             'accepted, and a locally_verified column is added to the CSV '
+             '(needs numpy)')
+    return parser
+
+
+def parse_arguments(argv=None):
+    """Parse and check the command line.
+
+    Returns:
+        A tuple of (arguments, starting_parameters).
+    """
+    parser = build_parser()
+    arguments = parser.parse_args(argv)
+    if arguments.ids != '-' and not os.path.isfile(arguments.ids):
+        parser.error('IDS file not found: %s' % arguments.ids)
+    for name in ('templates',):
+        path = getattr(arguments, name)
+        if path is not None and not os.path.isfile(path):
+            parser.error('--%s file not found: %s' % (name, path))
+    if (arguments.specificity_index is not None and
+            not os.path.isdir(arguments.specificity_index)):
+        parser.error('--specificity-index directory not found: %s' %
+                     arguments.specificity_index)
+
+    starting_parameters = {}
+    if arguments.config is not None:
+        try:
+            starting_parameters = read_preset(
+                arguments.config, arguments.preset)
+        except (OSError, configparser.Error, ValueError) as error:
+            parser.error(str(error))
+    elif arguments.preset != configparser.DEFAULTSECT:
+        parser.error('--preset needs --config')
+    starting_parameters.update(arguments.parameters)
+    return arguments, starting_parameters
+
+
+def run(arguments, starting_parameters, ids, output):
+    """Run the genes in ids and write CSV lines to output.
+
+    Returns:
+        The number of genes written.
+    """
+    from rt_primer_design import primer_blast
+    from rt_primer_design import rate_limit
+    from rt_primer_design import sinks
+
+    options = {}
+    if arguments.blast_url is not None:
+        from rt_primer_design import backends
+        options['backend'] = backends.PrimerBlastBackend(
+            arguments.blast_url, name='custom')
+    if arguments.adaptive:
+        from rt_primer_design import concurrency
+        options['concurrency'] = concurrency.AdaptiveConcurrency(
+            initial=arguments.n_jobs)
+    with contextlib.ExitStack() as stack:
+        if arguments.cache is not None:
+            from rt_primer_design import cache
+            options['cache'] = cache.ResultCache(arguments.cache)
+            stack.callback(options['cache'].close)
+        if arguments.journal is not None:
+            from rt_primer_design import journal
+            options['journal'] = journal.Journal(arguments.journal)
+            stack.callback(options['journal'].close)
+        if arguments.trace is not None:
+            from rt_primer_design import metrics
+            options['tracer'] = metrics.Tracer(arguments.trace)
+            stack.callback(options['tracer'].close)
+        if arguments.templates is not None:
+            from rt_primer_design import thermo
+            options['templates'] = thermo.read_fasta(arguments.templates)
+        if arguments.specificity_index is not None:
+            from rt_primer_design import kmer_index
+            options['specificity_index'] = kmer_index.KmerIndex(
+                arguments.specificity_index)
+        html_archive = None
+        if arguments.archive is not None:
+            from rt_primer_design import archive
+            html_archive = archive.HtmlArchive(arguments.archive)
+            stack.callback(html_archive.close)
+
+        sink = sinks.CsvSink(
+            output,
+            html_directory=arguments.html_directory,
+            header=False,
+            archive=html_archive,
+            locally_verified=arguments.specificity_index is not None)
+        # CsvSink only writes a header to empty files, and stdout may be a
+        # pipe
+        if not arguments.no_header:
+            print(sink.header(), file=output, flush=True)
+        for blast_result in primer_blast.iter_primer_blast(
+                ref_seq_list=_read_in_thread(ids),
+                starting_parameters=starting_parameters,
+                wait_seconds=arguments.wait_seconds,
+                verbose=arguments.verbose,
+                n_jobs=arguments.n_jobs,
+                rate_limiter=rate_limit.TokenBucket(
+                    rate=arguments.rate, state_file=arguments.rate_state),
+                speculation=arguments.speculation,
+                sink=sink,
+                **options):
+            pass
+    return sink.written
+
+
+def main(argv=None):
+    """Entry point of the rt-primer-design command."""
+    arguments, starting_parameters = parse_arguments(argv)
+    if arguments.ids == '-':
+        id_file = contextlib.nullcontext(sys.stdin)
+    else:
+        id_file = open(arguments.ids)
+    # the engine prints its messages to stdout, which is kept for the CSV
+    output = sys.stdout
+    try:
+        with id_file as lines, contextlib.redirect_stdout(sys.stderr):
+            run(arguments, starting_parameters, read_ids(lines), output)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # e.g. piped into head; don't complain when stdout is closed
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
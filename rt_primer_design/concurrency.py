@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import collections
+import math
+import time
+
+
+############
+# PROVIDES #
+############
+
+class AdaptiveConcurrency:
+    """Adjust the number of genes in flight to how the server is coping.
+
+    The window of genes in flight is raised and lowered additive-increase,
+    multiplicative-decrease (AIMD) style, like a TCP congestion window. Every
+    interval seconds, update looks at the session, the rate limiter and the
+    poll scheduler of the run:
+
+    - If requests were retried or failed since the last update, e.g. HTTP
+      429 or 503 responses or timeouts, the server is throttling us.
+    - If the mean latency of the requests since the last update is more
+      than latency_tolerance times its median over the last history
+      updates, and rising, the server is slow to answer.
+    - If the expected "Running" time of the jobs of any relaxation step is
+      more than running_tolerance times its median over the last history
+      updates, and rising, jobs are queueing on the server.
+
+    On any of these the window is multiplied by decrease, at most once per
+    interval. Otherwise, if every place of the window is in use, it grows by
+    increase. The window never goes below minimum, nor above maximum or
+    rate_cap. By default, rate_cap is the number of genes the rate limiter
+    can poll once per mean poll interval: the mean expected running time of
+    the jobs of each status, from the poll scheduler, but at least its
+    minimum poll interval. More genes than that would only wait for the
+    rate limiter, so the NCBI usage limits hold whatever the window.
+
+    The controller is used like an asyncio.Semaphore by the engine, with
+    acquire and release, and is meant for one event loop.
+
+    Attributes:
+        window: the current window, as a float. The number of genes in
+            flight is at most int(window).
+        minimum: smallest window.
+        maximum: largest window, or None for no limit other than the rate
+            limiter's.
+        rate_cap: largest window allowed by the rate limiter, or None to
+            work it out from the rate limiter and the poll scheduler at each
+            update.
+        increase: number of genes added to the window per interval.
+        decrease: factor the window is multiplied by on congestion.
+        interval: seconds between updates.
+        latency_tolerance: see above.
+        running_tolerance: see above.
+        in_flight: number of genes holding a place.
+        limit: largest window allowed by maximum and the rate limiter at the
+            last update.
+        poll_interval: mean seconds between polls of a job the rate limiter's
+            cap was worked out with at the last update.
+        reason: why the window was held or lowered at the last update, e.g.
+            'throttled', 'latency', 'running' or 'rate_limit', or None.
+        increases: number of times the window was raised.
+        decreases: number of times the window was lowered.
+    """
+    def __init__(self, initial=10, minimum=1, maximum=None, increase=1,
+                 decrease=0.5, interval=10.0, latency_tolerance=2.0,
+                 running_tolerance=1.5, history=60, rate_cap=None):
+        """Init AdaptiveConcurrency.
+
+        Args:
+            initial: starting window.
+            minimum: smallest window.
+            maximum: largest window, or None.
+            increase: number of genes added to the window per interval.
+            decrease: factor the window is multiplied by on congestion,
+                between 0 and 1.
+            interval: seconds between updates.
+            latency_tolerance: how many times slower than usual requests can
+                get before the window is lowered.
+            running_tolerance: how many times longer than usual jobs can run
+                before the window is lowered.
+            history: number of updates the usual latency and running times
+                are taken over.
+            rate_cap: largest window allowed by the rate limiter. By
+                default, rate times the mean poll interval of the jobs.
+        """
+        if not 0 < decrease < 1:
+            raise ValueError(
+                'decrease must be between 0 and 1, got %r' % decrease)
+        self.minimum = max(1, minimum)
+        self.maximum = maximum
+        self.window = float(max(self.minimum, initial))
+        if maximum is not None:
+            self.window = min(self.window, maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.latency_tolerance = latency_tolerance
+        self.running_tolerance = running_tolerance
+        self.rate_cap = rate_cap
+        self.in_flight = 0
+        self.limit = maximum
+        self.poll_interval = None
+        self.reason = None
+        self.increases = 0
+        self.decreases = 0
+        self._waiters = collections.deque()
+        self._counters = None
+        self._latencies = collections.deque(maxlen=history)
+        self._durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=history))
+        self._last_increase = -math.inf
+        self._last_decrease = -math.inf
+
+    def _places(self):
+        """Number of genes allowed in flight."""
+        return max(self.minimum, int(self.window))
+
+    def locked(self):
+        """True if a gene would have to wait for a place."""
+        return self.in_flight >= self._places()
+
+    def _wake(self):
+        """Wake as many waiting genes as there are free places."""
+        free = self._places() - self.in_flight
+        for waiter in self._waiters:
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+            free -= 1
+
+    async def acquire(self):
+        """Wait for a place in the window and take it."""
+        while self.locked():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # pass the place on to the next gene
+                    self._waiters.remove(waiter)
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        """Give a place back."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _congested(self, values, value, tolerance):
+        """Tell if value is more than tolerance times the median of values
+        and higher than the previous value, then add it to values."""
+        if value is None:
+            return False
+        usual = sorted(values)[len(values) // 2] if values else None
+        previous = values[-1] if values else None
+        values.append(value)
+        if len(values) < 4:
+            return False
+        return value > tolerance * usual and value > previous
+
+    def update(self, session, rate_limiter, poll_scheduler, now=None,
+               backlog=None):
+        """Raise or lower the window from the state of the run.
+
+        Args:
+            session: the session.BlastSession of the run.
+            rate_limiter: the rate_limit.TokenBucket of the run.
+            poll_scheduler: the scheduler.PollScheduler of the run.
+            now: time.monotonic(), for tests.
+            backlog: the backlog of rate_limiter in seconds, if it has
+                already been read. By default, rate_limiter.backlog() is
+                called.
+
+        Returns:
+            The new window.
+        """
+        if now is None:
+            now = time.monotonic()
+        if backlog is None:
+            backlog = rate_limiter.backlog()
+        session_stats = session.stats()
+        counters = (session_stats['requests'],
+                    session_stats['retried'] + session_stats['failed'],
+                    session_stats['latency_seconds'])
+        if self._counters is None:
+            self._counters = counters
+        requests, errors, latency_seconds = (
+            x - y for x, y in zip(counters, self._counters))
+        self._counters = counters
+
+        reason = None
+        if errors > 0:
+            reason = 'throttled'
+        # the mean latency of the requests since the last update
+        latency = latency_seconds / requests if requests else None
+        if self._congested(self._latencies, latency,
+                           self.latency_tolerance) and reason is None:
+            reason = 'latency'
+        # expected running times move slowly, so they only count while they
+        # are still rising
+        expected = poll_scheduler.stats()['expected_duration']
+        for status, duration in sorted(expected.items()):
+            if self._congested(self._durations[status], duration,
+                               self.running_tolerance) and reason is None:
+                reason = 'running'
+
+        # genes beyond what the rate limiter can poll once per poll
+        # interval would only queue for tokens. Jobs are polled when they
+        # are expected to finish, so the interval is their running time
+        intervals = [max(poll_scheduler.min_interval, x)
+                     for x in expected.values() if x is not None]
+        self.poll_interval = poll_scheduler.min_interval
+        if intervals:
+            self.poll_interval = sum(intervals) / len(intervals)
+        rate_cap = self.rate_cap
+        if rate_cap is None:
+            rate_cap = math.ceil(rate_limiter.rate * self.poll_interval)
+        self.limit = self.maximum
+        if self.limit is None or rate_cap < self.limit:
+            self.limit = max(self.minimum, rate_cap)
+
+        if reason is not None:
+            if now - self._last_decrease >= self.interval:
+                self.window = max(self.minimum, self.window * self.decrease)
+                self._last_decrease = now
+                self.decreases += 1
+        elif backlog >= poll_scheduler.min_interval:
+            reason = 'rate_limit'
+        elif (self.locked() and self.window < self.limit and
+              now - self._last_increase >= self.interval and
+              now - self._last_decrease >= self.interval):
+            self.window += self.increase
+            self._last_increase = now
+            self.increases += 1
+        self.window = max(self.minimum, min(self.window, self.limit))
+        self.reason = reason
+        self._wake()
+        return self.window
+
+    async def async_update(self, session, rate_limiter, poll_scheduler):
+        """Async twin of update.
+
+        The backlog of a shared rate limiter is read in the default
+        executor, so that waiting for its lock doesn't stall the event loop.
+        """
+        backlog = await rate_limiter.async_backlog()
+        return self.update(
+            session, rate_limiter, poll_scheduler, backlog=backlog)
+
+    def stats(self):
+        """The state of the controller.
+
+        Returns:
+            A dict with keys window, in_flight, waiting, limit,
+            poll_interval, reason, increases and decreases.
+        """
+        return {
+            'window': self.window,
+            'in_flight': self.in_flight,
+            'waiting': sum(not x.done() for x in self._waiters),
+            'limit': self.limit,
+            'poll_interval': self.poll_interval,
+            'reason': self.reason,
+            'increases': self.increases,
+            'decreases': self.decreases}
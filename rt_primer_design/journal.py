@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import json
+import os
+import threading
+import time
+from rt_primer_design.cache import parameter_hash
+
+
+############
+# PROVIDES #
+############
+
+class Journal:
+    """Write-ahead journal of a primer-BLAST run, for resuming after a crash.
+
+    The journal is an append-only file of JSON lines. Each relaxation step of
+    each gene is recorded when its BLAST query is submitted (with the
+    job_key) and when it has finished (with the parsed result), and each gene
+    is recorded when it is done. Every line is flushed and synced to disk
+    before the run carries on.
+
+    When a Journal is opened on an existing file the entries are replayed, so
+    that run_primer_blast can resume polling job_keys that were submitted
+    before the crash and skip steps and genes that had already finished.
+    A step whose job_key has expired in the meantime is dropped from the
+    journal and submitted again, and a speculative step that was cancelled
+    because a stricter step succeeded is recorded as cancelled, so that its
+    abandoned job isn't polled.
+
+    Steps are identified by ref_seq, the hash of the blast_parameters they
+    were started with, and status. Genes are identified by ref_seq and the
+    hash of their starting_parameters, so a gene that is run again with
+    other parameters isn't skipped.
+
+    Attributes:
+        path: path to the journal file.
+        steps: dict of the latest entry for each step.
+        genes: dict of the result record for each finished gene, by ref_seq
+            and parameter hash.
+    """
+    def __init__(self, path):
+        """Init Journal, replaying the entries in path if it exists.
+
+        Args:
+            path: path to the journal file.
+        """
+        self.path = path
+        self.steps = {}
+        self.genes = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._replay()
+        self._file = open(path, 'a')
+
+    def _replay(self):
+        """Load the entries in self.path."""
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line is incomplete if we crashed mid-write
+                    continue
+                if entry['event'] == 'gene_done':
+                    key = (entry['ref_seq'], entry.get('key'))
+                    self.genes[key] = entry['record']
+                    continue
+                key = (entry['ref_seq'], entry['key'], entry['status'])
+                if entry['event'] in ('dropped', 'cancelled'):
+                    self.steps.pop(key, None)
+                else:
+                    self.steps[key] = entry
+
+    def _write(self, entry):
+        """Append entry to the journal and sync it to disk."""
+        entry['time'] = time.time()
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _step_entry(self, event, ref_seq, blast_parameters, status):
+        """Start a new entry for a step and make it the latest one."""
+        entry = {
+            'event': event,
+            'ref_seq': ref_seq,
+            'key': parameter_hash(blast_parameters),
+            'status': status}
+        self.steps[(ref_seq, entry['key'], status)] = entry
+        return entry
+
+    def step(self, ref_seq, blast_parameters, status):
+        """Return the latest entry for a step, or None.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the step was started with.
+            status: the status of the primer set, e.g. 'strict'.
+
+        Returns:
+            A dict with key 'event', which is either 'submitted' (with keys
+            job_key and blast_parameters) or 'finished' (with key record).
+        """
+        return self.steps.get(
+            (ref_seq, parameter_hash(blast_parameters), status))
+
+    def gene(self, ref_seq, starting_parameters):
+        """Return the result record for a finished gene, or None.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            starting_parameters: the parameters the gene was started with.
+        """
+        return self.genes.get((ref_seq, parameter_hash(starting_parameters)))
+
+    def record_submitted(self, ref_seq, blast_parameters, status,
+                         blast_result):
+        """Record that a BLAST query for a step has been submitted.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the step was started with.
+            status: the status of the primer set, e.g. 'strict'.
+            blast_result: the submitted PrimerBlastResult.
+        """
+        entry = self._step_entry(
+            'submitted', ref_seq, blast_parameters, status)
+        entry['job_key'] = blast_result.job_key
+        entry['blast_parameters'] = blast_result.blast_parameters
+        self._write(entry)
+
+    def record_finished(self, ref_seq, blast_parameters, status,
+                        blast_result):
+        """Record the result of a finished step.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the step was started with.
+            status: the status of the primer set, e.g. 'strict'.
+            blast_result: the finished PrimerBlastResult.
+        """
+        entry = self._step_entry('finished', ref_seq, blast_parameters, status)
+        entry['record'] = blast_result.to_record()
+        self._write(entry)
+
+    def drop_step(self, ref_seq, blast_parameters, status):
+        """Forget a submitted step, e.g. because its job_key has expired,
+        so that it is submitted again.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the step was started with.
+            status: the status of the primer set, e.g. 'strict'.
+        """
+        key = (ref_seq, parameter_hash(blast_parameters), status)
+        self.steps.pop(key, None)
+        self._write({
+            'event': 'dropped',
+            'ref_seq': ref_seq,
+            'key': key[1],
+            'status': status})
+
+    def cancel_step(self, ref_seq, blast_parameters, status):
+        """Record that a submitted step was cancelled, e.g. a speculative
+        step made unnecessary by a stricter one, so that a resumed run
+        doesn't poll its job.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            blast_parameters: the parameters the step was started with.
+            status: the status of the primer set, e.g. 'strict'.
+        """
+        key = (ref_seq, parameter_hash(blast_parameters), status)
+        self.steps.pop(key, None)
+        self._write({
+            'event': 'cancelled',
+            'ref_seq': ref_seq,
+            'key': key[1],
+            'status': status})
+
+    def record_gene(self, blast_result, starting_parameters):
+        """Record the final result for a gene.
+
+        Args:
+            blast_result: the PrimerBlastResult returned by
+                iterate_primer_blast.
+            starting_parameters: the parameters the gene was started with.
+        """
+        record = blast_result.to_record()
+        key = parameter_hash(starting_parameters)
+        self.genes[(blast_result.ref_seq, key)] = record
+        self._write({
+            'event': 'gene_done',
+            'ref_seq': blast_result.ref_seq,
+            'key': key,
+            'record': record})
+
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import json
+import numpy
+import os
+from rt_primer_design import thermo
+
+
+############
+# PROVIDES #
+############
+
+# bases of padding around each sequence, so that primer sites near the ends
+# can be compared without going out of bounds
+_PADDING = 64
+_FILES = ('kmers.npy', 'positions.npy', 'sequence.npy', 'offsets.npy')
+
+
+def _accession(name):
+    """The accession of a sequence name without its version."""
+    return name.split('.')[0]
+
+
+def _reverse_complement(sequence):
+    """The reverse complement of a DNA sequence."""
+    return sequence.upper()[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+def _kmer_codes(bases, k):
+    """2-bit codes of every k-mer of an encoded sequence.
+
+    Returns:
+        A tuple of (codes, valid). valid is False for k-mers with a base
+        other than A, C, G or T.
+    """
+    count = len(bases) - k + 1
+    if count <= 0:
+        return (numpy.zeros(0, dtype=numpy.uint32),
+                numpy.zeros(0, dtype=bool))
+    codes = numpy.zeros(count, dtype=numpy.uint32)
+    invalid = numpy.concatenate([[0], numpy.cumsum(bases > 3)])
+    for offset in range(k):
+        codes <<= numpy.uint32(2)
+        codes |= (bases[offset:offset + count] & 3).astype(numpy.uint32)
+    return codes, invalid[k:] - invalid[:-k] == 0
+
+
+class KmerIndex:
+    """Memory-mapped k-mer index of a transcriptome, for checking primers
+    for off-target products locally.
+
+    The index is built once from a FASTA file with KmerIndex.build, and
+    stored in a directory of numpy arrays. Opening it maps the arrays into
+    memory, so it loads instantly and several processes can share it.
+    Building it takes about 30 bytes of RAM per base of the FASTA file, i.e.
+    several GB for a full transcriptome, e.g. over 10 GB for a mammalian
+    RefSeq transcriptome.
+
+    A primer is taken to bind a site if the k bases at its 3' end match the
+    site exactly and there are at most max_mismatches mismatches over the
+    whole primer. A pair of sites on the same sequence, facing each other
+    and no more than max_product_size bases apart, is a product. Either
+    primer of a pair can bind at either end of a product.
+
+    Attributes:
+        path: directory of the index.
+        k: length of the k-mers, at most 16.
+        names: names of the indexed sequences.
+    """
+    def __init__(self, path):
+        """Open an index built by KmerIndex.build.
+
+        Args:
+            path: directory of the index.
+        """
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as index_file:
+            index = json.load(index_file)
+        self.k = index['k']
+        self.names = index['names']
+        self._kmers, self._positions, self._sequence, self._offsets = (
+            numpy.load(os.path.join(path, x), mmap_mode='r') for x in _FILES)
+
+    @classmethod
+    def build(cls, fasta_file, path, k=12):
+        """Build an index of the sequences in fasta_file.
+
+        The whole transcriptome is encoded and sorted in memory, which
+        takes about 30 bytes of RAM per base, so a full transcriptome needs
+        several GB.
+
+        Args:
+            fasta_file: path to a FASTA file, e.g. a RefSeq transcriptome.
+            path: directory to write the index to. It is created if it
+                doesn't exist.
+            k: length of the k-mers, at most 16. This is the number of bases
+                at the 3' end of a primer that must match a site exactly.
+
+        Returns:
+            The new KmerIndex.
+        """
+        if not 0 < k <= 16:
+            raise ValueError('k must be between 1 and 16, not %s' % k)
+        names = []
+        chunks = [numpy.full(_PADDING, 4, dtype=numpy.uint8)]
+        offsets = []
+        length = _PADDING
+        for name, sequence in thermo.iter_fasta(fasta_file):
+            names.append(name)
+            offsets.append(length)
+            chunks.append(thermo.encode(sequence))
+            chunks.append(numpy.full(_PADDING, 4, dtype=numpy.uint8))
+            length += len(sequence) + _PADDING
+        sequence = numpy.concatenate(chunks)
+        del chunks
+
+        codes, valid = _kmer_codes(sequence, k)
+        positions = numpy.flatnonzero(valid)
+        if len(sequence) < 2 ** 32:
+            positions = positions.astype(numpy.uint32)
+        codes = codes[positions]
+        order = numpy.argsort(codes, kind='stable')
+
+        os.makedirs(path, exist_ok=True)
+        for file_name, array in zip(_FILES, (
+                codes[order], positions[order], sequence,
+                numpy.array(offsets, dtype=numpy.int64))):
+            numpy.save(os.path.join(path, file_name), array)
+        with open(os.path.join(path, 'index.json'), 'w') as index_file:
+            json.dump({'k': k, 'names': names}, index_file)
+        return cls(path)
+
+    def _sites(self, primer, max_mismatches):
+        """Binding sites of primer.
+
+        Returns:
+            A tuple of (forward, reverse) arrays. forward holds the start of
+            each site where primer matches the plus strand, and reverse the
+            start of each site where it matches the minus strand, both as
+            positions in the concatenated sequence.
+        """
+        primer = primer.upper()
+        length = len(primer)
+        if not self.k <= length <= _PADDING:
+            raise ValueError(
+                'Primer %s must be between %d and %d bases long' %
+                (primer, self.k, _PADDING))
+        sites = []
+        for site, anchor in ((primer, length - self.k),
+                             (_reverse_complement(primer), 0)):
+            bases = thermo.encode(site)
+            code, valid = _kmer_codes(bases[anchor:anchor + self.k], self.k)
+            if not valid[0]:
+                sites.append(numpy.zeros(0, dtype=numpy.int64))
+                continue
+            low = numpy.searchsorted(self._kmers, code[0], side='left')
+            high = numpy.searchsorted(self._kmers, code[0], side='right')
+            starts = self._positions[low:high].astype(numpy.int64) - anchor
+            if len(starts):
+                # compare the whole primer with each hit. Bases in the
+                # padding never match, so sites can't run off a sequence.
+                window = self._sequence[
+                    starts[:, None] + numpy.arange(length)]
+                mismatches = numpy.count_nonzero(window != bases, axis=1)
+                starts = starts[mismatches <= max_mismatches]
+            sites.append(numpy.sort(starts))
+        return tuple(sites)
+
+    def products(self, F, R, max_product_size=4000, max_mismatches=2):
+        """Find the products a primer pair could amplify.
+
+        Args:
+            F: forward primer sequence.
+            R: reverse primer sequence.
+            max_product_size: largest product to report.
+            max_mismatches: largest number of mismatches between a primer
+                and a site it binds.
+
+        Returns:
+            A list of (name, start, end) tuples, with name the sequence the
+            product is on, and start and end 0-based positions on it.
+        """
+        F_sites = self._sites(F, max_mismatches)
+        R_sites = self._sites(R, max_mismatches)
+        products = set()
+        for forward in (F_sites[0], R_sites[0]):
+            for reverse, other in ((F_sites[1], F), (R_sites[1], R)):
+                if not len(forward) or not len(reverse):
+                    continue
+                # the first reverse site at or after each forward site, and
+                # every site after it within max_product_size
+                first = numpy.searchsorted(reverse, forward, side='left')
+                last = numpy.searchsorted(
+                    reverse, forward + max_product_size - len(other),
+                    side='right')
+                for start, low, high in zip(forward, first, last):
+                    for site in reverse[low:high]:
+                        products.add((int(start), int(site) + len(other)))
+        found = []
+        for start, end in sorted(products):
+            sequence = numpy.searchsorted(
+                self._offsets, start, side='right') - 1
+            if sequence != numpy.searchsorted(
+                    self._offsets, end - 1, side='right') - 1:
+                # the sites are on different sequences
+                continue
+            offset = int(self._offsets[sequence])
+            found.append((self.names[sequence], start - offset, end - offset))
+        return found
+
+    def off_targets(self, F, R, intended=(), max_product_size=4000,
+                    max_mismatches=2):
+        """Find the products of a primer pair on unintended sequences.
+
+        Args:
+            F: forward primer sequence.
+            R: reverse primer sequence.
+            intended: names of the sequences the pair is meant to amplify,
+                e.g. the template and its similar templates. Versions are
+                ignored.
+            max_product_size: passed to products.
+            max_mismatches: passed to products.
+
+        Returns:
+            A list of (name, start, end) tuples, as products returns.
+        """
+        intended = {_accession(x) for x in intended}
+        return [product for product in self.products(
+                    F, R, max_product_size, max_mismatches)
+                if _accession(product[0]) not in intended]
+
+    def specific_pairs(self, pairs, intended=(), max_product_size=4000,
+                       max_mismatches=2):
+        """Pick the primer pairs without off-target products.
+
+        Args:
+            pairs: a list of primers.PrimerPair, e.g. from a results page.
+            intended: passed to off_targets.
+            max_product_size: passed to off_targets.
+            max_mismatches: passed to off_targets.
+
+        Returns:
+            A list of the pairs that have no off-target products, in the
+            same order.
+        """
+        return [pair for pair in pairs if pair.F and pair.R and
+                not self.off_targets(pair.F, pair.R, intended,
+                                     max_product_size, max_mismatches)]
+
+    def stats(self):
+        """Size of the index.
+
+        Returns:
+            A dict with keys sequences, bases and kmers.
+        """
+        return {
+            'sequences': len(self.names),
+            'bases': int(len(self._sequence) -
+                         _PADDING * (len(self.names) + 1)),
+            'kmers': len(self._kmers)}
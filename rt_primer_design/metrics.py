@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+
+
+############
+# PROVIDES #
+############
+
+PHASES = ('submit', 'queue', 'backoff', 'sleep', 'poll', 'parse',
+          'similar_templates')
+
+
+class StepTrace:
+    """Timings and counts for one relaxation step of one gene.
+
+    Phases:
+        submit: submitting BLAST queries, excluding queue and backoff.
+        queue: waiting for the rate limiter.
+        backoff: waiting to retry failed requests and submissions.
+        sleep: waiting between polls.
+        poll: polling running jobs, excluding queue and backoff.
+        parse: checking the finished page and parsing the primers.
+        similar_templates: re-submitting the query for similar templates,
+            excluding queue and backoff.
+
+    Attributes:
+        ref_seq: RefSeq sequence ID.
+        status: the status of the step, e.g. 'strict'.
+        phases: dict of seconds spent in each phase.
+        counts: dict of event counts, e.g. polls, submissions and requests.
+    """
+    def __init__(self, tracer, ref_seq, status):
+        """Init StepTrace. Use Tracer.step instead."""
+        self._tracer = tracer
+        self.ref_seq = ref_seq
+        self.status = status
+        self.phases = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self._started = time.monotonic()
+
+    @contextlib.contextmanager
+    def phase(self, name, blast_result=None, profile=False):
+        """Time a phase.
+
+        Args:
+            name: the phase, one of PHASES.
+            blast_result: the PrimerBlastResult making requests in this
+                phase, if any. Its rate limiter queueing and backoff are
+                booked to the queue and backoff phases, and its requests are
+                counted.
+            profile: if True, and the tracer is profiling, run the phase
+                under cProfile.
+        """
+        timings = _timings(blast_result)
+        start = time.monotonic()
+        profiler = self._tracer._profiler if profile else None
+        if profiler is not None:
+            self._tracer._profile_lock.acquire()
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._tracer._profile_lock.release()
+            elapsed = time.monotonic() - start
+            if timings is not None:
+                after = _timings(blast_result)
+                queued = after['queued'] - timings['queued']
+                backoff = after['backoff'] - timings['backoff']
+                self.phases['queue'] += queued
+                self.phases['backoff'] += backoff
+                self.counts['requests'] += (
+                    after['requests'] - timings['requests'])
+                elapsed -= queued + backoff
+            self.phases[name] += max(0.0, elapsed)
+
+    def count(self, name, n=1):
+        """Count n events called name."""
+        self.counts[name] += n
+
+    def finish(self, outcome):
+        """Record the step with the tracer.
+
+        Args:
+            outcome: how the step ended, e.g. 'primers', 'no_primers',
+                'off_targets', 'cached' or 'journal'.
+        """
+        self._tracer._finish_step(self, outcome)
+
+
+def _timings(blast_result):
+    """A copy of the request timings of blast_result, or None."""
+    if blast_result is None:
+        return None
+    return dict(blast_result.request_timings)
+
+
+class Tracer:
+    """Collect per-gene and per-step timings of a primer-BLAST run.
+
+    Each finished step and gene is added to running totals by status, and
+    written as a line of JSON to jsonl_file if it is given. The totals can
+    be exported as a Prometheus text snapshot with prometheus_text or
+    write_prometheus.
+
+    If profile is True, the parse phase runs under cProfile, and the
+    accumulated profile is available from profile_stats and dump_profile.
+
+    Attributes:
+        jsonl_file: path to the JSON-lines file, or None.
+        profile: True if the parse phase is profiled.
+        phase_seconds: dict of total seconds by (status, phase).
+        event_counts: dict of total counts by (status, event).
+        step_outcomes: dict of number of steps by (status, outcome).
+        gene_statuses: dict of number of genes by final status.
+        gene_seconds: total wall-clock seconds of the finished genes.
+        gauges: dict of (value, help text) by name, for values that go up
+            and down, e.g. the concurrency window.
+    """
+    def __init__(self, jsonl_file=None, profile=False):
+        """Init Tracer.
+
+        Args:
+            jsonl_file: path to append the trace to as JSON lines.
+            profile: if True, profile the parse phase with cProfile.
+        """
+        self.jsonl_file = jsonl_file
+        self.profile = profile
+        self.phase_seconds = collections.defaultdict(float)
+        self.event_counts = collections.defaultdict(int)
+        self.step_outcomes = collections.defaultdict(int)
+        self.gene_statuses = collections.defaultdict(int)
+        self.gene_seconds = 0.0
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._file = open(jsonl_file, 'a') if jsonl_file else None
+        self._profiler = cProfile.Profile() if profile else None
+        self._profile_lock = threading.Lock()
+
+    def step(self, ref_seq, status):
+        """Start tracing a step.
+
+        Returns:
+            A StepTrace.
+        """
+        return StepTrace(self, ref_seq, status)
+
+    def _write(self, entry):
+        """Append entry to the JSON-lines file, if there is one."""
+        if self._file is None:
+            return
+        entry['time'] = time.time()
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def _finish_step(self, step_trace, outcome):
+        """Add a finished step to the totals."""
+        seconds = time.monotonic() - step_trace._started
+        with self._lock:
+            for phase, phase_seconds in step_trace.phases.items():
+                self.phase_seconds[(step_trace.status, phase)] += phase_seconds
+            for event, count in step_trace.counts.items():
+                self.event_counts[(step_trace.status, event)] += count
+            self.step_outcomes[(step_trace.status, outcome)] += 1
+            self._write({
+                'event': 'step',
+                'ref_seq': step_trace.ref_seq,
+                'status': step_trace.status,
+                'outcome': outcome,
+                'seconds': seconds,
+                'phases': dict(step_trace.phases),
+                'counts': dict(step_trace.counts)})
+
+    def record_gene(self, ref_seq, status, seconds, steps):
+        """Add a finished gene to the totals.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the final status of the gene.
+            seconds: wall-clock seconds the gene took.
+            steps: number of relaxation steps run for the gene, or None if
+                it was given up.
+        """
+        with self._lock:
+            self.gene_statuses[status] += 1
+            self.gene_seconds += seconds
+            self._write({
+                'event': 'gene',
+                'ref_seq': ref_seq,
+                'status': status,
+                'seconds': seconds,
+                'steps': steps})
+
+    def set_gauge(self, name, value, help_text=''):
+        """Set a gauge, and trace the new value if it changed.
+
+        Args:
+            name: name of the gauge, e.g. 'concurrency_window'.
+            value: the current value.
+            help_text: description for prometheus_text.
+        """
+        with self._lock:
+            previous = self.gauges.get(name, (None,))[0]
+            self.gauges[name] = (value, help_text)
+            if value != previous:
+                self._write({
+                    'event': 'gauge',
+                    'name': name,
+                    'value': value})
+
+    def stats(self):
+        """The totals as a dict.
+
+        Returns:
+            A dict with keys genes, gene_seconds, phase_seconds (a dict of
+            seconds by phase) and events (a dict of counts by event), summed
+            over all statuses, and gauges (a dict of values by name).
+        """
+        with self._lock:
+            phases = collections.defaultdict(float)
+            for (status, phase), seconds in self.phase_seconds.items():
+                phases[phase] += seconds
+            events = collections.defaultdict(int)
+            for (status, event), count in self.event_counts.items():
+                events[event] += count
+            return {
+                'genes': sum(self.gene_statuses.values()),
+                'gene_seconds': self.gene_seconds,
+                'phase_seconds': dict(phases),
+                'events': dict(events),
+                'gauges': {x: y[0] for x, y in self.gauges.items()}}
+
+    def prometheus_text(self, prefix='rt_primer_design'):
+        """The totals in the Prometheus text exposition format.
+
+        Args:
+            prefix: prefix of the metric names.
+
+        Returns:
+            A str.
+        """
+        lines = []
+
+        def metric(name, help_text, kind, samples):
+            name = '%s_%s' % (prefix, name)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                label_text = ','.join(
+                    '%s="%s"' % (key, _escape_label(value))
+                    for key, value in labels)
+                if label_text:
+                    lines.append('%s{%s} %s' % (name, label_text, value))
+                else:
+                    lines.append('%s %s' % (name, value))
+
+        with self._lock:
+            metric(
+                'phase_seconds_total',
+                'Seconds spent in each phase of the relaxation steps.',
+                'counter',
+                [((('status', status), ('phase', phase)), seconds)
+                 for (status, phase), seconds
+                 in sorted(self.phase_seconds.items())])
+            metric(
+                'step_events_total',
+                'Polls, submissions and requests of the relaxation steps.',
+                'counter',
+                [((('status', status), ('event', event)), count)
+                 for (status, event), count
+                 in sorted(self.event_counts.items())])
+            metric(
+                'steps_total',
+                'Finished relaxation steps by outcome.',
+                'counter',
+                [((('status', status), ('outcome', outcome)), count)
+                 for (status, outcome), count
+                 in sorted(self.step_outcomes.items())])
+            metric(
+                'genes_total',
+                'Finished genes by final status.',
+                'counter',
+                [((('status', status),), count)
+                 for status, count in sorted(self.gene_statuses.items())])
+            metric(
+                'gene_seconds_total',
+                'Wall-clock seconds of the finished genes.',
+                'counter',
+                [((), self.gene_seconds)])
+            for name, (value, help_text) in sorted(self.gauges.items()):
+                metric(name, help_text, 'gauge', [((), value)])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='rt_primer_design'):
+        """Write prometheus_text to path, replacing it atomically.
+
+        Suitable for the node_exporter textfile collector.
+        """
+        temporary_path = '%s.%i.tmp' % (path, os.getpid())
+        with open(temporary_path, 'w') as prometheus_file:
+            prometheus_file.write(self.prometheus_text(prefix))
+        os.replace(temporary_path, path)
+
+    def profile_stats(self):
+        """The accumulated profile of the parse phase as pstats.Stats, or
+        None if profiling is off."""
+        if self._profiler is None:
+            return None
+        with self._profile_lock:
+            return pstats.Stats(self._profiler)
+
+    def dump_profile(self, path):
+        """Write the accumulated profile of the parse phase to path, for
+        pstats or snakeviz."""
+        with self._profile_lock:
+            self._profiler.dump_stats(path)
+
+    def close(self):
+        """Close the JSON-lines file."""
+        if self._file is not None:
+            self._file.close()
+
+
+def _escape_label(value):
+    """Escape a Prometheus label value."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
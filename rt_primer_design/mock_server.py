@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import http.server
+import itertools
+import os
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+from rt_primer_design import backends
+
+
+############
+# PROVIDES #
+############
+
+# the kinds of page the server returns, besides 'running'
+PAGE_KINDS = ('success', 'no_primers', 'off_targets', 'no_intron',
+              'similar_templates')
+
+# share of genes whose strict query gives each kind of page, in percent
+DEFAULT_MIX = (
+    ('success', 50),
+    ('no_primers', 20),
+    ('off_targets', 15),
+    ('no_intron', 10),
+    ('similar_templates', 5))
+
+# replaced by the job_key in every page, including recorded ones
+JOB_KEY_MARKER = b'@JOB_KEY@'
+
+_RUNNING = (
+    b'<html><head><title>Primer-BLAST</title></head><body>'
+    b'<div id="breadcrumb">Primer-BLAST: Job id=@JOB_KEY@</div>'
+    b'<input type="hidden" name="job_key" value="@JOB_KEY@">'
+    b'<table><tr class="odd"><td>Running</td></tr></table>'
+    b'</body></html>')
+
+_PAIR = (
+    b'<div class="prPairInfo"><h2>Primer pair %d</h2>'
+    b'<table class="prPairDtl">'
+    b'<tr><th></th><th>Sequence (5\'->3\')</th><th>Template strand</th>'
+    b'<th>Length</th><th>Start</th><th>Stop</th><th>Tm</th><th>GC%%</th>'
+    b'<th>Self complementarity</th><th>Self 3\' complementarity</th></tr>'
+    b'<tr><th>Forward primer</th><td>%s</td><td>Plus</td><td>20</td>'
+    b'<td>%d</td><td>%d</td><td>60.%02d</td><td>50.00</td><td>4.00</td>'
+    b'<td>2.00</td></tr>'
+    b'<tr><th>Reverse primer</th><td>%s</td><td>Minus</td><td>20</td>'
+    b'<td>%d</td><td>%d</td><td>59.%02d</td><td>50.00</td><td>5.00</td>'
+    b'<td>1.00</td></tr>'
+    b'<tr><th>Product length</th><td>%d</td></tr>'
+    b'<tr><th>Total intron size</th><td>850</td></tr>'
+    b'</table></div>')
+
+
+def _finished_page(param_summary, info=b'', pairs=5, padding=0):
+    """A synthetic finished page with primer pairs."""
+    body = [
+        b'<html><head><title>Primer-BLAST results</title>'
+        b'<link rel="stylesheet" href="css/primer-blast.css"></head><body>',
+        b'<div id="breadcrumb">Primer-BLAST: Job id=@JOB_KEY@</div>',
+        b'<div class="paramSummary">Specificity of primers: %s</div>'
+        % param_summary,
+        info]
+    bases = b'ACGT'
+    for rank in range(1, pairs + 1):
+        forward = bytes(bases[(rank * x) % 4] for x in range(20))
+        reverse = bytes(bases[(rank * x + 1) % 4] for x in range(20))
+        start = 100 * rank
+        body.append(_PAIR % (
+            rank, forward, start, start + 19, rank, reverse,
+            start + 180, start + 161, rank, 181))
+    if padding:
+        # stands in for the graphics and alignments of a real page
+        body.append(b'<div class="graphics">%s</div>' % (b'x' * padding))
+    body.append(b'</body></html>')
+    return b''.join(body)
+
+
+def synthetic_pages(padding=0):
+    """Synthetic primer-BLAST pages of every kind, with the markers that
+    scanner.scan_page and primers.parse_primer_pairs look for.
+
+    Args:
+        padding: bytes of filler added to finished pages, to bring them
+            closer to the size of real pages.
+
+    Returns:
+        A dict of page bytes keyed by 'running' and the items of
+        PAGE_KINDS.
+    """
+    return {
+        'running': _RUNNING,
+        'success': _finished_page(
+            b'primers are specific', padding=padding),
+        'no_primers': (
+            b'<html><body><div id="breadcrumb">Job id=@JOB_KEY@</div>'
+            b'<p class="info">No primers were found. Please loosen the '
+            b'selection criteria.</p></body></html>'),
+        'off_targets': _finished_page(
+            b'primer pairs may not be specific to the input template',
+            padding=padding),
+        'no_intron': _finished_page(
+            b'primers are specific',
+            info=(b'<p class="info">Exon-exon junction cannot be found on '
+                  b'the template.</p>'),
+            padding=padding),
+        'similar_templates': (
+            b'<html><body><div id="breadcrumb">Job id=@JOB_KEY@</div>'
+            b'<div id="expl">Your PCR template is highly similar to the '
+            b'following sequence(s) @USER_SEQLOC@</div></body></html>')}
+
+
+def load_pages(directory, padding=0):
+    """Load recorded pages from directory.
+
+    Pages are read from files named after their kind, e.g. 'success.html'
+    or 'running.html'. Kinds without a file get the synthetic page. In
+    recorded pages, the job_key and the USER_SEQLOC checkboxes should be
+    replaced by the markers '@JOB_KEY@' and '@USER_SEQLOC@', so that the
+    server can fill them in.
+
+    Args:
+        directory: directory of recorded pages.
+        padding: passed to synthetic_pages.
+
+    Returns:
+        A dict of page bytes, as synthetic_pages returns.
+    """
+    pages = synthetic_pages(padding)
+    for kind in ('running',) + PAGE_KINDS:
+        path = os.path.join(directory, kind + '.html')
+        if os.path.exists(path):
+            with open(path, 'rb') as page:
+                pages[kind] = page.read()
+    return pages
+
+
+def _share(ref_seq, mix):
+    """The kind of gene ref_seq is, picked from mix by a hash of its
+    accession, so that every run treats a gene the same way."""
+    point = zlib.crc32(ref_seq.split('.')[0].encode()) % sum(
+        share for kind, share in mix)
+    for kind, share in mix:
+        if point < share:
+            return kind
+        point -= share
+    return mix[-1][0]
+
+
+def default_scenario(ref_seq, blast_parameters, mix=DEFAULT_MIX):
+    """Pick the page for a query.
+
+    Each gene is given a kind from mix. Its strict query gets the page of
+    that kind, and relaxed queries succeed once the relaxation that fixes
+    it has been applied:
+
+    - no_primers: once GC_CLAMP is '0'
+    - off_targets: once PRIMER_MIN_GC is '35' (relaxed GC content)
+    - no_intron: once SPAN_INTRON is dropped
+    - similar_templates: once USER_SEQLOC is filled in
+
+    Args:
+        ref_seq: the INPUT_SEQUENCE of the query.
+        blast_parameters: the parameters of the query, as str.
+        mix: sequence of (kind, share) pairs.
+
+    Returns:
+        One of PAGE_KINDS.
+    """
+    kind = _share(ref_seq, mix)
+    if kind == 'no_primers' and blast_parameters.get('GC_CLAMP') != '0':
+        return kind
+    if (kind == 'off_targets' and
+            blast_parameters.get('PRIMER_MIN_GC') != '35'):
+        return kind
+    if kind == 'no_intron' and 'SPAN_INTRON' in blast_parameters:
+        return kind
+    if (kind == 'similar_templates' and
+            'USER_SEQLOC' not in blast_parameters):
+        return kind
+    return 'success'
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serve GET requests to the mock primertool.cgi."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.mock.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockPrimerBlastServer:
+    """Local stand-in for the primer-BLAST server, for load tests and
+    benchmarks.
+
+    The server accepts the same GET requests as primertool.cgi. A submit
+    (a request with INPUT_SEQUENCE) returns a running page with a new
+    job_key, and polls of the job_key return the running page until
+    job_seconds have passed, then the finished page picked by scenario.
+    Pages are synthetic, or replayed from recorded pages (see load_pages).
+
+    Each request is delayed by a random time around latency, and fails with
+    HTTP 503 with probability error_rate.
+
+    Use as a context manager, or call start and stop:
+
+        with MockPrimerBlastServer(latency=0.05) as server:
+            multiple_primer_blast(..., backend=server.backend())
+
+    Attributes:
+        latency: mean delay of each response in seconds.
+        error_rate: probability that a request fails with HTTP 503.
+        job_seconds: time a job runs before its page is finished.
+        pages: dict of page bytes by kind.
+        scenario: function that takes ref_seq and the query parameters and
+            returns the kind of the finished page.
+        counts: dict of the number of requests, submissions, polls and
+            errors served.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0,
+                 error_rate=0.0, job_seconds=0.0, pages=None, scenario=None,
+                 padding=0, seed=None):
+        """Init MockPrimerBlastServer.
+
+        Args:
+            host: address to listen on.
+            port: port to listen on. 0 picks a free port.
+            latency: mean delay of each response in seconds. Delays are
+                uniform between 0.5 and 1.5 times latency.
+            error_rate: probability that a request fails with HTTP 503.
+            job_seconds: time a job runs before its page is finished.
+            pages: dict of page bytes by kind, e.g. from load_pages. By
+                default, synthetic_pages(padding) is used.
+            scenario: function that picks the kind of page for a query. By
+                default, default_scenario is used.
+            padding: passed to synthetic_pages.
+            seed: seed for the latency and error draws.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.job_seconds = job_seconds
+        if pages is None:
+            pages = synthetic_pages(padding)
+        self.pages = pages
+        if scenario is None:
+            scenario = default_scenario
+        self.scenario = scenario
+        self.counts = {'requests': 0, 'submissions': 0, 'polls': 0,
+                       'errors': 0}
+        self._random = random.Random(seed)
+        self._job_ids = itertools.count(1)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(
+            (host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """URL of the mock primertool.cgi."""
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d/primertool.cgi' % (host, port)
+
+    def backend(self):
+        """A backends.PrimerBlastBackend that sends queries to this server."""
+        return backends.PrimerBlastBackend(self.url, name='mock')
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _submit(self, params):
+        """Start a job and return the running page."""
+        parameters = {name: values[0] if len(values) == 1 else values
+                      for name, values in params.items()}
+        ref_seq = params['INPUT_SEQUENCE'][0]
+        kind = self.scenario(ref_seq, parameters)
+        with self._lock:
+            self.counts['submissions'] += 1
+            job_key = '%s-%d' % (
+                ref_seq.replace('.', '_'), next(self._job_ids))
+            self._jobs[job_key] = (
+                time.monotonic() + self.job_seconds, kind, ref_seq)
+        return self._page('running', job_key, ref_seq)
+
+    def _poll(self, job_key):
+        """Return the page of a job, or None if there is no such job."""
+        with self._lock:
+            self.counts['polls'] += 1
+            job = self._jobs.get(job_key)
+            if job is None:
+                return None
+            finish, kind, ref_seq = job
+            if time.monotonic() < finish:
+                kind = 'running'
+        return self._page(kind, job_key, ref_seq)
+
+    def _page(self, kind, job_key, ref_seq):
+        """A page of kind, with its markers filled in."""
+        page = self.pages[kind].replace(JOB_KEY_MARKER, job_key.encode())
+        if b'@USER_SEQLOC@' in page:
+            accession = ref_seq.split('.')[0]
+            boxes = b''.join(
+                b'<input type="checkbox" name="USER_SEQLOC" value="%s_%d.1">'
+                % (accession.encode(), isoform) for isoform in (2, 3))
+            page = page.replace(b'@USER_SEQLOC@', boxes)
+        return page
+
+    def handle(self, request):
+        """Answer one GET request."""
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = self.latency * self._random.uniform(0.5, 1.5)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.counts['errors'] += 1
+        if delay:
+            time.sleep(delay)
+
+        page = None
+        if not failed:
+            params = urllib.parse.parse_qs(
+                urllib.parse.urlsplit(request.path).query)
+            if 'INPUT_SEQUENCE' in params:
+                page = self._submit(params)
+            elif 'job_key' in params:
+                page = self._poll(params['job_key'][0])
+        if failed:
+            status, page = 503, b'Service unavailable'
+        elif page is None:
+            status, page = 404, b'Unknown job_key'
+        else:
+            status = 200
+        request.send_response(status)
+        request.send_header('Content-Type', 'text/html; charset=utf-8')
+        request.send_header('Content-Length', str(len(page)))
+        request.end_headers()
+        request.wfile.write(page)
+
+    def stats(self):
+        """Counts of requests served.
+
+        Returns:
+            A dict with keys requests, submissions, polls and errors.
+        """
+        with self._lock:
+            return dict(self.counts)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import collections
+import math
+import numpy
+from rt_primer_design import thermo
+
+
+############
+# PROVIDES #
+############
+
+Conflict = collections.namedtuple(
+    'Conflict', ['ref_seq_1', 'primer_1', 'ref_seq_2', 'primer_2', 'score'])
+Conflict.__doc__ = """Two primers of a panel that may form a cross-dimer.
+
+Attributes:
+    ref_seq_1, ref_seq_2: the genes of the two primers
+    primer_1, primer_2: 'F' or 'R'
+    score: 3' complementarity of the two primers, see end_complementarity
+"""
+
+
+def _dtype(window):
+    """The smallest unsigned type that holds window 2-bit bases and a
+    sentinel bit."""
+    if not 1 <= window <= 15:
+        raise ValueError('window must be between 1 and 15, got %r' % window)
+    return numpy.uint16 if window <= 7 else numpy.uint32
+
+
+def _encode(sequences, window):
+    """Pack the 3' ends and every window of sequences into integers.
+
+    Bases are packed 2 bits each, so that XOR of a 3' end and a window is
+    zero in the first t bases exactly when those bases are complementary.
+    Positions that don't hold A, C, G or T are set in the invalid masks,
+    and the 3' end masks also set a sentinel bit after the last base.
+
+    Args:
+        sequences: list of primer sequences. None or '' for a missing
+            primer, which is complementary to nothing.
+        window: number of 3' bases to score.
+
+    Returns:
+        A tuple of (ends, end_invalid, windows, window_invalid). ends and
+        end_invalid have one value per sequence, starting with its 3' base.
+        windows and window_invalid have shape (len(sequences), length), with
+        the complement of the bases starting at each position.
+    """
+    dtype = _dtype(window)
+    length = max([len(x) for x in sequences if x] or [1])
+    bases = numpy.full((len(sequences), length + window - 1), 4,
+                       dtype=numpy.uint8)
+    end_bases = numpy.full((len(sequences), window), 4, dtype=numpy.uint8)
+    for index, sequence in enumerate(sequences):
+        if sequence:
+            encoded = thermo.encode(sequence)
+            bases[index, :len(encoded)] = encoded
+            end = encoded[::-1][:window]
+            end_bases[index, :len(end)] = end
+    shifts = (2 * numpy.arange(window)).astype(dtype)
+    invalid_bases = numpy.where(end_bases > 3, 3, 0).astype(dtype)
+    ends = ((end_bases & 3).astype(dtype) << shifts).sum(axis=1, dtype=dtype)
+    end_invalid = (invalid_bases << shifts).sum(axis=1, dtype=dtype)
+    end_invalid |= dtype(1) << dtype(2 * window)
+
+    views = numpy.lib.stride_tricks.sliding_window_view(bases, window, axis=1)
+    # A, C, G, T = 0, 1, 2, 3, so 3 - x is the complement
+    windows = (((3 - views) & 3).astype(dtype) << shifts).sum(
+        axis=2, dtype=dtype)
+    window_invalid = (numpy.where(views > 3, 3, 0).astype(dtype) <<
+                      shifts).sum(axis=2, dtype=dtype)
+    return ends, end_invalid, windows, window_invalid
+
+
+def _runs(ends, end_invalid, windows, window_invalid, block_size):
+    """3' complementarity of every encoded end against every encoded
+    sequence, computed block_size ends at a time.
+
+    Returns:
+        An int8 array of shape (len(ends), len(windows)).
+    """
+    count, length = windows.shape
+    # position-major, so that the maximum over positions is taken between
+    # contiguous rows
+    windows = numpy.ascontiguousarray(windows.T).reshape(-1)
+    window_invalid = numpy.ascontiguousarray(window_invalid.T).reshape(-1)
+    runs = numpy.zeros((len(ends), count), dtype=numpy.int8)
+    for start in range(0, len(ends), block_size):
+        stop = min(start + block_size, len(ends))
+        mismatches = numpy.bitwise_xor(ends[start:stop, None], windows)
+        mismatches |= window_invalid
+        mismatches |= end_invalid[start:stop, None]
+        # keep the lowest set bit, i.e. the first mismatch from the 3' end
+        mismatches &= numpy.negative(mismatches)
+        first = mismatches.reshape(stop - start, length, count).max(axis=1)
+        runs[start:stop] = (numpy.frexp(first)[1] - 1) // 2
+    return runs
+
+
+def end_complementarity(primers_1, primers_2=None, window=7, block_size=16):
+    """Score the 3' complementarity of every primer against every other.
+
+    The score of primers_1[i] against primers_2[j] is the longest run of
+    complementary bases that starts at the 3' end of primers_1[i], over all
+    antiparallel alignments with primers_2[j], up to window. A 3' end that
+    anneals to another primer can be extended by the polymerase, so runs of
+    4 or more usually make primer-dimers.
+
+    Args:
+        primers_1: list of primer sequences.
+        primers_2: list of primer sequences. By default, primers_1.
+        window: longest run to score. At most 15.
+        block_size: number of primers_1 scored at once. Memory use is about
+            block_size * len(primers_2) * primer length * 4 bytes.
+
+    Returns:
+        A numpy.int8 array of shape (len(primers_1), len(primers_2)). The
+        array is not symmetric; the dimer score of two primers is the larger
+        of their scores against each other.
+    """
+    ends, end_invalid, _, _ = _encode(primers_1, window)
+    if primers_2 is None:
+        primers_2 = primers_1
+    _, _, windows, window_invalid = _encode(primers_2, window)
+    return _runs(ends, end_invalid, windows, window_invalid, block_size)
+
+
+def _tm(value):
+    """A melting temperature as float, or nan if it is missing."""
+    if value in (None, ''):
+        return math.nan
+    return float(value)
+
+
+class PanelReport:
+    """Multiplex compatibility of a panel, from MultiplexPanel.check.
+
+    Attributes:
+        ref_seqs: the genes of the panel, in panel order.
+        conflicts: list of Conflict, for every pair of primers of different
+            genes whose score is above max_end_complementarity.
+        tm_median: median melting temperature of the panel's primers.
+        tm_outliers: genes with a primer more than max_tm_deviation from
+            tm_median.
+        offenders: genes to redesign, worst first. Replacing the primers of
+            every offender clears all conflicts and Tm outliers.
+    """
+    def __init__(self, ref_seqs, conflicts, tm_median, tm_outliers,
+                 offenders):
+        self.ref_seqs = ref_seqs
+        self.conflicts = conflicts
+        self.tm_median = tm_median
+        self.tm_outliers = tm_outliers
+        self.offenders = offenders
+
+    @property
+    def compatible(self):
+        """True if there are no conflicts or Tm outliers."""
+        return not self.conflicts and not self.tm_outliers
+
+    def conflict_counts(self):
+        """Number of conflicts of each gene with conflicts.
+
+        Returns:
+            A collections.Counter keyed by ref_seq.
+        """
+        counts = collections.Counter()
+        for conflict in self.conflicts:
+            counts[conflict.ref_seq_1] += 1
+            counts[conflict.ref_seq_2] += 1
+        return counts
+
+    def __repr__(self):
+        return ('PanelReport(genes=%d, conflicts=%d, tm_outliers=%d, '
+                'offenders=%d)' % (
+                    len(self.ref_seqs), len(self.conflicts),
+                    len(self.tm_outliers), len(self.offenders)))
+
+
+class MultiplexPanel:
+    """The primer pairs of a panel of genes, checked for multiplexing.
+
+    Each gene's F and R primers are scored against the primers of every
+    other gene with end_complementarity, and their melting temperatures
+    against the median of the panel. Offending genes can be given an
+    alternate pair from their primer_pairs (swap_alternates), or a result
+    of a new BLAST query (adopt).
+
+    Attributes:
+        blast_results: the PrimerBlastResult or records.PrimerBlastRecord of
+            each gene. Results are changed in place when an alternate pair
+            is used, and replaced by adopt.
+        max_end_complementarity: largest acceptable score of two primers
+            of different genes.
+        max_tm_deviation: largest acceptable difference between the melting
+            temperature of a primer and the median of the panel.
+        window: passed to end_complementarity.
+        block_size: passed to end_complementarity.
+    """
+    def __init__(self, blast_results, max_end_complementarity=4,
+                 max_tm_deviation=2.5, window=7, block_size=16):
+        """Init MultiplexPanel.
+
+        Args:
+            blast_results: iterable of finished results, e.g. from
+                multiple_primer_blast.
+            max_end_complementarity: largest acceptable score of two
+                primers of different genes.
+            max_tm_deviation: largest acceptable difference between a
+                primer's melting temperature and the median of the panel,
+                or None to not check melting temperatures.
+            window: passed to end_complementarity.
+            block_size: passed to end_complementarity.
+        """
+        self.blast_results = list(blast_results)
+        self.max_end_complementarity = max_end_complementarity
+        self.max_tm_deviation = max_tm_deviation
+        self.window = window
+        self.block_size = block_size
+        self._index = {x.ref_seq: i for i, x in enumerate(self.blast_results)}
+        # genes to leave out when picking primers for another gene, because
+        # their primers are about to be replaced
+        self._floating = set()
+        self._encode_panel()
+        tms = self._tms[~numpy.isnan(self._tms)]
+        self.tm_median = float(numpy.median(tms)) if len(tms) else math.nan
+
+    def _encode_panel(self):
+        """Encode the current primers; row 2 * i is the F primer of gene i,
+        and row 2 * i + 1 its R primer."""
+        primers = []
+        tms = []
+        for blast_result in self.blast_results:
+            primers += [getattr(blast_result, 'F', None),
+                        getattr(blast_result, 'R', None)]
+            tms += [_tm(getattr(blast_result, 'TM_F', None)),
+                    _tm(getattr(blast_result, 'TM_R', None))]
+        (self._ends, self._end_invalid, self._windows,
+         self._window_invalid) = _encode(primers, self.window)
+        self._tms = numpy.array(tms, dtype=float)
+
+    def _set_primers(self, index, blast_result):
+        """Update the encoded primers of gene index."""
+        primers = [getattr(blast_result, 'F', None),
+                   getattr(blast_result, 'R', None)]
+        if max(len(x or '') for x in primers) > self._windows.shape[1]:
+            self._encode_panel()
+            return
+        ends, end_invalid, windows, window_invalid = _encode(
+            primers, self.window)
+        rows = slice(2 * index, 2 * index + 2)
+        self._ends[rows] = ends
+        self._end_invalid[rows] = end_invalid
+        self._windows[rows] = numpy.pad(
+            windows, ((0, 0), (0, self._windows.shape[1] - windows.shape[1])),
+            constant_values=0)
+        self._window_invalid[rows] = numpy.pad(
+            window_invalid,
+            ((0, 0), (0, self._windows.shape[1] - windows.shape[1])),
+            constant_values=(1 << 2 * self.window) - 1)
+        self._tms[rows] = [_tm(getattr(blast_result, 'TM_F', None)),
+                           _tm(getattr(blast_result, 'TM_R', None))]
+
+    def _tm_ok(self, tms):
+        """True where tms are close enough to the panel median."""
+        tms = numpy.asarray(tms, dtype=float)
+        if self.max_tm_deviation is None or math.isnan(self.tm_median):
+            return numpy.ones(tms.shape, dtype=bool)
+        return ~(numpy.abs(tms - self.tm_median) > self.max_tm_deviation)
+
+    def scores(self):
+        """Dimer scores of every pair of primers in the panel.
+
+        Returns:
+            A symmetric numpy.int8 array of shape (2 * genes, 2 * genes),
+            where row 2 * i is the F primer of gene i and row 2 * i + 1 its
+            R primer.
+        """
+        runs = _runs(self._ends, self._end_invalid, self._windows,
+                     self._window_invalid, self.block_size)
+        return numpy.maximum(runs, runs.T)
+
+    def check(self):
+        """Find the conflicts and Tm outliers of the panel.
+
+        Returns:
+            A PanelReport.
+        """
+        ref_seqs = [x.ref_seq for x in self.blast_results]
+        scores = self.scores()
+        first, second = numpy.nonzero(
+            numpy.triu(scores > self.max_end_complementarity, 1))
+        different_genes = first // 2 != second // 2
+        first, second = first[different_genes], second[different_genes]
+        conflicts = [
+            Conflict(ref_seqs[i // 2], 'FR'[i % 2],
+                     ref_seqs[j // 2], 'FR'[j % 2], int(scores[i, j]))
+            for i, j in zip(first.tolist(), second.tolist())]
+
+        # greedily pick the gene with the most conflicting genes left
+        neighbours = collections.defaultdict(set)
+        for i, j in zip((first // 2).tolist(), (second // 2).tolist()):
+            neighbours[i].add(j)
+            neighbours[j].add(i)
+        degrees = numpy.zeros(len(ref_seqs), dtype=int)
+        for gene, genes in neighbours.items():
+            degrees[gene] = len(genes)
+        offenders = []
+        while len(degrees) and degrees.max() > 0:
+            gene = int(degrees.argmax())
+            offenders.append(gene)
+            degrees[gene] = 0
+            for neighbour in neighbours[gene]:
+                if degrees[neighbour] > 0:
+                    degrees[neighbour] -= 1
+
+        tm_bad = ~self._tm_ok(self._tms).reshape(-1, 2).all(axis=1)
+        tm_outliers = numpy.nonzero(tm_bad)[0].tolist()
+        dimer_offenders = set(offenders)
+        offenders += [x for x in tm_outliers if x not in dimer_offenders]
+        return PanelReport(
+            ref_seqs, conflicts, self.tm_median,
+            [ref_seqs[x] for x in tm_outliers],
+            [ref_seqs[x] for x in offenders])
+
+    def _pick_pair(self, index, pairs):
+        """The first of pairs that is compatible with the rest of the
+        panel, ignoring gene index and floating genes, or None."""
+        pairs = [x for x in pairs if x.F and x.R and
+                 self._tm_ok([_tm(x.TM_F), _tm(x.TM_R)]).all()]
+        if not pairs:
+            return None
+        candidates = [primer for pair in pairs for primer in (pair.F, pair.R)]
+        ends, end_invalid, windows, window_invalid = _encode(
+            candidates, self.window)
+        # score as many panel primers at once as block_size candidates
+        # against the panel would take
+        panel_block_size = max(
+            self.block_size,
+            self.block_size * len(self._ends) // len(candidates))
+        scores = numpy.maximum(
+            _runs(ends, end_invalid, self._windows, self._window_invalid,
+                  self.block_size),
+            _runs(self._ends, self._end_invalid, windows, window_invalid,
+                  panel_block_size).T)
+        ignored = [index] + list(self._floating)
+        scores[:, [2 * x for x in ignored] + [2 * x + 1 for x in ignored]] = 0
+        ok = (scores <= self.max_end_complementarity).all(axis=1)
+        for pair, pair_ok in zip(pairs, ok.reshape(-1, 2).all(axis=1)):
+            if pair_ok:
+                return pair
+        return None
+
+    def swap_alternates(self, report=None):
+        """Give each offender the first alternate from its primer_pairs that
+        is compatible with the rest of the panel.
+
+        Offenders are visited worst first. Each is checked against the
+        genes that aren't offenders and the offenders already fixed.
+
+        Args:
+            report: a PanelReport of the panel. By default, check the panel.
+
+        Returns:
+            A list of the ref_seq of the offenders that could not be fixed.
+        """
+        if report is None:
+            report = self.check()
+        self._floating = {self._index[x] for x in report.offenders}
+        unresolved = []
+        for ref_seq in report.offenders:
+            index = self._index[ref_seq]
+            blast_result = self.blast_results[index]
+            self._floating.discard(index)
+            current = (getattr(blast_result, 'F', None),
+                       getattr(blast_result, 'R', None))
+            pairs = [x for x in getattr(blast_result, 'primer_pairs', None)
+                     or () if (x.F, x.R) != current]
+            pair = self._pick_pair(index, pairs)
+            if pair is None:
+                unresolved.append(ref_seq)
+                self._floating.add(index)
+                continue
+            blast_result.use_primer_pair(pair)
+            self._set_primers(index, blast_result)
+        return unresolved
+
+    def rerun_parameters(self, starting_parameters, num_return=50):
+        """Parameters to design new primers for offenders with.
+
+        The melting temperatures are limited to the panel's range, and
+        primer-BLAST is asked for more pairs to pick an alternate from.
+
+        Args:
+            starting_parameters: the parameters the panel was designed with.
+            num_return: number of primer pairs to ask for.
+
+        Returns:
+            A new dict of parameters.
+        """
+        parameters = dict(starting_parameters)
+        parameters['PRIMER_NUM_RETURN'] = str(num_return)
+        if self.max_tm_deviation is not None and not math.isnan(
+                self.tm_median):
+            parameters['PRIMER_OPT_TM'] = '%.1f' % self.tm_median
+            parameters['PRIMER_MIN_TM'] = '%.1f' % (
+                self.tm_median - self.max_tm_deviation)
+            parameters['PRIMER_MAX_TM'] = '%.1f' % (
+                self.tm_median + self.max_tm_deviation)
+        return parameters
+
+    def adopt(self, blast_result):
+        """Use a new result for its gene, if one of its primer pairs is
+        compatible with the panel.
+
+        Genes that swap_alternates could not fix, other than this one, are
+        ignored, so that new results can be adopted one by one.
+
+        Args:
+            blast_result: a finished result for a gene of the panel.
+
+        Returns:
+            True if the result replaced the gene's result.
+        """
+        index = self._index[blast_result.ref_seq]
+        pair = self._pick_pair(
+            index, getattr(blast_result, 'primer_pairs', None) or ())
+        if pair is None:
+            return False
+        blast_result.use_primer_pair(pair)
+        self.blast_results[index] = blast_result
+        self._floating.discard(index)
+        self._set_primers(index, blast_result)
+        return True
+
+
+def check_panel(blast_results, max_end_complementarity=4,
+                max_tm_deviation=2.5, window=7, block_size=16):
+    """Check the primers of a panel for cross-dimers and Tm spread.
+
+    Args:
+        blast_results: iterable of finished results, e.g. from
+            multiple_primer_blast.
+        max_end_complementarity: passed to MultiplexPanel.
+        max_tm_deviation: passed to MultiplexPanel.
+        window: passed to MultiplexPanel.
+        block_size: passed to MultiplexPanel.
+
+    Returns:
+        A PanelReport.
+    """
+    return MultiplexPanel(
+        blast_results, max_end_complementarity, max_tm_deviation, window,
+        block_size).check()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import threading
+from rt_primer_design.cache import parameter_hash
+
+
+############
+# PROVIDES #
+############
+
+def _accession(ref_seq):
+    """The RefSeq accession without its version, e.g. 'NM_001' for
+    'NM_001.2'."""
+    return ref_seq.split('.')[0]
+
+
+class TemplateRegistry:
+    """Remember the similar-template sets that NCBI reports.
+
+    When NCBI reports that a template is highly similar to other sequences,
+    the template and those sequences form a group, e.g. the isoforms of a
+    gene. Every other member of the group will get the same report, so its
+    query can be submitted with TRY_USER_GUIDE and USER_SEQLOC filled in
+    straight away, instead of being re-submitted after the first query has
+    finished.
+
+    Members are matched by accession, ignoring the version.
+
+    Attributes:
+        registered: number of similar-template sets registered.
+        predicted: number of queries that were given a USER_SEQLOC.
+    """
+    def __init__(self):
+        """Init TemplateRegistry."""
+        self.registered = 0
+        self.predicted = 0
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def register(self, ref_seq, user_seqloc):
+        """Record the similar templates NCBI reported for ref_seq.
+
+        Args:
+            ref_seq: RefSeq sequence ID of the template.
+            user_seqloc: the USER_SEQLOC values NCBI reported.
+        """
+        group = {_accession(ref_seq): ref_seq}
+        for template in user_seqloc:
+            group.setdefault(_accession(template), template)
+        with self._lock:
+            self.registered += 1
+            for accession in group:
+                self._groups[accession] = group
+
+    def user_seqloc(self, ref_seq):
+        """The USER_SEQLOC values expected for ref_seq, or None."""
+        accession = _accession(ref_seq)
+        with self._lock:
+            group = self._groups.get(accession)
+            if group is None:
+                return None
+            self.predicted += 1
+        return [template for member, template in sorted(group.items())
+                if member != accession]
+
+    def prefill(self, ref_seq, blast_parameters):
+        """Add TRY_USER_GUIDE and USER_SEQLOC to blast_parameters if the
+        similar templates of ref_seq are known.
+
+        Args:
+            ref_seq: RefSeq sequence ID of the template.
+            blast_parameters: the parameters of the query, which are updated
+                in place.
+
+        Returns:
+            The USER_SEQLOC values that were added, or None.
+        """
+        if 'USER_SEQLOC' in blast_parameters:
+            return None
+        user_seqloc = self.user_seqloc(ref_seq)
+        if not user_seqloc:
+            return None
+        blast_parameters['TRY_USER_GUIDE'] = 'yes'
+        blast_parameters['USER_SEQLOC'] = user_seqloc
+        return user_seqloc
+
+
+class BatchPlanner:
+    """Share work between the genes of a batch.
+
+    Genes that are queued more than once with the same parameters are only
+    run once. The first claim runs the gene, and the duplicates wait for its
+    result. Once the gene has finished, only its record is kept, and later
+    duplicates get a copy rebuilt from the record.
+
+    A record is only kept while a later duplicate still needs it. The
+    duplicates of each gene are counted by plan, before the batch starts,
+    and the record is dropped when the last of them has been claimed and
+    has read it. Genes that weren't planned, e.g. from a generator, only
+    share their result with duplicates claimed while they are running, and
+    are run again if they turn up after they have finished.
+
+    The planner also holds a TemplateRegistry, so that isoforms can be
+    submitted with their similar templates filled in.
+
+    Attributes:
+        templates: the TemplateRegistry.
+        duplicates: number of duplicate genes that weren't run.
+    """
+    def __init__(self, from_record, templates=None):
+        """Init BatchPlanner.
+
+        Args:
+            from_record: function to rebuild a result from its record, e.g.
+                PrimerBlastResult.from_record.
+            templates: a TemplateRegistry. By default, a new one is used.
+        """
+        self._from_record = from_record
+        if templates is None:
+            templates = TemplateRegistry()
+        self.templates = templates
+        self.duplicates = 0
+        self._running = {}
+        self._finished = {}
+        # claims still to come, and duplicates yet to read the result, by key
+        self._planned = {}
+        self._readers = {}
+
+    def _key(self, ref_seq, blast_parameters):
+        return (ref_seq, parameter_hash(blast_parameters))
+
+    def plan(self, ref_seq_list, blast_parameters):
+        """Count the genes of a batch, so that the record of a finished
+        gene is kept until its last duplicate has been claimed.
+
+        Args:
+            ref_seq_list: the RefSeq IDs of the batch, e.g. a list.
+            blast_parameters: the parameters the genes are claimed with.
+        """
+        parameters_hash = parameter_hash(blast_parameters)
+        for ref_seq in ref_seq_list:
+            key = (ref_seq, parameters_hash)
+            self._planned[key] = self._planned.get(key, 0) + 1
+
+    def _release(self, key):
+        """Drop the record of key if no duplicate needs it any more."""
+        if not self._planned.get(key) and not self._readers.get(key):
+            self._planned.pop(key, None)
+            self._readers.pop(key, None)
+            self._finished.pop(key, None)
+
+    def claim(self, ref_seq, blast_parameters):
+        """Claim a gene.
+
+        Returns:
+            True if the caller should run the gene and then call resolve or
+            fail, False if it is a duplicate and the caller should await
+            shared_result instead.
+        """
+        key = self._key(ref_seq, blast_parameters)
+        if self._planned.get(key):
+            self._planned[key] -= 1
+        if key in self._running or key in self._finished:
+            self.duplicates += 1
+            self._readers[key] = self._readers.get(key, 0) + 1
+            return False
+        self._running[key] = asyncio.get_running_loop().create_future()
+        return True
+
+    def resolve(self, ref_seq, blast_parameters, blast_result):
+        """Hand the result of a claimed gene to its duplicates."""
+        key = self._key(ref_seq, blast_parameters)
+        if self._planned.get(key) or self._readers.get(key):
+            self._finished[key] = blast_result.to_record()
+        future = self._running.pop(key)
+        if not future.done():
+            future.set_result(blast_result)
+        self._release(key)
+
+    def fail(self, ref_seq, blast_parameters, error):
+        """Hand the error of a claimed gene to its duplicates, and let the
+        gene be claimed again."""
+        future = self._running.pop(self._key(ref_seq, blast_parameters))
+        if not future.done():
+            future.set_exception(error)
+            # don't warn about the exception if there were no duplicates
+            future.exception()
+
+    async def shared_result(self, ref_seq, blast_parameters):
+        """The result of a duplicate gene.
+
+        Raises:
+            The error of the claimed gene, if it failed.
+        """
+        key = self._key(ref_seq, blast_parameters)
+        try:
+            if key in self._finished:
+                return self._from_record(self._finished[key])
+            return await asyncio.shield(self._running[key])
+        finally:
+            self._readers[key] -= 1
+            self._release(key)
+
+    def stats(self):
+        """Counters for the batch.
+
+        Returns:
+            A dict with keys duplicates, templates_registered and
+            templates_predicted.
+        """
+        return {
+            'duplicates': self.duplicates,
+            'templates_registered': self.templates.registered,
+            'templates_predicted': self.templates.predicted}
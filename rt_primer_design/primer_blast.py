@@ -0,0 +1,1989 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+from rt_primer_design import backends
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import re
+from rt_primer_design import metrics
+from rt_primer_design import planner
+from rt_primer_design import primers
+from rt_primer_design import rate_limit
+from rt_primer_design import records
+from rt_primer_design import relaxation
+from rt_primer_design import scheduler
+from rt_primer_design import session as blast_session
+import time
+import tompytools
+
+
+############
+# PROVIDES #
+############
+
+_RECORD_FIELDS = (
+    'ref_seq', 'status', 'blast_parameters', 'job_key', 'url',
+    'no_intron', 'no_primers_found', 'off_targets', 'user_seqloc',
+    'F', 'R', 'TM_F', 'TM_R', 'product_size', 'intron_size', 'primer_pairs',
+    'locally_verified')
+
+_JOB_ID = re.compile(r'Job id\=(\S+).*')
+
+
+class _GeneSlot:
+    """A gene's place among the n_jobs genes in flight.
+
+    The slot can be given up while the gene waits to re-submit a query, and
+    taken back afterwards. The relaxation steps of a gene share its slot.
+    """
+    def __init__(self, semaphore):
+        """Init _GeneSlot, which holds one place of semaphore."""
+        self._semaphore = semaphore
+        self.held = True
+
+    async def acquire(self):
+        """Take the place back, if no step of the gene has already."""
+        if self.held:
+            return
+        await self._semaphore.acquire()
+        if self.held:
+            self._semaphore.release()
+        self.held = True
+
+    def release(self):
+        """Give up the place, if it is held."""
+        if self.held:
+            self.held = False
+            self._semaphore.release()
+
+
+# the _GeneSlot of the gene the current task is working on, if any
+_gene_slot = contextvars.ContextVar('gene_slot', default=None)
+
+
+class SubmissionError(Exception):
+    """The BLAST server didn't return a job_key for a query.
+
+    Attributes:
+        blast_result: the PrimerBlastResult whose submission failed. Its page
+            is the one returned by the server.
+    """
+    def __init__(self, blast_result):
+        """Init SubmissionError.
+
+        Args:
+            blast_result: the PrimerBlastResult whose submission failed.
+        """
+        super().__init__(
+            "%s: Couldn't parse job_key" % blast_result.ref_seq)
+        self.blast_result = blast_result
+
+
+class PrimerBlastResult:
+    """Submit BLAST query to NCBI and parse results.
+
+    Attributes:
+        F: Forward primer
+        R: Reverse primer
+        TM_F: TM of the forward primer
+        TM_R: TM of the reverse primer
+        backend: the backends.PrimerBlastBackend of the service queried
+        exceptions: True if the string 'Exception' is in the text of 'error'
+            class in html
+        html: result of GET parsed with BeautifulSoup lxml parser. Only built
+            when it is first accessed.
+        intron_size: expected size of intron(s) in the PCR product from genomic
+            DNA
+        job_key: job_key for retrieving results from NCBI server.
+        locally_verified: True if NCBI found that the primers may not be
+            specific, but the pair used had no off-target products in a local
+            kmer_index.KmerIndex, so off_targets was cleared
+        no_intron: True if the string 'junction cannot be found' is in the text
+            of 'info' class in the html
+        no_primers_found: True if 'No primers were found' is in the text of the
+            'info' class in html or if 'loosen the selection criteria' is in
+            the 'warning' class of the html
+        product_size: expected PCR product size
+        off_targets: True if string 'may not be specific' is in the text of the
+            'paramSummary' class in the html
+        page: scanner.PageSummary of the status markers in the current page
+        primer_pairs: list of primers.PrimerPair for every primer pair on the
+            page, in the order primer-BLAST ranks them. F, R and the other
+            primer attributes are taken from the first pair.
+        rate_limiter: the rate_limit.TokenBucket that every request to
+            blast_url goes through
+        request_timings: dict of the seconds spent queueing for the rate
+            limiter ('queued') and backing off before retries ('backoff'),
+            and the number of requests made ('requests')
+        session: the session.BlastSession that makes the requests
+        running: True if the job is still running on the NCBI server
+        submitted_at: time.monotonic() when the BLAST query was submitted
+        url: complete URL used for the GET query by submit_blast_request
+        user_seqloc: USER_SEQLOC values for similar templates according to the
+            NCBI server
+
+    """
+    def __init__(
+        self, ref_seq, status, blast_parameters,
+        F=None,
+        R=None,
+        TM_F=None,
+        TM_R=None,
+        exceptions=None,
+        html=None,
+        intron_size=None,
+        job_key=None,
+        no_intron=None,
+        no_primers_found=None,
+        off_targets=None,
+        product_size=None,
+        running=None,
+        url=None,
+        user_seqloc=None,
+        blast_url=None,
+        rate_limiter=None,
+        session=None,
+        backend=None,
+        submit=True):
+        """Init PrimerBlastResult.
+
+        Submits the BLAST query for ref_seq to blast_url using blast_parameters
+        and returns a PrimerBlastResult with attributes blast_url, ref_seq,
+        blast_parameters, status, url, html, job_key, running.
+
+        Args:
+            ref_seq: RefSeq sequence ID to design primers for.
+            status: the status of the primer set, e.g. 'strict' if submitting
+                the initial BLAST search with strict parameters.
+            blast_parameters: the parameters to use for designing the primers.
+            blast_url: URL to send the query to. By default, the blast_url
+                of backend.
+            rate_limiter: the rate_limit.TokenBucket to use for requests. By
+                default, use the process-wide limiter.
+            session: the session.BlastSession to make requests with. By
+                default, use the process-wide session.
+            backend: the backends.PrimerBlastBackend of the service to
+                query. By default, use the process-wide backend, which is
+                NCBI.
+            submit: if False, don't submit the BLAST query. Used by the
+                asyncio engine, which awaits async_submit_blast_request
+                instead.
+        """
+        # initiate the object
+        self._content = None
+        self._html = None
+        self.page = None
+        self.submitted_at = None
+        self.locally_verified = False
+        self.request_timings = {'queued': 0.0, 'backoff': 0.0, 'requests': 0}
+        if backend is None:
+            backend = backends.get_backend()
+        self.backend = backend
+        if blast_url is None:
+            blast_url = backend.blast_url
+        self.blast_url = blast_url
+        if rate_limiter is None:
+            rate_limiter = rate_limit.get_rate_limiter()
+        self.rate_limiter = rate_limiter
+        if session is None:
+            session = blast_session.get_session()
+        self.session = session
+        self.ref_seq = ref_seq
+        self.status = status
+        self.blast_parameters = blast_parameters.copy()
+        self.blast_parameters['INPUT_SEQUENCE'] = self.ref_seq
+
+        # submit the BLAST request
+        if submit:
+            self.submit_blast_request()
+
+    def __eq__(self, other):
+        """Compare PrimerBlastResult objects by job_key.
+
+        Args:
+            other: the PrimerBlastResult to compare to self.
+
+        Returns:
+            A boolean value indicating if the job_keys are identical.
+        """
+        return self.job_key == other.job_key
+
+    def __str__(self):
+        """Formatted html result."""
+        return str(self.html)
+
+    @property
+    def html(self):
+        """The current page parsed with BeautifulSoup, built on first use."""
+        if self._html is None and self._content is not None:
+            # bs4 and lxml are only needed here, so don't import them
+            # until a page is parsed
+            from bs4 import BeautifulSoup
+            self._html = BeautifulSoup(self._content, 'lxml')
+        return self._html
+
+    @html.setter
+    def html(self, html):
+        self._html = html
+
+    @property
+    def content(self):
+        """The raw bytes of the current page, or None."""
+        return self._content
+
+    def _set_page(self, content):
+        """Store the raw content of a new page and scan it for markers.
+
+        The BeautifulSoup tree is dropped, and only rebuilt if self.html is
+        accessed.
+        """
+        self._content = content
+        self._html = None
+        self.page = self.backend.scan_page(content)
+
+    def _get(self, params):
+        """GET blast_url with params through self.session, waiting for the
+        rate limiter before each attempt."""
+        return self.session.get(
+            self.blast_url, params, self.rate_limiter, self.request_timings)
+
+    async def _async_get(self, params):
+        """Async twin of _get. The GET runs in the default executor of the
+        running event loop."""
+        return await self.session.async_get(
+            self.blast_url, params, self.rate_limiter, self.request_timings)
+
+    def _submit(self):
+        """Submit the BLAST query and store the response page."""
+        blast_result = self._get(
+            self.backend.submit_params(self.blast_parameters))
+        self.submitted_at = time.monotonic()
+        self.url = blast_result.url
+        self._set_page(blast_result.content)
+
+    async def _async_submit(self):
+        """Async twin of _submit."""
+        blast_result = await self._async_get(
+            self.backend.submit_params(self.blast_parameters))
+        self.submitted_at = time.monotonic()
+        self.url = blast_result.url
+        self._set_page(blast_result.content)
+
+    def submit_blast_request(self, retry_queue=None):
+        """Run the BLAST query on NCBI primer-blast.
+
+        Submits the BLAST query then calls get_job_key and poll_results
+        methods. If no job_key is returned, the query is re-submitted after
+        the backoff given by retry_queue.
+
+        Args:
+            retry_queue: the scheduler.RetryQueue that decides when to
+                re-submit. By default, a new RetryQueue is used.
+
+        Raises:
+            SubmissionError: if there is still no job_key after the retries
+                allowed by retry_queue.
+        """
+        if retry_queue is None:
+            retry_queue = scheduler.RetryQueue()
+        attempt = 0
+        while True:
+            self._submit()
+            try:
+                self.get_job_key()
+                break
+            except SubmissionError:
+                delay = retry_queue.schedule(attempt)
+                if delay is None:
+                    raise
+                retry_queue.wait(delay)
+                self.request_timings['backoff'] += delay
+                attempt += 1
+
+        # poll the results once to get the finished page
+        self.poll_results()
+
+    async def async_submit_blast_request(self, poll=True, retry_queue=None):
+        """Async twin of submit_blast_request.
+
+        While waiting to re-submit, the task gives up its gene slot, if it
+        holds one, so that other genes can run in the meantime.
+
+        Args:
+            poll: if False, don't poll the results straight after submitting.
+                Instead, set self.running and leave it to the caller to decide
+                when to poll.
+            retry_queue: the scheduler.RetryQueue that decides when to
+                re-submit. By default, a new RetryQueue is used.
+        """
+        if retry_queue is None:
+            retry_queue = scheduler.RetryQueue()
+        attempt = 0
+        while True:
+            await self._async_submit()
+            try:
+                self.get_job_key()
+                break
+            except SubmissionError:
+                delay = retry_queue.schedule(attempt)
+                if delay is None:
+                    raise
+                await _back_off(retry_queue, delay)
+                self.request_timings['backoff'] += delay
+                attempt += 1
+        if poll:
+            await self.async_poll_results()
+        else:
+            self.running = True
+
+    def _parse_job_key(self):
+        """Parse the job_key from self.page.
+
+        Returns:
+            The job_key, or None if it couldn't be found.
+        """
+        # first choice is the proper "job_key" tag
+        job_key = self.page.job_key
+
+        # otherwise, try to parse the 'Job id' from `breadcrumb` with regex :(
+        if self.page.breadcrumb is not None:
+            bc_text = self.page.breadcrumb
+            bc_search = _JOB_ID.search(bc_text)
+            if bc_search:
+                job_key = bc_search.group(1)
+
+        return job_key
+
+    def get_job_key(self):
+        """Retrieve the job_key and store in self.job_key.
+
+        Raises:
+            SubmissionError: if the page has no job_key.
+        """
+        job_key = self._parse_job_key()
+        if not job_key:
+            raise SubmissionError(self)
+        self.job_key = job_key
+
+    def poll_results(self):
+        """Retrieve the current html from NCBI and update self.html and
+        self.running.
+        """
+        status_page_response = self._get(
+            self.backend.poll_params(self.job_key))
+        self._set_page(status_page_response.content)
+        self.check_running()
+
+    async def async_poll_results(self):
+        """Async twin of poll_results."""
+        status_page_response = await self._async_get(
+            self.backend.poll_params(self.job_key))
+        self._set_page(status_page_response.content)
+        self.check_running()
+
+    def job_found(self):
+        """Tell if self.page is a page of the job, with a job_key or a
+        status. Polls of an expired or unknown job_key get neither."""
+        return self._parse_job_key() is not None or self.page.odd is not None
+
+    def check_running(self):
+        """Parse self.page and update self.running."""
+        if self.page.odd is not None:
+            self.running = 'Running' in self.page.odd
+        else:
+            self.running = False
+
+    def check_introns(self):
+        """Parse self.page and update self.no_intron."""
+        if self.page.info is not None:
+            self.no_intron = 'junction cannot be found' in self.page.info
+        else:
+            self.no_intron = False
+
+    def check_specificity(self):
+        """Parse self.page and update self.off_targets."""
+        if self.page.param_summary is not None:
+            self.off_targets = 'may not be specific' in self.page.param_summary
+        else:
+            self.off_targets = False
+
+    def check_success(self):
+        """Parse self.page and update self.no_primers_found.
+
+        Parse self.page and update self.no_primers_found based on the 'warning'
+        and 'info' html classes. This usually means no primers were found for
+        the given blast_parameters, which should be relaxed.
+        """
+        warning_list = []
+        if self.page.warning is not None:
+            warning_list.append(
+                'loosen the selection criteria' in self.page.warning)
+
+        if self.page.info is not None:
+            warning_list.append(
+                'No primers were found' in self.page.info)
+
+        if any(x for x in warning_list):
+            self.no_primers_found = True
+        else:
+            self.no_primers_found = False
+
+    def parse_primers(self):
+        """Parse every primer pair on the page into self.primer_pairs, and
+        set the primer attributes from the first pair.
+
+        Raises:
+            ValueError: if there are no primer pairs on the page.
+        """
+        self.primer_pairs = self.backend.parse_primer_pairs(self._content)
+        if not self.primer_pairs:
+            raise ValueError(
+                '%s: No primer pairs on the results page' % self.ref_seq)
+        self.use_primer_pair(self.primer_pairs[0])
+
+    def use_primer_pair(self, pair):
+        """Set F, R, TM_F, TM_R, product_size and intron_size from pair, e.g.
+        an alternate picked with primers.select_pairs.
+
+        Args:
+            pair: a primers.PrimerPair.
+        """
+        for field, value in primers.legacy_fields(pair).items():
+            setattr(self, field, value)
+
+    def csv_line(self, locally_verified=False):
+        """Print a line of csv.
+
+        Use the primer attributes found by parse_primers to print a line of CSV
+        for writing to file.
+
+        Args:
+            locally_verified: if True, add a column with self.locally_verified,
+                as in sinks.LOCALLY_VERIFIED_HEADER.
+
+        Returns:
+            A str of text in csv format.
+        """
+        if not hasattr(self, 'F'):
+            line = '{0},{1},,,,,,'.format(self.ref_seq, self.status)
+        else:
+            line = '{0},{1},{2},{3},{4},{5},{6},{7}'.format(
+                self.ref_seq,       # 0
+                self.status,        # 1
+                self.F,             # 2
+                self.TM_F,          # 3
+                self.R,             # 4
+                self.TM_R,          # 5
+                self.product_size,  # 6
+                self.intron_size)   # 7
+        if locally_verified:
+            line += ',%s' % bool(self.locally_verified)
+        return line
+
+    def replace_css_links(self):
+        """Replace the local css links in self.html with absolute paths."""
+        css_links = self.html.findAll(href=re.compile('css'))
+        for link in css_links:
+            link['href'] = ('https://www.ncbi.nlm.nih.gov/'
+                            'tools/primer-blast/' + link['href'])
+
+    def _find_similar_templates(self):
+        """Parse self.page for similar templates.
+
+        If NCBI reports that the template is "highly similar" to another
+        sequence, update the user_seqloc attribute and add the parameters
+        'TRY_USER_GUIDE' and 'USER_SEQLOC' to self.blast_parameters.
+
+        Returns:
+            True if the BLAST query has to be re-submitted.
+        """
+        if self.page.expl is None:
+            return False
+        if (('Your PCR template is highly similar to the following'
+             ' sequence') not in self.page.expl):
+            return False
+
+        self.user_seqloc = list(self.page.user_seqloc)
+        print("%s: Found similar sequences: %s" %
+              (self.ref_seq, self.user_seqloc))
+        self.blast_parameters['TRY_USER_GUIDE'] = 'yes'
+        self.blast_parameters['USER_SEQLOC'] = self.user_seqloc
+        return True
+
+    def check_similar_templates(self, retry_queue=None):
+        """Check for similar templates and re-submit BLAST if necessary.
+
+        If NCBI reports that the template is "highly similar" to another
+        sequence, parse the RefSeq ID of that sequence and resubmit the BLAST
+        query with the extra parameters 'TRY_USER_GUIDE' and 'USER_SEQLOC',
+        and update the user_seqloc attribute.
+
+        Args:
+            retry_queue: passed to submit_blast_request.
+        """
+        if self._find_similar_templates():
+            # this is a new BLAST request
+            self.submit_blast_request(retry_queue=retry_queue)
+
+    async def async_check_similar_templates(self, poll=True, retry_queue=None):
+        """Async twin of check_similar_templates.
+
+        Args:
+            poll: passed to async_submit_blast_request if the BLAST query is
+                re-submitted.
+            retry_queue: passed to async_submit_blast_request.
+        """
+        if self._find_similar_templates():
+            await self.async_submit_blast_request(
+                poll=poll, retry_queue=retry_queue)
+
+    def to_record(self, include_html=False):
+        """Summarise the result as a dict of plain values.
+
+        Args:
+            include_html: if True, include self.html as a str.
+
+        Returns:
+            A dict that can be serialised as JSON and passed to from_record.
+        """
+        record = {x: getattr(self, x, None) for x in _RECORD_FIELDS}
+        record['primer_pairs'] = primers.to_records(record['primer_pairs'])
+        if include_html:
+            if self._html is not None:
+                record['html'] = str(self._html)
+            elif self._content is not None:
+                record['html'] = self._content.decode('utf-8', 'replace')
+        return record
+
+    @classmethod
+    def from_record(cls, record, rate_limiter=None, session=None,
+                    backend=None):
+        """Rebuild a finished PrimerBlastResult from the output of to_record.
+
+        No BLAST query is submitted.
+
+        Args:
+            record: a dict returned by to_record.
+            rate_limiter: the rate_limit.TokenBucket to use if the result is
+                re-submitted.
+            session: the session.BlastSession to use if the result is
+                re-submitted.
+            backend: the backends.PrimerBlastBackend to use if the result is
+                re-submitted.
+
+        Returns:
+            A PrimerBlastResult.
+        """
+        blast_result = cls(
+            ref_seq=record['ref_seq'],
+            status=record['status'],
+            blast_parameters=record['blast_parameters'],
+            rate_limiter=rate_limiter,
+            session=session,
+            backend=backend,
+            submit=False)
+        for field in _RECORD_FIELDS:
+            # csv_line relies on F only being set if primers were parsed
+            if record.get(field) is not None:
+                setattr(blast_result, field, record[field])
+        if record.get('primer_pairs') is not None:
+            blast_result.primer_pairs = primers.from_records(
+                record['primer_pairs'])
+        blast_result.running = False
+        if record.get('html') is not None:
+            blast_result._set_page(record['html'].encode())
+        return blast_result
+
+    def print_file(self, output_subdirectory):
+        """Print html to a file in output_subdirectory"""
+        output_file = output_subdirectory + "/" + self.ref_seq + ".html"
+        with open(output_file, 'w') as file:
+            print(self.html, file=file)
+
+
+def _loop_running():
+    """True if the calling thread is running an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _run_sync(main):
+    """Run coroutine main to completion and return its result.
+
+    Like asyncio.run, but also works from a thread that is already running
+    an event loop, e.g. in Jupyter, where asyncio.run raises RuntimeError.
+    There, main runs on a new event loop in a worker thread, and the
+    calling thread waits for it, blocking its loop.
+    """
+    if not _loop_running():
+        return asyncio.run(main)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as worker:
+        return worker.submit(asyncio.run, main).result()
+
+
+async def _back_off(retry_queue, delay):
+    """Wait in retry_queue for delay seconds without holding a gene slot."""
+    gene_slot = _gene_slot.get()
+    if gene_slot is not None:
+        gene_slot.release()
+    await retry_queue.async_wait(delay)
+    if gene_slot is not None:
+        await gene_slot.acquire()
+
+
+def _needs_relaxing(blast_result):
+    """True if no primers were found or they aren't specific."""
+    return blast_result.no_primers_found or blast_result.off_targets
+
+
+def _check_local_specificity(blast_result, specificity_index, verbose):
+    """Look for a specific primer pair locally, if NCBI found primers that
+    may not be specific.
+
+    Every primer pair on the page is checked with specificity_index, in
+    rank order. The first pair without products on other sequences than the
+    template and its similar templates is used, and off_targets is cleared,
+    so the gene doesn't need another relaxation step.
+
+    Args:
+        blast_result: a finished PrimerBlastResult.
+        specificity_index: a kmer_index.KmerIndex, or None.
+        verbose: If True, print stepwise status messages.
+
+    Returns:
+        True if a specific pair was found.
+    """
+    if (specificity_index is None or not blast_result.off_targets or
+            blast_result.no_primers_found or blast_result.content is None):
+        return False
+    pairs = getattr(blast_result, 'primer_pairs', None)
+    if not pairs:
+        pairs = blast_result.backend.parse_primer_pairs(blast_result.content)
+    intended = [blast_result.ref_seq] + list(
+        getattr(blast_result, 'user_seqloc', None) or [])
+    specific_pairs = specificity_index.specific_pairs(pairs, intended)
+    if not specific_pairs:
+        return False
+    if verbose:
+        tompytools.generate_message(
+            '%s: Primer pair %d has no off-target products in the local '
+            'index' % (blast_result.ref_seq, specific_pairs[0].rank))
+    blast_result.primer_pairs = pairs
+    blast_result.use_primer_pair(specific_pairs[0])
+    blast_result.off_targets = False
+    # keep these apart from primers NCBI found to be specific
+    blast_result.locally_verified = True
+    return True
+
+
+async def _prescreen(ref_seq, starting_parameters, templates, strategy):
+    """Find the first relaxation level whose primer limits the template of
+    ref_seq can meet, with thermo.first_feasible_level.
+
+    The screen runs in a worker thread, so that the event loop keeps
+    polling other genes.
+
+    Returns:
+        A tuple of (index, parameters) as thermo.first_feasible_level
+        returns, or (-1, starting_parameters) if the template of ref_seq
+        isn't in templates.
+    """
+    sequence = templates.get(ref_seq)
+    if sequence is None:
+        sequence = templates.get(ref_seq.split('.')[0])
+    if sequence is None:
+        return -1, starting_parameters
+    from rt_primer_design import thermo
+    return await asyncio.get_running_loop().run_in_executor(
+        None, thermo.first_feasible_level,
+        sequence, starting_parameters, strategy.levels)
+
+
+async def _resume(blast_result, trace):
+    """Poll the journaled job_key of blast_result.
+
+    The server answers an unknown job_key with an error page, which
+    BlastSession returns like any other response that isn't worth
+    retrying, so job_found tells whether the job is still there.
+
+    Returns:
+        False if the job is gone, e.g. because its job_key has expired.
+    """
+    try:
+        with trace.phase('poll', blast_result):
+            await blast_result.async_poll_results()
+    finally:
+        trace.count('polls')
+    return blast_result.job_found()
+
+
+async def _wait_for_blast(blast_result, poll_scheduler, verbose, trace):
+    """Poll blast_result until it has finished running.
+
+    Args:
+        blast_result: a submitted PrimerBlastResult.
+        poll_scheduler: the scheduler.PollScheduler that decides when to poll,
+            and records the completion time of the job.
+        verbose: If True, print stepwise status messages.
+        trace: the metrics.StepTrace to book the sleeps and polls to.
+    """
+    if not blast_result.running:
+        return
+    last_running = 0
+    polls = 0
+    while blast_result.running:
+        last_running = time.monotonic() - blast_result.submitted_at
+        delay = poll_scheduler.next_delay(blast_result.status, last_running)
+        if verbose:
+            tompytools.generate_message(
+                '%s: Waiting %i seconds for BLAST' %
+                (blast_result.ref_seq, delay))
+        with trace.phase('sleep'):
+            await asyncio.sleep(delay)
+        if verbose:
+            tompytools.generate_message(
+                '%s.poll_results()' % blast_result.ref_seq)
+        with trace.phase('poll', blast_result):
+            await blast_result.async_poll_results()
+        trace.count('polls')
+        polls += 1
+    poll_scheduler.record(
+        blast_result.status,
+        last_running,
+        time.monotonic() - blast_result.submitted_at,
+        polls)
+
+
+async def async_run_primer_blast(
+        ref_seq,
+        blast_parameters,
+        status,
+        wait_seconds=60,
+        verbose=False,
+        rate_limiter=None,
+        session=None,
+        backend=None,
+        cache=None,
+        journal=None,
+        poll_scheduler=None,
+        retry_queue=None,
+        tracer=None,
+        batch_planner=None,
+        specificity_index=None):
+    """Run NCBI primer-blast and wait for results.
+
+    Submits a BLAST query for ref_seq using blast_parameters and an initial
+    status. Waits for BLAST server to finish query, polling every wait_seconds.
+    wait_seconds should be 60 to as per NCBI usage guidelines. Checks results
+    for exon/exon junction. Checks for similar templates and waits for new
+    BLAST query to finish if necessary. Lastly, checks whether primers were
+    found and if they are specific. If so, parses the primers.
+
+    Waiting is done with asyncio.sleep, so the event loop can keep many
+    queries in flight from a single process.
+
+    Args:
+        ref_seq: RefSeq sequence ID to design primers for.
+        status: the status of the primer set, e.g. 'strict' if submitting
+            the initial BLAST search with strict parameters.
+        blast_parameters: the parameters to use for designing the primers.
+        wait_seconds: minimum time to wait between polls of a BLAST job, if
+            poll_scheduler isn't given. NCBI usage guidelines state "Do not
+            poll for any single RID more often than once a minute".
+        verbose: If True, print stepwise status messages.
+        rate_limiter: the rate_limit.TokenBucket that all requests go
+            through. By default, use the process-wide limiter.
+        session: the session.BlastSession that makes all requests. By
+            default, use the process-wide session, which keeps connections
+            alive and retries transient failures.
+        backend: the backends.PrimerBlastBackend of the service to query.
+            By default, use the process-wide backend, which is NCBI.
+        cache: a cache.ResultCache to look up results in before submitting
+            BLAST queries, and to store new results in.
+        journal: a journal.Journal to record progress in, and to resume
+            from after a crash.
+        poll_scheduler: a scheduler.PollScheduler that decides when to poll
+            running jobs. By default, a new scheduler with min_interval
+            wait_seconds is used.
+        retry_queue: a scheduler.RetryQueue that decides when to re-submit
+            queries that didn't return a job_key. By default, a new queue
+            is used.
+        tracer: a metrics.Tracer that records the time spent in each phase
+            of each step. By default, a new tracer is used.
+        batch_planner: a planner.BatchPlanner whose TemplateRegistry is used
+            to submit queries with their similar templates filled in, if
+            they are known from another gene.
+        specificity_index: a kmer_index.KmerIndex of the transcriptome.
+            Opt-in: if given and NCBI finds primers that may not be
+            specific, the pairs are checked against the index, and the
+            first one without off-target products is used instead of
+            relaxing further. Such results keep the status of their step,
+            and are marked locally_verified.
+
+    Returns:
+        A PrimerBlastResult with attributes no_intron, no_primers_found and
+        off_targets.
+    """
+    if verbose:
+        tompytools.generate_message('Running BLAST for %s' % ref_seq)
+        print(
+            'ref_seq=%s\t\t\t'
+            'blast_parameters=%s\t\t\t'
+            'status=%s' %
+            (ref_seq, blast_parameters, status))
+
+    if poll_scheduler is None:
+        poll_scheduler = scheduler.PollScheduler(min_interval=wait_seconds)
+    if tracer is None:
+        tracer = metrics.Tracer()
+    trace = tracer.step(ref_seq, status)
+
+    # the parameters that identify this step in the cache and journal
+    step_parameters = blast_parameters.copy()
+
+    # check the journal for a finished or in-flight query from a previous run
+    journal_entry = None
+    if journal is not None:
+        journal_entry = journal.step(ref_seq, step_parameters, status)
+        if journal_entry and journal_entry['event'] == 'finished':
+            trace.finish('journal')
+            blast_result = PrimerBlastResult.from_record(
+                journal_entry['record'],
+                rate_limiter=rate_limiter,
+                session=session,
+                backend=backend)
+            _check_local_specificity(blast_result, specificity_index, verbose)
+            return blast_result
+
+    # use the cached result if we have one
+    if cache is not None:
+        cached_record = cache.get(ref_seq, step_parameters, status)
+        if cached_record is not None:
+            if verbose:
+                tompytools.generate_message(
+                    '%s: Using cached result for status %s' %
+                    (ref_seq, status))
+            trace.finish('cached')
+            blast_result = PrimerBlastResult.from_record(
+                cached_record,
+                rate_limiter=rate_limiter,
+                session=session,
+                backend=backend)
+            _check_local_specificity(blast_result, specificity_index, verbose)
+            return blast_result
+
+    # run the BLAST search
+    blast_result = PrimerBlastResult(
+        ref_seq=ref_seq,
+        blast_parameters=blast_parameters,
+        status=status,
+        rate_limiter=rate_limiter,
+        session=session,
+        backend=backend,
+        submit=False)
+    resumed = False
+    if journal_entry:
+        if verbose:
+            tompytools.generate_message(
+                '%s: Resuming job_key %s' %
+                (ref_seq, journal_entry['job_key']))
+        blast_result.blast_parameters = journal_entry['blast_parameters']
+        blast_result.job_key = journal_entry['job_key']
+        blast_result.submitted_at = time.monotonic() - max(
+            0, time.time() - journal_entry['time'])
+        resumed = await _resume(blast_result, trace)
+        if not resumed:
+            # the job is gone, so run it again with the journaled parameters
+            if verbose:
+                tompytools.generate_message(
+                    '%s: job_key %s has expired, resubmitting' %
+                    (ref_seq, journal_entry['job_key']))
+            journal.drop_step(ref_seq, step_parameters, status)
+            blast_result.job_key = None
+    if not resumed:
+        if batch_planner is not None:
+            user_seqloc = batch_planner.templates.prefill(
+                ref_seq, blast_result.blast_parameters)
+            if user_seqloc:
+                blast_result.user_seqloc = user_seqloc
+                if verbose:
+                    tompytools.generate_message(
+                        '%s: Using known similar sequences: %s' %
+                        (ref_seq, user_seqloc))
+        try:
+            with trace.phase('submit', blast_result):
+                await blast_result.async_submit_blast_request(
+                    poll=False, retry_queue=retry_queue)
+        except SubmissionError:
+            trace.finish('submission_failed')
+            raise
+        trace.count('submissions')
+        if journal is not None:
+            journal.record_submitted(
+                ref_seq, step_parameters, status, blast_result)
+
+    # wait for job to finish
+    await _wait_for_blast(blast_result, poll_scheduler, verbose, trace)
+
+    # check for exon/exon junction
+    if verbose:
+        tompytools.generate_message('%s.check_introns()' % ref_seq)
+    with trace.phase('parse', profile=True):
+        blast_result.check_introns()
+
+    # check for similar sequences and wait for re-run to finish if required
+    if verbose:
+        tompytools.generate_message('%s.check_similar_templates()' % ref_seq)
+    job_key = blast_result.job_key
+    try:
+        with trace.phase('similar_templates', blast_result):
+            await blast_result.async_check_similar_templates(
+                poll=False, retry_queue=retry_queue)
+    except SubmissionError:
+        trace.finish('submission_failed')
+        raise
+    if blast_result.job_key != job_key:
+        trace.count('submissions')
+        if batch_planner is not None:
+            batch_planner.templates.register(ref_seq, blast_result.user_seqloc)
+        if journal is not None:
+            journal.record_submitted(
+                ref_seq, step_parameters, status, blast_result)
+    await _wait_for_blast(blast_result, poll_scheduler, verbose, trace)
+
+    # check if we found primers
+    with trace.phase('parse', profile=True):
+        if verbose:
+            tompytools.generate_message('%s.check_success()' % ref_seq)
+        blast_result.check_success()
+        if verbose:
+            tompytools.generate_message('%s.check_specificity()' % ref_seq)
+        blast_result.check_specificity()
+        if not (blast_result.no_primers_found or blast_result.off_targets):
+            if verbose:
+                tompytools.generate_message('%s.parse_primers()' % ref_seq)
+            blast_result.parse_primers()
+
+    if cache is not None:
+        cache.put(
+            ref_seq, step_parameters, status,
+            blast_result.to_record(include_html=True))
+    if journal is not None:
+        journal.record_finished(ref_seq, step_parameters, status, blast_result)
+
+    # the cache and journal keep NCBI's answer, without the local check
+    with trace.phase('parse', profile=True):
+        local_pair = _check_local_specificity(
+            blast_result, specificity_index, verbose)
+
+    if blast_result.no_primers_found:
+        trace.finish('no_primers')
+    elif local_pair:
+        trace.finish('local_specificity')
+    elif blast_result.off_targets:
+        trace.finish('off_targets')
+    else:
+        trace.finish('primers')
+
+    # finished
+    return blast_result
+
+
+def run_primer_blast(
+        ref_seq,
+        blast_parameters,
+        status,
+        wait_seconds=60,
+        verbose=False,
+        **kwargs):
+    """Run NCBI primer-blast and wait for results.
+
+    Synchronous wrapper to async_run_primer_blast, which documents the
+    arguments. Can be called from a running event loop, like
+    multiple_primer_blast.
+
+    Args:
+        ref_seq: RefSeq sequence ID to design primers for.
+        blast_parameters: the parameters to use for designing the primers.
+        status: the status of the primer set, e.g. 'strict'.
+        wait_seconds: minimum time to wait between polls of a BLAST job.
+        verbose: If True, print stepwise status messages.
+        **kwargs: passed to async_run_primer_blast, e.g. cache or journal.
+
+    Returns:
+        A PrimerBlastResult with attributes no_intron, no_primers_found and
+        off_targets.
+    """
+    return _run_sync(async_run_primer_blast(
+        ref_seq=ref_seq,
+        blast_parameters=blast_parameters,
+        status=status,
+        wait_seconds=wait_seconds,
+        verbose=verbose,
+        **kwargs))
+
+
+async def async_iterate_primer_blast(
+        ref_seq,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        rate_limiter=None,
+        session=None,
+        backend=None,
+        cache=None,
+        journal=None,
+        poll_scheduler=None,
+        retry_queue=None,
+        tracer=None,
+        batch_planner=None,
+        speculation=0,
+        strategy=None,
+        templates=None,
+        specificity_index=None):
+    """Progressively relax BLAST parameters until primers are found.
+
+    Runs a BLAST query for ref_seq with starting_parameters using
+    async_run_primer_blast(). Checks results and re-runs with relaxed
+    parameters if the gene has no introns, no primers were found, or the
+    primers are not specific. The parameters are relaxed level by level,
+    following the relaxation ladder of strategy.
+
+    Args:
+        ref_seq: RefSeq sequence ID to design primers for.
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds, verbose, rate_limiter, session, backend, cache,
+            journal, poll_scheduler, retry_queue, tracer, batch_planner,
+            specificity_index: passed to async_run_primer_blast for each
+            step, which documents them. One poll_scheduler and retry_queue
+            are shared by the steps unless given.
+        speculation: number of extra relaxation steps to submit at the same
+            time as the next one. The strictest step that finds primers is
+            used, and the looser ones are cancelled and recorded as
+            cancelled in the journal. Speculative steps are only submitted
+            while the rate limiter's backlog is shorter than the poll
+            interval.
+        strategy: a relaxation.RelaxationStrategy that decides which
+            relaxation levels to submit. By default, a new strategy that
+            follows relaxation.DEFAULT_LADDER is used.
+        templates: dict of template sequences keyed by RefSeq ID, e.g.
+            from thermo.read_fasta. If the template of a gene is given,
+            the primer limits of each relaxation level are checked locally
+            first, the levels the template can't meet are skipped, and the
+            gene isn't submitted at all if no level can meet them, but
+            given status 'prescreen_infeasible'. Needs numpy.
+
+    Returns:
+        A PrimerBlastResult with status and parsed primers.
+    """
+    started = time.monotonic()
+    if tracer is None:
+        tracer = metrics.Tracer()
+
+    # skip genes that finished in a previous run
+    journal_record = None
+    if journal is not None:
+        journal_record = journal.gene(ref_seq, starting_parameters)
+    if journal_record is not None:
+        if verbose:
+            tompytools.generate_message(
+                '%s: Using result from journal' % ref_seq)
+        blast_result = PrimerBlastResult.from_record(
+            journal_record,
+            rate_limiter=rate_limiter,
+            session=session,
+            backend=backend)
+        tracer.record_gene(ref_seq, blast_result.status, 0.0, 0)
+        return blast_result
+
+    # share one poll scheduler and retry queue between the relaxation steps
+    if poll_scheduler is None:
+        poll_scheduler = scheduler.PollScheduler(min_interval=wait_seconds)
+    if retry_queue is None:
+        retry_queue = scheduler.RetryQueue()
+    if rate_limiter is None:
+        rate_limiter = rate_limit.get_rate_limiter()
+    run_step = functools.partial(
+        async_run_primer_blast,
+        ref_seq=ref_seq,
+        wait_seconds=wait_seconds,
+        verbose=verbose,
+        rate_limiter=rate_limiter,
+        session=session,
+        backend=backend,
+        cache=cache,
+        journal=journal,
+        poll_scheduler=poll_scheduler,
+        retry_queue=retry_queue,
+        tracer=tracer,
+        batch_planner=batch_planner,
+        specificity_index=specificity_index)
+
+    # skip the levels whose primer limits the template can't meet
+    if strategy is None:
+        strategy = relaxation.RelaxationStrategy()
+    next_level = 0
+    blast_parameters = starting_parameters
+    status = 'strict'
+    if templates is not None:
+        level_index, blast_parameters = await _prescreen(
+            ref_seq, starting_parameters, templates, strategy)
+        if level_index is None:
+            tompytools.generate_message(
+                '%s: No relaxation level can meet the primer limits, '
+                'not submitting' % ref_seq)
+            # a status of its own, as the screen is an estimate and the
+            # gene may still be worth submitting with other limits
+            blast_result = PrimerBlastResult(
+                ref_seq, 'prescreen_infeasible', blast_parameters,
+                rate_limiter=rate_limiter,
+                session=session,
+                backend=backend,
+                submit=False)
+            blast_result.no_intron = False
+            blast_result.no_primers_found = True
+            blast_result.off_targets = False
+            blast_result.running = False
+            if journal is not None:
+                journal.record_gene(blast_result, starting_parameters)
+            tracer.record_gene(
+                ref_seq, blast_result.status, time.monotonic() - started, 0)
+            return blast_result
+        if level_index >= 0:
+            if verbose:
+                tompytools.generate_message(
+                    '%s: Starting at relaxation level %s' %
+                    (ref_seq, strategy.levels[level_index].status))
+            status = strategy.levels[level_index].status
+            next_level = level_index + 1
+
+    # start iteration with starting_parameters
+    iterative_blast_result = await run_step(
+        blast_parameters=blast_parameters,
+        status=status)
+    steps = 1
+
+    # check for intron, pop and re-run if necessary
+    strict_result = None
+    if iterative_blast_result.no_intron:
+        tompytools.generate_message('Record %s has no introns' % ref_seq)
+        strict_result = iterative_blast_result
+        iterative_blast_result.blast_parameters.pop('SPAN_INTRON', None)
+        iterative_blast_result = await run_step(
+            blast_parameters=iterative_blast_result.blast_parameters,
+            status=iterative_blast_result.status)
+        steps += 1
+
+    # walk down the relaxation ladder until primers are found. The re-run
+    # without SPAN_INTRON can't find a missing junction, so no_intron comes
+    # from the first strict result
+    traits = relaxation.gene_traits(iterative_blast_result, strict_result)
+    while _needs_relaxing(iterative_blast_result):
+        # only speculate if the rate limiter can serve the extra queries
+        # before the next poll is due
+        batch_size = 1
+        if await rate_limiter.async_backlog() < poll_scheduler.min_interval:
+            batch_size += speculation
+        batch = strategy.plan(
+            iterative_blast_result.blast_parameters,
+            next_level,
+            traits,
+            batch_size)
+        if not batch:
+            break
+
+        level_steps = []
+        for index, level, blast_parameters in batch:
+            if level.message:
+                tompytools.generate_message(
+                    '%s: %s' % (ref_seq, level.message))
+            level_steps.append(asyncio.ensure_future(run_step(
+                blast_parameters=blast_parameters,
+                status=level.status)))
+        steps += len(level_steps)
+
+        # take the strictest level that succeeds and discard the looser ones
+        try:
+            for (index, level, blast_parameters), step in zip(
+                    batch, level_steps):
+                iterative_blast_result = await step
+                next_level = index + 1
+                strategy.record(
+                    traits,
+                    level.status,
+                    not _needs_relaxing(iterative_blast_result))
+                if not _needs_relaxing(iterative_blast_result):
+                    break
+        finally:
+            pending = [x for x in level_steps if not x.done()]
+            for step in pending:
+                step.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        # the looser steps were abandoned, so a resumed run mustn't poll them
+        if journal is not None:
+            for (index, level, blast_parameters), step in zip(
+                    batch, level_steps):
+                journal_entry = journal.step(
+                    ref_seq, blast_parameters, level.status)
+                if (step.cancelled() and journal_entry and
+                        journal_entry['event'] == 'submitted'):
+                    journal.cancel_step(
+                        ref_seq, blast_parameters, level.status)
+
+    # deal with leftover genes
+    if iterative_blast_result.no_primers_found:
+        iterative_blast_result.status = 'primer_quality_too_low'
+    if iterative_blast_result.off_targets:
+        iterative_blast_result.status = 'no_specific_primers'
+
+    if journal is not None:
+        journal.record_gene(iterative_blast_result, starting_parameters)
+    tracer.record_gene(
+        ref_seq,
+        iterative_blast_result.status,
+        time.monotonic() - started,
+        steps)
+
+    # finished
+    return iterative_blast_result
+
+
+def iterate_primer_blast(
+        ref_seq,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        **kwargs):
+    """Progressively relax BLAST parameters until primers are found.
+
+    Synchronous wrapper to async_iterate_primer_blast, which documents the
+    arguments. Can be called from a running event loop, like
+    multiple_primer_blast.
+
+    Args:
+        ref_seq: RefSeq sequence ID to design primers for.
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds: minimum time to wait between polls of a BLAST job.
+        verbose: If True, print stepwise status messages.
+        **kwargs: passed to async_iterate_primer_blast, e.g. cache, journal
+            or strategy.
+
+    Returns:
+        A PrimerBlastResult with status and parsed primers.
+    """
+    return _run_sync(async_iterate_primer_blast(
+        ref_seq=ref_seq,
+        starting_parameters=starting_parameters,
+        wait_seconds=wait_seconds,
+        verbose=verbose,
+        **kwargs))
+
+
+async def _async_iter(iterable):
+    """Iterate over an iterable or an async iterable."""
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def _write(sink, blast_result):
+    """Write blast_result to sink, with its async_write if it has one."""
+    if hasattr(sink, 'async_write'):
+        await sink.async_write(blast_result)
+    else:
+        sink.write(blast_result)
+
+
+async def _iterate_genes(
+        ref_seq_list,
+        starting_parameters,
+        n_jobs,
+        concurrency,
+        options):
+    """Run async_iterate_primer_blast for each gene, as results finish.
+
+    Genes are taken from ref_seq_list one at a time whenever one of the
+    n_jobs gene slots is free, so ref_seq_list can be a generator, or an
+    async generator, and is never copied. A gene gives up its slot while
+    its submission is waiting in retry_queue, and takes it back before
+    re-submitting. Finished results go through a queue of n_jobs places, so
+    no new genes are started if the consumer falls behind.
+
+    Genes whose submission is given up by retry_queue are yielded with
+    status 'submission_failed', and genes that fail with any other error
+    are yielded with status 'failed', instead of stopping the run. Only
+    cancellation, e.g. by KeyboardInterrupt, stops the other genes.
+
+    Duplicate genes in ref_seq_list are only run once, by batch_planner, and
+    don't take a gene slot while they wait for the result. If ref_seq_list
+    is a list or tuple, the duplicates are counted up front, so that a
+    finished gene's record is kept until its last duplicate has it. In a
+    generator, a gene is only shared with duplicates that come while it is
+    running.
+
+    If concurrency is given, its window of gene slots replaces the n_jobs
+    slots, and it is updated every concurrency.interval seconds.
+
+    Args:
+        ref_seq_list: iterable or async iterable of RefSeq IDs.
+        starting_parameters: passed to async_iterate_primer_blast.
+        n_jobs: number of gene slots.
+        concurrency: a concurrency.AdaptiveConcurrency, or None.
+        options: dict of the other arguments of async_iterate_primer_blast.
+            A poll_scheduler, retry_queue, tracer, batch_planner and
+            strategy are made for the genes to share unless given.
+
+    Yields:
+        Tuples of (index of the gene in ref_seq_list, PrimerBlastResult), in
+        the order they finish.
+    """
+    # a misspelt option would otherwise fail every gene one by one
+    inspect.signature(async_iterate_primer_blast).bind_partial(**options)
+    options = dict(options)
+    options.setdefault('wait_seconds', 60)
+    if options.get('poll_scheduler') is None:
+        options['poll_scheduler'] = scheduler.PollScheduler(
+            min_interval=options['wait_seconds'])
+    if options.get('retry_queue') is None:
+        options['retry_queue'] = scheduler.RetryQueue()
+    if options.get('tracer') is None:
+        options['tracer'] = metrics.Tracer()
+    if options.get('batch_planner') is None:
+        options['batch_planner'] = planner.BatchPlanner(functools.partial(
+            PrimerBlastResult.from_record,
+            rate_limiter=options.get('rate_limiter'),
+            session=options.get('session'),
+            backend=options.get('backend')))
+    if options.get('strategy') is None:
+        options['strategy'] = relaxation.RelaxationStrategy()
+    tracer = options['tracer']
+    batch_planner = options['batch_planner']
+    if isinstance(ref_seq_list, (list, tuple)):
+        # so that the planner only keeps records duplicates still need
+        batch_planner.plan(ref_seq_list, starting_parameters)
+    n_jobs = max(1, n_jobs)
+    gene_slots = asyncio.Semaphore(n_jobs)
+    if concurrency is not None:
+        gene_slots = concurrency
+    finished = asyncio.Queue(maxsize=n_jobs)
+    running = set()
+
+    async def control_concurrency():
+        while True:
+            window = await concurrency.async_update(
+                options.get('session') or blast_session.get_session(),
+                options.get('rate_limiter') or rate_limit.get_rate_limiter(),
+                options['poll_scheduler'])
+            tracer.set_gauge(
+                'concurrency_window', window,
+                'Genes allowed in flight by the adaptive concurrency '
+                'controller.')
+            tracer.set_gauge(
+                'genes_in_flight', concurrency.in_flight,
+                'Genes holding a gene slot.')
+            await asyncio.sleep(concurrency.interval)
+
+    async def run_gene(index, ref_seq, gene_slot):
+        _gene_slot.set(gene_slot)
+        started = time.monotonic()
+        try:
+            try:
+                blast_result = await async_iterate_primer_blast(
+                    ref_seq=ref_seq,
+                    starting_parameters=starting_parameters,
+                    **options)
+            except SubmissionError as error:
+                tompytools.generate_message(str(error))
+                blast_result = error.blast_result
+                blast_result.status = 'submission_failed'
+                blast_result.running = False
+                tracer.record_gene(
+                    ref_seq, blast_result.status,
+                    time.monotonic() - started, None)
+            except Exception as error:
+                # one gene's error doesn't stop the others
+                tompytools.generate_message(
+                    '%s: Failed with %s: %s' %
+                    (ref_seq, type(error).__name__, error))
+                blast_result = PrimerBlastResult(
+                    ref_seq=ref_seq,
+                    status='failed',
+                    blast_parameters=starting_parameters,
+                    rate_limiter=options.get('rate_limiter'),
+                    session=options.get('session'),
+                    backend=options.get('backend'),
+                    submit=False)
+                blast_result.running = False
+                tracer.record_gene(
+                    ref_seq, blast_result.status,
+                    time.monotonic() - started, None)
+        except BaseException as error:
+            # cancelled, so duplicates waiting for this gene are too
+            batch_planner.fail(ref_seq, starting_parameters, error)
+            raise
+        else:
+            batch_planner.resolve(ref_seq, starting_parameters, blast_result)
+            await finished.put((index, blast_result, None))
+        finally:
+            gene_slot.release()
+
+    async def share_gene(index, ref_seq):
+        try:
+            blast_result = await batch_planner.shared_result(
+                ref_seq, starting_parameters)
+        except Exception as error:
+            await finished.put((None, None, error))
+        else:
+            await finished.put((index, blast_result, None))
+
+    async def start_genes():
+        try:
+            index = -1
+            async for ref_seq in _async_iter(ref_seq_list):
+                index += 1
+                if batch_planner.claim(ref_seq, starting_parameters):
+                    await gene_slots.acquire()
+                    task = asyncio.ensure_future(
+                        run_gene(index, ref_seq, _GeneSlot(gene_slots)))
+                else:
+                    task = asyncio.ensure_future(share_gene(index, ref_seq))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            while running:
+                await asyncio.wait(set(running))
+        except Exception as error:
+            await finished.put((None, None, error))
+        else:
+            await finished.put(None)
+
+    starter = asyncio.ensure_future(start_genes())
+    controller = None
+    if concurrency is not None:
+        controller = asyncio.ensure_future(control_concurrency())
+    try:
+        while True:
+            item = await finished.get()
+            if item is None:
+                break
+            index, blast_result, error = item
+            if error is not None:
+                raise error
+            yield index, blast_result
+    finally:
+        tasks = [starter] + list(running)
+        if controller is not None:
+            tasks.append(controller)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def async_iter_primer_blast(
+        ref_seq_list,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        n_jobs=10,
+        concurrency=None,
+        sink=None,
+        **kwargs):
+    """Run iterate_primer_blast for multiple genes, yielding results as they
+    finish.
+
+    Async generator version of async_multiple_primer_blast. Each
+    PrimerBlastResult is yielded as soon as its gene is done, so results can
+    be used before the whole run has finished, and nothing is kept once it
+    has been yielded.
+
+    Args:
+        ref_seq_list: iterable or async iterable of RefSeq IDs
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds: minimum time to wait between polls of a BLAST job, if
+            poll_scheduler isn't given. NCBI usage guidelines state "Do not
+            poll for any single RID more often than once a minute".
+        verbose: If True, print stepwise status messages.
+        n_jobs: number of genes in flight. Requests are spaced out by
+            rate_limiter, so n_jobs doesn't need to be kept low to respect
+            NCBI usage guidelines.
+        concurrency: a concurrency.AdaptiveConcurrency that raises and
+            lowers the number of genes in flight as the server copes,
+            instead of keeping n_jobs genes in flight. Its window is
+            traced as the concurrency_window gauge of tracer.
+        sink: an object with a write method, e.g. a sinks.CsvSink, that each
+            result is written to before it is yielded. If it also has an
+            async_write coroutine method, e.g. a work_queue.WorkQueue, that
+            is used instead.
+        **kwargs: passed to async_iterate_primer_blast, e.g. rate_limiter,
+            cache, journal or speculation. Unless they are given, one
+            poll_scheduler, retry_queue, tracer and strategy are shared by
+            all genes, and a planner.BatchPlanner that runs duplicate genes
+            only once.
+
+    Yields:
+        PrimerBlastResult objects, in the order they finish.
+    """
+    genes = _iterate_genes(
+        ref_seq_list=ref_seq_list,
+        starting_parameters=starting_parameters,
+        n_jobs=n_jobs,
+        concurrency=concurrency,
+        options=dict(kwargs, wait_seconds=wait_seconds, verbose=verbose))
+    try:
+        async for index, blast_result in genes:
+            if sink is not None:
+                await _write(sink, blast_result)
+            yield blast_result
+    finally:
+        await genes.aclose()
+
+
+def iter_primer_blast(
+        ref_seq_list,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        n_jobs=10,
+        **kwargs):
+    """Run BLAST queries for multiple genes, yielding results as they finish.
+
+    Synchronous generator wrapper to async_iter_primer_blast, which
+    documents the arguments. The event loop runs while the generator is
+    waiting for the next result. Closing the generator early cancels the
+    genes still in flight. If the calling thread already runs an event
+    loop, e.g. in Jupyter, the genes run on a worker thread instead, and
+    each step of the generator blocks the calling loop until the next
+    result is ready.
+
+    Args:
+        ref_seq_list: iterable or async iterable of RefSeq IDs
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds: minimum time to wait between polls of a BLAST job.
+        verbose: If True, print stepwise status messages.
+        n_jobs: number of genes in flight.
+        **kwargs: passed to async_iter_primer_blast, e.g. sink, cache or
+            journal.
+
+    Yields:
+        PrimerBlastResult objects, in the order they finish.
+    """
+    loop = asyncio.new_event_loop()
+    worker = None
+    run = loop.run_until_complete
+    if _loop_running():
+        worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        def run(awaitable):
+            return worker.submit(loop.run_until_complete, awaitable).result()
+    results = async_iter_primer_blast(
+        ref_seq_list=ref_seq_list,
+        starting_parameters=starting_parameters,
+        wait_seconds=wait_seconds,
+        verbose=verbose,
+        n_jobs=n_jobs,
+        **kwargs)
+    try:
+        while True:
+            try:
+                yield run(results.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        try:
+            run(results.aclose())
+            run(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+            if worker is not None:
+                worker.shutdown()
+
+
+async def async_multiple_primer_blast(
+        ref_seq_list,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        n_jobs=10,
+        concurrency=None,
+        spill_directory=None,
+        archive=None,
+        page_store=None,
+        sink=None,
+        **kwargs):
+    """Run iterate_primer_blast for multiple genes on one event loop.
+
+    Runs async_iterate_primer_blast for each gene in ref_seq_list using
+    starting_parameters. At most n_jobs genes are in flight at once. Genes
+    waiting for the BLAST server don't hold a process or a thread, so n_jobs
+    can be much larger than the number of CPUs.
+
+    Args:
+        ref_seq_list: list of RefSeq IDs
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds: minimum time to wait between polls of a BLAST job, if
+            poll_scheduler isn't given. NCBI usage guidelines state "Do not
+            poll for any single RID more often than once a minute".
+        verbose: If True, print stepwise status messages.
+        n_jobs: number of genes in flight. Requests are spaced out by
+            rate_limiter, so n_jobs doesn't need to be kept low to respect
+            NCBI usage guidelines.
+        concurrency: a concurrency.AdaptiveConcurrency that raises and
+            lowers the number of genes in flight, as in
+            async_iter_primer_blast.
+        spill_directory: directory to write the compressed result pages to.
+            By default, a temporary directory is used, which is removed once
+            the records are no longer referenced.
+        archive: an archive.HtmlArchive to store the result pages in, instead
+            of spill_directory.
+        page_store: where to store the result pages instead, e.g.
+            records.MemoryPageStore() to keep them compressed in memory.
+        sink: an object with a write method, e.g. a sinks.CsvSink, that each
+            record is written to as soon as its gene is done.
+        **kwargs: passed to async_iterate_primer_blast, e.g. rate_limiter,
+            cache, journal or speculation, and shared by all genes as in
+            async_iter_primer_blast.
+
+    Returns:
+        A list of records.PrimerBlastRecord objects, one for each gene in
+        ref_seq_list. Each record only holds the parsed results. The result
+        page is loaded back when it's needed, e.g. by print_file.
+    """
+    if page_store is None and archive is not None:
+        page_store = archive
+    elif page_store is None:
+        # pages on disk, so that a large batch doesn't fill memory
+        page_store = records.SpillDirectory(spill_directory)
+
+    ref_seq_list = list(ref_seq_list)
+    blast_records = [None] * len(ref_seq_list)
+    genes = _iterate_genes(
+        ref_seq_list=ref_seq_list,
+        starting_parameters=starting_parameters,
+        n_jobs=n_jobs,
+        concurrency=concurrency,
+        options=dict(kwargs, wait_seconds=wait_seconds, verbose=verbose))
+    try:
+        async for index, blast_result in genes:
+            blast_records[index] = records.PrimerBlastRecord.from_result(
+                blast_result, page_store)
+            if sink is not None:
+                await _write(sink, blast_records[index])
+    finally:
+        await genes.aclose()
+    return blast_records
+
+
+def multiple_primer_blast(
+        ref_seq_list,
+        starting_parameters,
+        wait_seconds=60,
+        verbose=False,
+        n_jobs=10,
+        **kwargs):
+    """Run BLAST queries for multiple genes.
+
+    Synchronous wrapper to async_multiple_primer_blast, which runs
+    iterate_primer_blast for each gene in ref_seq_list using
+    starting_parameters, and documents the arguments. By default runs 10
+    genes simultaneously.
+
+    asyncio.run can't be used from a thread that already runs an event
+    loop, e.g. in Jupyter or an async web app, so there the genes run on a
+    new event loop in a worker thread, and the calling loop is blocked until
+    they are done. Use async_multiple_primer_blast to keep it running.
+
+    Args:
+        ref_seq_list: list of RefSeq IDs
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        wait_seconds: minimum time to wait between polls of a BLAST job.
+            NCBI usage guidelines state "Do not poll for any single RID more
+            often than once a minute".
+        verbose: If True, print stepwise status messages.
+        n_jobs: number of genes in flight.
+        **kwargs: passed to async_multiple_primer_blast, e.g. sink, cache or
+            journal.
+
+    Returns:
+        A list of records.PrimerBlastRecord objects, one for each gene in
+        ref_seq_list.
+    """
+    return _run_sync(async_multiple_primer_blast(
+        ref_seq_list=ref_seq_list,
+        starting_parameters=starting_parameters,
+        wait_seconds=wait_seconds,
+        verbose=verbose,
+        n_jobs=n_jobs,
+        **kwargs))
+
+
+async def async_run_worker(
+        work_queue,
+        starting_parameters,
+        n_jobs=10,
+        wait=True,
+        **kwargs):
+    """Work through the genes of a shared work queue.
+
+    Genes are claimed from work_queue one at a time, whenever one of the
+    n_jobs gene slots is free, and run with async_iter_primer_blast. Each
+    result is stored in work_queue as soon as it's done. The leases of the
+    genes in flight are renewed every third of work_queue.lease_seconds, and
+    handed back to the queue if the worker stops early.
+
+    Unless rate_limiter is given, requests go through
+    work_queue.rate_limiter(), so that the NCBI limit of one request every
+    three seconds holds across all workers of the queue.
+
+    Args:
+        work_queue: a work_queue.WorkQueue.
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        n_jobs: number of genes in flight on this worker.
+        wait: if True, keep going until every gene in the queue is done. When
+            there is nothing left to claim, the worker checks every minute
+            for genes whose lease has expired, until no other worker holds a
+            lease. If False, stop when there is nothing left to claim.
+        **kwargs: passed to async_iter_primer_blast, e.g. wait_seconds,
+            cache or journal.
+
+    Returns:
+        The number of genes this worker finished.
+    """
+    if kwargs.get('rate_limiter') is None:
+        kwargs['rate_limiter'] = work_queue.rate_limiter()
+    finished = 0
+
+    loop = asyncio.get_running_loop()
+
+    async def claims():
+        while True:
+            # claiming waits for the database lock, so not on the event loop
+            claimed = await loop.run_in_executor(None, work_queue.claim)
+            if not claimed:
+                return
+            yield claimed[0]
+
+    async def renew_leases():
+        while True:
+            await asyncio.sleep(work_queue.lease_seconds / 3)
+            await loop.run_in_executor(None, work_queue.renew)
+
+    renewer = asyncio.ensure_future(renew_leases())
+    try:
+        while True:
+            results = async_iter_primer_blast(
+                ref_seq_list=claims(),
+                starting_parameters=starting_parameters,
+                n_jobs=n_jobs,
+                sink=work_queue,
+                **kwargs)
+            try:
+                async for blast_result in results:
+                    finished += 1
+            finally:
+                await results.aclose()
+            if not wait:
+                break
+            next_expiry = await loop.run_in_executor(
+                None, work_queue.next_expiry)
+            if next_expiry is None:
+                break
+            await asyncio.sleep(min(next_expiry, 60))
+    finally:
+        renewer.cancel()
+        await asyncio.gather(renewer, return_exceptions=True)
+        await loop.run_in_executor(None, work_queue.release)
+    return finished
+
+
+def run_worker(
+        work_queue,
+        starting_parameters,
+        n_jobs=10,
+        wait=True,
+        **kwargs):
+    """Work through the genes of a shared work queue.
+
+    Synchronous wrapper to async_run_worker. Can be called from a running
+    event loop, like multiple_primer_blast. Run it on each machine, or in
+    each process, that shares work_queue, e.g.:
+
+        queue = work_queue.WorkQueue('/shared/panel.db')
+        queue.add(ref_seq_list)
+        run_worker(queue, starting_parameters, journal=journal)
+        queue.write_csv('panel.csv')
+
+    Args:
+        work_queue: a work_queue.WorkQueue.
+        starting_parameters: the strict parameters, which will be progressively
+            relaxed until primers are found.
+        n_jobs: number of genes in flight on this worker.
+        wait: if True, keep going until every gene in the queue is done,
+            including genes whose lease expires on other workers.
+        **kwargs: passed to async_iter_primer_blast, e.g. wait_seconds,
+            cache or journal.
+
+    Returns:
+        The number of genes this worker finished.
+    """
+    return _run_sync(async_run_worker(
+        work_queue=work_queue,
+        starting_parameters=starting_parameters,
+        n_jobs=n_jobs,
+        wait=wait,
+        **kwargs))
+
+
+async def async_resolve_multiplex(
+        blast_results,
+        starting_parameters,
+        max_rounds=1,
+        num_return=50,
+        max_end_complementarity=4,
+        max_tm_deviation=2.5,
+        verbose=False,
+        **kwargs):
+    """Make the primers of a panel compatible for multiplexing.
+
+    The primers of every gene are checked against the primers of every
+    other gene for 3' complementarity, and against the median melting
+    temperature of the panel, with multiplex.MultiplexPanel. Offending
+    genes, worst first, are given the first alternate primer pair from their
+    results page that is compatible with the rest of the panel. Offenders
+    without a compatible alternate are sent back through the relaxation
+    pipeline with async_multiple_primer_blast, asking for num_return pairs
+    within the panel's melting temperature range, for up to max_rounds
+    rounds. Needs numpy.
+
+    Args:
+        blast_results: list of finished results, e.g. from
+            multiple_primer_blast. Results are changed in place when an
+            alternate pair is used.
+        starting_parameters: the parameters the panel was designed with.
+        max_rounds: number of rounds of new BLAST queries. 0 to only use
+            the alternates already on the results pages.
+        num_return: number of primer pairs to ask for in new queries.
+        max_end_complementarity: largest acceptable 3' complementarity
+            of two primers of different genes, see
+            multiplex.end_complementarity.
+        max_tm_deviation: largest acceptable difference between a primer's
+            melting temperature and the median of the panel, or None.
+        verbose: If True, print stepwise status messages.
+        **kwargs: passed to async_multiple_primer_blast, e.g. wait_seconds,
+            cache or journal.
+
+    Returns:
+        A tuple of (blast_results, report). blast_results is a new list with
+        the results of the panel, in the same order, including the results
+        of new queries that were used. report is the multiplex.PanelReport
+        of the final panel.
+    """
+    from rt_primer_design import multiplex
+    loop = asyncio.get_running_loop()
+    panel = multiplex.MultiplexPanel(
+        blast_results,
+        max_end_complementarity=max_end_complementarity,
+        max_tm_deviation=max_tm_deviation)
+    report = await loop.run_in_executor(None, panel.check)
+    if verbose:
+        tompytools.generate_message(
+            'Panel of %d genes: %d conflicts, %d Tm outliers' % (
+                len(report.ref_seqs), len(report.conflicts),
+                len(report.tm_outliers)))
+    if report.compatible:
+        return panel.blast_results, report
+    unresolved = await loop.run_in_executor(
+        None, panel.swap_alternates, report)
+    if verbose:
+        tompytools.generate_message(
+            'Used alternate primers for %d of %d offending genes' % (
+                len(report.offenders) - len(unresolved),
+                len(report.offenders)))
+
+    parameters = panel.rerun_parameters(starting_parameters, num_return)
+    for _ in range(max_rounds):
+        if not unresolved:
+            break
+        if verbose:
+            tompytools.generate_message(
+                'Redesigning primers for %d genes' % len(unresolved))
+        rerun_results = await async_multiple_primer_blast(
+            ref_seq_list=unresolved,
+            starting_parameters=parameters,
+            verbose=verbose,
+            **kwargs)
+        unresolved = [x.ref_seq for x in rerun_results
+                      if not panel.adopt(x)]
+    report = await loop.run_in_executor(None, panel.check)
+    if verbose:
+        tompytools.generate_message(
+            'Panel of %d genes: %d conflicts, %d Tm outliers left' % (
+                len(report.ref_seqs), len(report.conflicts),
+                len(report.tm_outliers)))
+    return panel.blast_results, report
+
+
+def resolve_multiplex(
+        blast_results,
+        starting_parameters,
+        max_rounds=1,
+        num_return=50,
+        max_end_complementarity=4,
+        max_tm_deviation=2.5,
+        verbose=False,
+        **kwargs):
+    """Make the primers of a panel compatible for multiplexing.
+
+    Synchronous wrapper to async_resolve_multiplex. Can be called from a
+    running event loop, like multiple_primer_blast, e.g.:
+
+        blast_records = multiple_primer_blast(ref_seq_list, parameters)
+        blast_records, report = resolve_multiplex(blast_records, parameters)
+        for conflict in report.conflicts:
+            print(conflict)
+
+    Args:
+        blast_results: list of finished results, e.g. from
+            multiple_primer_blast.
+        starting_parameters: the parameters the panel was designed with.
+        max_rounds: number of rounds of new BLAST queries.
+        num_return: number of primer pairs to ask for in new queries.
+        max_end_complementarity: largest acceptable 3' complementarity
+            of two primers of different genes.
+        max_tm_deviation: largest acceptable difference between a primer's
+            melting temperature and the median of the panel, or None.
+        verbose: If True, print stepwise status messages.
+        **kwargs: passed to async_multiple_primer_blast.
+
+    Returns:
+        A tuple of (blast_results, report), see async_resolve_multiplex.
+    """
+    return _run_sync(async_resolve_multiplex(
+        blast_results=blast_results,
+        starting_parameters=starting_parameters,
+        max_rounds=max_rounds,
+        num_return=num_return,
+        max_end_complementarity=max_end_complementarity,
+        max_tm_deviation=max_tm_deviation,
+        verbose=verbose,
+        **kwargs))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import collections
+import html
+import re
+
+
+############
+# PROVIDES #
+############
+
+PrimerPair = collections.namedtuple(
+    'PrimerPair',
+    ['rank', 'F', 'R', 'TM_F', 'TM_R', 'GC_F', 'GC_R', 'length_F',
+     'length_R', 'start_F', 'stop_F', 'start_R', 'stop_R', 'self_any_F',
+     'self_any_R', 'self_end_F', 'self_end_R', 'product_size',
+     'intron_size'])
+PrimerPair.__doc__ = """A primer pair from a primer-BLAST results page.
+
+Attributes ending in _F are for the forward primer, and attributes ending in
+_R for the reverse primer. Numbers are parsed as int or float, and missing
+values are None.
+
+Attributes:
+    rank: position of the pair on the page, starting at 1
+    F, R: primer sequences
+    TM_F, TM_R: melting temperatures
+    GC_F, GC_R: GC content in percent
+    length_F, length_R: primer lengths
+    start_F, stop_F, start_R, stop_R: positions of the primers on the
+        template
+    self_any_F, self_any_R: self complementarity scores
+    self_end_F, self_end_R: self 3' complementarity scores
+    product_size: expected PCR product size
+    intron_size: expected size of intron(s) in the PCR product from genomic
+        DNA, or None if the page doesn't give one
+"""
+
+# the blocks of the page that hold one primer pair each
+_PAIR_INFO = re.compile(
+    rb'<(\w+)[^>]*\bclass\s*=\s*["\']?[^"\'>]*\bprPairInfo\b[^>]*>',
+    re.IGNORECASE)
+_TABLE = re.compile(rb'<table\b.*?</table\s*>', re.IGNORECASE | re.DOTALL)
+_ROW = re.compile(rb'<tr\b[^>]*>(.*?)(?=<tr\b|</table|$)',
+                  re.IGNORECASE | re.DOTALL)
+_CELL = re.compile(rb'<t([hd])\b[^>]*>(.*?)(?=<t[hd]\b|</tr|$)',
+                   re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(rb'<[^>]*>')
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+# primer columns, in the order primer-BLAST uses when there is no header
+_COLUMNS = ('sequence', 'strand', 'length', 'start', 'stop', 'tm', 'gc',
+            'self_any', 'self_end')
+
+
+def _text(cell):
+    """Text of a table cell, without tags or surrounding whitespace."""
+    return html.unescape(
+        _TAG.sub(b'', cell).decode('utf-8', 'replace')).strip()
+
+
+def _column(header):
+    """Map a header cell of the primer table to a column name, or None."""
+    header = header.lower()
+    if 'sequence' in header:
+        return 'sequence'
+    if 'strand' in header:
+        return 'strand'
+    if "3'" in header:
+        return 'self_end'
+    if 'complementarity' in header:
+        return 'self_any'
+    for column in ('length', 'start', 'stop', 'tm', 'gc'):
+        if header.startswith(column):
+            return column
+    return None
+
+
+def _number(text):
+    """The first number in text as an int or float, or None."""
+    match = _NUMBER.search(text)
+    if match is None:
+        return None
+    number = match.group(0)
+    return float(number) if '.' in number else int(number)
+
+
+def _parse_table(table, rank):
+    """Parse the primer table of one pair into a PrimerPair, or None."""
+    columns = _COLUMNS
+    primers = {}
+    values = {}
+    for row in _ROW.finditer(table):
+        cells = [(kind.lower(), _text(cell))
+                 for kind, cell in _CELL.findall(row.group(1))]
+        if not cells:
+            continue
+        if all(kind == b'h' for kind, text in cells) and len(cells) > 2:
+            columns = [_column(text) for kind, text in cells[1:]]
+            continue
+        label = cells[0][1].lower()
+        data = [text for kind, text in cells[1:]]
+        if label.startswith('forward primer'):
+            primers['F'] = dict(zip(columns, data))
+        elif label.startswith('reverse primer'):
+            primers['R'] = dict(zip(columns, data))
+        elif label.startswith('product length') and data:
+            values['product_size'] = _number(data[0])
+        elif label.startswith('total intron size') and data:
+            values['intron_size'] = _number(data[0])
+
+    if 'F' not in primers or 'R' not in primers:
+        return None
+    fields = {'rank': rank}
+    for strand, primer in primers.items():
+        fields[strand] = primer.get('sequence')
+        fields['TM_' + strand] = _number(primer.get('tm', ''))
+        fields['GC_' + strand] = _number(primer.get('gc', ''))
+        for column in ('length', 'start', 'stop', 'self_any', 'self_end'):
+            fields['%s_%s' % (column, strand)] = _number(
+                primer.get(column, ''))
+    fields['product_size'] = values.get('product_size')
+    fields['intron_size'] = values.get('intron_size')
+    return PrimerPair(**fields)
+
+
+def parse_primer_pairs(content):
+    """Parse every primer pair on a primer-BLAST results page.
+
+    Each pair is in its own block with class 'prPairInfo', holding a table
+    with a header row, a row for each primer, and rows for the product
+    length and, if the primers span an intron, the total intron size.
+
+    Args:
+        content: the page as bytes or str.
+
+    Returns:
+        A list of PrimerPair, in the order they appear on the page, which is
+        the order primer-BLAST ranks them in.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    blocks = [match.end() for match in _PAIR_INFO.finditer(content)]
+    pairs = []
+    for start, end in zip(blocks, blocks[1:] + [len(content)]):
+        table = _TABLE.search(content, start, end)
+        if table is None:
+            continue
+        pair = _parse_table(table.group(0), len(pairs) + 1)
+        if pair is not None:
+            pairs.append(pair)
+    return pairs
+
+
+def legacy_fields(pair):
+    """The F, R, TM_F, TM_R, product_size and intron_size attributes of a
+    PrimerBlastResult for pair, as str like the page shows them."""
+    def text(value, template='%s'):
+        return '' if value is None else template % value
+    return {
+        'F': pair.F,
+        'R': pair.R,
+        'TM_F': text(pair.TM_F, '%.2f'),
+        'TM_R': text(pair.TM_R, '%.2f'),
+        'product_size': text(pair.product_size),
+        'intron_size': text(pair.intron_size)}
+
+
+def to_records(pairs):
+    """Convert a list of PrimerPair to a list of dicts for JSON."""
+    if pairs is None:
+        return None
+    return [dict(pair._asdict()) for pair in pairs]
+
+
+def from_records(records):
+    """Convert the output of to_records back to a list of PrimerPair."""
+    if records is None:
+        return None
+    return [x if isinstance(x, PrimerPair) else PrimerPair(**x)
+            for x in records]
+
+
+def select_pairs(pairs, min_product_size=None, max_product_size=None,
+                 max_tm_difference=None, max_self_end=None,
+                 exclude_primers=(), accept=None):
+    """Pick the primer pairs that meet local criteria, in rank order.
+
+    Args:
+        pairs: a list of PrimerPair.
+        min_product_size: smallest acceptable product size.
+        max_product_size: largest acceptable product size.
+        max_tm_difference: largest acceptable difference between the melting
+            temperatures of the forward and reverse primers.
+        max_self_end: largest acceptable self 3' complementarity score of
+            either primer.
+        exclude_primers: primer sequences that must not be used, e.g. ones
+            known to form cross-dimers with other primers in the reaction.
+        accept: a function that takes a PrimerPair and returns False if the
+            pair should be rejected, for any other criteria.
+
+    Returns:
+        A list of PrimerPair.
+    """
+    exclude_primers = {x.upper() for x in exclude_primers}
+    selected = []
+    for pair in pairs:
+        if (min_product_size is not None and
+                (pair.product_size or 0) < min_product_size):
+            continue
+        if (max_product_size is not None and
+                (pair.product_size or 0) > max_product_size):
+            continue
+        if (max_tm_difference is not None and
+                abs((pair.TM_F or 0) - (pair.TM_R or 0)) > max_tm_difference):
+            continue
+        if max_self_end is not None and max(
+                pair.self_end_F or 0, pair.self_end_R or 0) > max_self_end:
+            continue
+        if (pair.F or '').upper() in exclude_primers:
+            continue
+        if (pair.R or '').upper() in exclude_primers:
+            continue
+        if accept is not None and not accept(pair):
+            continue
+        selected.append(pair)
+    return selected
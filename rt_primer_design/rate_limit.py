@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+
+############
+# PROVIDES #
+############
+
+class TokenBucket:
+    """Token-bucket rate limiter for requests to the BLAST server.
+
+    Every request reserves one token. Tokens are refilled at rate per second
+    up to burst. If the bucket is empty the reservation goes into debt, and
+    the caller waits until its token has been refilled, so waiting callers
+    are served in the order they arrived.
+
+    If state_file is given, the bucket state is kept in that file under an
+    exclusive lock, so that all processes using the same state_file share one
+    budget.
+
+    Attributes:
+        rate: tokens added per second. NCBI usage guidelines state "Do not
+            contact the server more often than once every three seconds".
+        burst: maximum number of tokens in the bucket.
+        state_file: path to the shared state file, or None.
+        requests: number of tokens handed out by this object.
+        queued_seconds: total time callers of this object spent waiting for
+            a token.
+        max_queued_seconds: longest single wait for a token.
+    """
+    def __init__(self, rate=1 / 3, burst=1, state_file=None):
+        """Init TokenBucket.
+
+        Args:
+            rate: tokens added per second.
+            burst: maximum number of tokens in the bucket.
+            state_file: optional path to a file for sharing the bucket
+                between processes.
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        if burst < 1:
+            raise ValueError('burst must be at least 1')
+        self.rate = rate
+        self.burst = burst
+        self.state_file = state_file
+        self.requests = 0
+        self.queued_seconds = 0.0
+        self.max_queued_seconds = 0.0
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = self._clock()
+
+    def _clock(self):
+        """Wall-clock time if shared between processes, monotonic if not."""
+        if self.state_file:
+            return time.time()
+        return time.monotonic()
+
+    def _shared(self):
+        """True if _update locks state shared with other processes, and may
+        block for a while."""
+        return bool(self.state_file)
+
+    def _refill(self, tokens, updated, now):
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def _update(self, cost):
+        """Refill the bucket, take cost tokens and return the wait in
+        seconds before the last token taken is available."""
+        now = self._clock()
+        if not self.state_file:
+            self._tokens = self._refill(
+                self._tokens, self._updated, now) - cost
+            self._updated = now
+            return max(0.0, -self._tokens / self.rate)
+
+        import fcntl
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as state:
+            fcntl.flock(state, fcntl.LOCK_EX)
+            try:
+                saved = json.loads(state.read() or '{}')
+                tokens = self._refill(
+                    saved.get('tokens', self.burst),
+                    saved.get('updated', now),
+                    now) - cost
+                state.seek(0)
+                state.truncate()
+                state.write(json.dumps({'tokens': tokens, 'updated': now}))
+                state.flush()
+            finally:
+                fcntl.flock(state, fcntl.LOCK_UN)
+        return max(0.0, -tokens / self.rate)
+
+    def reserve(self):
+        """Reserve a token.
+
+        Returns:
+            The number of seconds to wait before using the token.
+        """
+        with self._lock:
+            delay = self._update(1)
+            self.requests += 1
+            self.queued_seconds += delay
+            self.max_queued_seconds = max(self.max_queued_seconds, delay)
+        return delay
+
+    def backlog(self):
+        """Seconds a new request would have to wait for a token."""
+        with self._lock:
+            return self._update(0)
+
+    async def async_backlog(self):
+        """Async twin of backlog.
+
+        A shared bucket is locked in the default executor, as in
+        async_acquire.
+        """
+        if self._shared():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.backlog)
+        return self.backlog()
+
+    def acquire(self):
+        """Wait for a token.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def async_acquire(self):
+        """Async twin of acquire.
+
+        A shared bucket is locked in the default executor, so that waiting
+        for the lock doesn't stall the event loop.
+        """
+        if self._shared():
+            delay = await asyncio.get_running_loop().run_in_executor(
+                None, self.reserve)
+        else:
+            delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self):
+        """Counters for the requests handed out by this object.
+
+        Returns:
+            A dict with keys requests, queued_seconds and max_queued_seconds.
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'queued_seconds': self.queued_seconds,
+                'max_queued_seconds': self.max_queued_seconds}
+
+
+_default_rate_limiter = None
+
+
+def get_rate_limiter():
+    """Return the process-wide TokenBucket, creating it if necessary.
+
+    The default limiter allows one request every three seconds, as per NCBI
+    usage guidelines.
+    """
+    global _default_rate_limiter
+    if _default_rate_limiter is None:
+        _default_rate_limiter = TokenBucket()
+    return _default_rate_limiter
+
+
+def set_rate_limiter(rate_limiter):
+    """Replace the process-wide TokenBucket.
+
+    Args:
+        rate_limiter: the TokenBucket to use for all requests that aren't
+            given a limiter explicitly.
+    """
+    global _default_rate_limiter
+    _default_rate_limiter = rate_limiter
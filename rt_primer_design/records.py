@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import gzip
+import os
+import re
+import tempfile
+import threading
+import urllib.parse
+import zlib
+from rt_primer_design import primers
+
+
+############
+# PROVIDES #
+############
+
+class MemoryPageStore:
+    """Keep result pages in memory, compressed with zlib."""
+    def __init__(self):
+        """Init MemoryPageStore."""
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def put(self, ref_seq, status, content):
+        """Store the page for ref_seq and status.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set, e.g. 'strict'.
+            content: the page as bytes.
+        """
+        with self._lock:
+            self._pages[(ref_seq, status)] = zlib.compress(content)
+
+    def get(self, ref_seq, status):
+        """Return the page for ref_seq and status as bytes, or None."""
+        with self._lock:
+            page = self._pages.get((ref_seq, status))
+        if page is None:
+            return None
+        return zlib.decompress(page)
+
+
+class SpillDirectory:
+    """Keep result pages in a directory, one gzip file per page.
+
+    Attributes:
+        path: the directory. It is created if it doesn't exist.
+    """
+    def __init__(self, path=None):
+        """Init SpillDirectory.
+
+        Args:
+            path: the directory to write pages to. By default, a new
+                temporary directory, which is removed when the
+                SpillDirectory is garbage collected.
+        """
+        self._temporary = None
+        if path is None:
+            self._temporary = tempfile.TemporaryDirectory(
+                prefix='rt_primer_design_')
+            path = self._temporary.name
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _page_file(self, ref_seq, status):
+        """Path to the page for ref_seq and status.
+
+        Both are percent-encoded, so that a path separator in either can't
+        put the page outside the directory.
+        """
+        return os.path.join(self.path, '%s.%s.html.gz' % (
+            urllib.parse.quote(ref_seq, safe=''),
+            urllib.parse.quote(status, safe='')))
+
+    def put(self, ref_seq, status, content):
+        """Store the page for ref_seq and status.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set, e.g. 'strict'.
+            content: the page as bytes.
+        """
+        with gzip.open(self._page_file(ref_seq, status), 'wb') as page:
+            page.write(content)
+
+    def get(self, ref_seq, status):
+        """Return the page for ref_seq and status as bytes, or None."""
+        page_file = self._page_file(ref_seq, status)
+        if not os.path.exists(page_file):
+            return None
+        with gzip.open(page_file, 'rb') as page:
+            return page.read()
+
+
+_FIELDS = (
+    'ref_seq', 'status', 'blast_parameters', 'job_key', 'no_intron',
+    'no_primers_found', 'off_targets', 'user_seqloc', 'F', 'R', 'TM_F',
+    'TM_R', 'product_size', 'intron_size', 'primer_pairs',
+    'locally_verified')
+
+
+class PrimerBlastRecord:
+    """Compact record of a finished PrimerBlastResult.
+
+    Only the parsed fields are kept. The result page is written to a page
+    store when the record is created, and only read back and parsed if html
+    is accessed, e.g. by print_file.
+
+    Attributes:
+        F: Forward primer
+        R: Reverse primer
+        TM_F: TM of the forward primer
+        TM_R: TM of the reverse primer
+        blast_parameters: the parameters used for the final BLAST query
+        html: the result page parsed with BeautifulSoup lxml parser, or None
+            if the page wasn't stored
+        intron_size: expected size of intron(s) in the PCR product from genomic
+            DNA
+        job_key: job_key of the final BLAST query
+        locally_verified: True if the primers were found to be specific by
+            a local kmer_index.KmerIndex rather than by NCBI
+        no_intron: True if no exon/exon junction was found
+        no_primers_found: True if no primers were found
+        off_targets: True if the primers may not be specific
+        primer_pairs: list of primers.PrimerPair for every primer pair on the
+            result page, or None
+        product_size: expected PCR product size
+        ref_seq: RefSeq sequence ID
+        status: the status of the primer set
+        user_seqloc: USER_SEQLOC values for similar templates
+    """
+    __slots__ = _FIELDS + ('_page_store', '_html')
+
+    def __init__(self, ref_seq, status, page_store=None, **fields):
+        """Init PrimerBlastRecord.
+
+        Args:
+            ref_seq: RefSeq sequence ID.
+            status: the status of the primer set.
+            page_store: a MemoryPageStore, SpillDirectory or
+                archive.HtmlArchive holding the result page, or None.
+            **fields: values for the other attributes. Missing attributes are
+                set to None.
+        """
+        self.ref_seq = ref_seq
+        self.status = status
+        for field in _FIELDS[2:]:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError('Unexpected fields: %s' % ', '.join(fields))
+        self.primer_pairs = primers.from_records(self.primer_pairs)
+        self._page_store = page_store
+        self._html = None
+
+    @classmethod
+    def from_result(cls, blast_result, page_store=None):
+        """Make a record from a finished PrimerBlastResult.
+
+        Args:
+            blast_result: the PrimerBlastResult.
+            page_store: where to put the result page. If None, the page is
+                discarded.
+
+        Returns:
+            A PrimerBlastRecord.
+        """
+        record = blast_result.to_record()
+        record.pop('url', None)
+        if page_store is not None and blast_result.content is not None:
+            page_store.put(blast_result.ref_seq, blast_result.status,
+                           blast_result.content)
+        return cls(page_store=page_store, **record)
+
+    def __eq__(self, other):
+        """Compare records by job_key."""
+        return self.job_key == other.job_key
+
+    def __str__(self):
+        """Formatted html result."""
+        return str(self.html)
+
+    @property
+    def content(self):
+        """The raw bytes of the result page, or None."""
+        if self._page_store is None:
+            return None
+        return self._page_store.get(self.ref_seq, self.status)
+
+    @property
+    def html(self):
+        """The result page parsed with BeautifulSoup, loaded on first use."""
+        if self._html is None:
+            content = self.content
+            if content is not None:
+                from bs4 import BeautifulSoup
+                self._html = BeautifulSoup(content, 'lxml')
+        return self._html
+
+    def release_html(self):
+        """Drop the parsed page from memory. It is reloaded if needed."""
+        self._html = None
+
+    def to_record(self):
+        """Summarise the record as a dict, like PrimerBlastResult.to_record."""
+        record = {x: getattr(self, x) for x in _FIELDS}
+        record['primer_pairs'] = primers.to_records(self.primer_pairs)
+        return record
+
+    def use_primer_pair(self, pair):
+        """Set the primer attributes from pair, like
+        PrimerBlastResult.use_primer_pair."""
+        for field, value in primers.legacy_fields(pair).items():
+            setattr(self, field, value)
+
+    def csv_line(self, locally_verified=False):
+        """Print a line of csv.
+
+        Args:
+            locally_verified: if True, add a column with self.locally_verified.
+
+        Returns:
+            A str of text in csv format, as PrimerBlastResult.csv_line.
+        """
+        if self.F is None:
+            line = '{0},{1},,,,,,'.format(self.ref_seq, self.status)
+        else:
+            line = '{0},{1},{2},{3},{4},{5},{6},{7}'.format(
+                self.ref_seq,       # 0
+                self.status,        # 1
+                self.F,             # 2
+                self.TM_F,          # 3
+                self.R,             # 4
+                self.TM_R,          # 5
+                self.product_size,  # 6
+                self.intron_size)   # 7
+        if locally_verified:
+            line += ',%s' % bool(self.locally_verified)
+        return line
+
+    def replace_css_links(self):
+        """Replace the local css links in self.html with absolute paths."""
+        css_links = self.html.findAll(href=re.compile('css'))
+        for link in css_links:
+            link['href'] = ('https://www.ncbi.nlm.nih.gov/'
+                            'tools/primer-blast/' + link['href'])
+
+    def print_file(self, output_subdirectory):
+        """Print html to a file in output_subdirectory"""
+        output_file = output_subdirectory + "/" + self.ref_seq + ".html"
+        with open(output_file, 'w') as file:
+            print(self.html, file=file)
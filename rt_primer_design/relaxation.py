@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import collections
+import json
+import os
+import threading
+
+
+############
+# PROVIDES #
+############
+
+class RelaxationLevel(collections.namedtuple(
+        'RelaxationLevel',
+        ['status', 'message', 'set_parameters', 'drop_parameters'])):
+    """One step of the relaxation ladder.
+
+    Attributes:
+        status: the status given to primers found at this level, e.g. 'GC1'.
+        message: message printed when the level is tried, or None.
+        set_parameters: dict of blast_parameters to set.
+        drop_parameters: tuple of blast_parameters to remove.
+    """
+    __slots__ = ()
+
+    def apply(self, blast_parameters):
+        """Relax blast_parameters.
+
+        Args:
+            blast_parameters: the parameters of the previous level.
+
+        Returns:
+            A new dict of parameters for this level.
+        """
+        relaxed = blast_parameters.copy()
+        relaxed.update(self.set_parameters)
+        for parameter in self.drop_parameters:
+            relaxed.pop(parameter, None)
+        return relaxed
+
+
+DEFAULT_LADDER = (
+    RelaxationLevel(
+        'GC1', 'Relaxing GC clamp',
+        {'GC_CLAMP': '1'}, ()),
+    RelaxationLevel(
+        'GC0', None,
+        {'GC_CLAMP': '0'}, ()),
+    RelaxationLevel(
+        'GC_content', 'Relaxing GC content',
+        {'PRIMER_MIN_GC': '35', 'PRIMER_MAX_GC': '65'}, ()),
+    RelaxationLevel(
+        'Low_TM', 'Relaxing primer TM',
+        {'PRIMER_MIN_GC': '35', 'PRIMER_MAX_GC': '65'}, ()),
+    RelaxationLevel(
+        'Potential_Dimers', 'Relaxing primer self-complementarity',
+        {'SELF_ANY': '5', 'SELF_END': '2'}, ()),
+    RelaxationLevel(
+        'Probable_Dimers',
+        'Using default primer self-complementarity (caution)',
+        {'SELF_ANY': '8', 'SELF_END': '3'}, ()),
+    RelaxationLevel(
+        'No_repeat_filter', 'Disabling repeat filter',
+        {}, ('LOW_COMPLEXITY_FILTER',)))
+
+
+def gene_traits(blast_result, strict_result=None):
+    """Traits of a gene that predict which relaxation levels will work.
+
+    Args:
+        blast_result: the PrimerBlastResult of the strict query.
+        strict_result: the first result of the strict query, if it was run
+            again without SPAN_INTRON. Only the first one tells if an
+            exon/exon junction was found.
+
+    Returns:
+        A tuple of trait names: 'no_intron' if no exon/exon junction was
+        found, 'similar_templates' if NCBI reported similar templates, and
+        'off_targets' or 'no_primers_found' for the way the strict query
+        failed.
+    """
+    traits = []
+    if (getattr(blast_result, 'no_intron', False) or
+            getattr(strict_result, 'no_intron', False)):
+        traits.append('no_intron')
+    if getattr(blast_result, 'user_seqloc', None):
+        traits.append('similar_templates')
+    if getattr(blast_result, 'off_targets', False):
+        traits.append('off_targets')
+    elif getattr(blast_result, 'no_primers_found', False):
+        traits.append('no_primers_found')
+    return tuple(traits)
+
+
+class RelaxationStrategy:
+    """Choose which relaxation levels to submit.
+
+    Levels that don't change the parameters, e.g. 'Low_TM' after
+    'GC_content' in DEFAULT_LADDER, are always skipped, because they would
+    give the same result as the level before.
+
+    The strategy also records how often each level finds primers for genes
+    with each set of traits (see gene_traits). If skip_below is set, levels
+    whose success rate for the gene's traits is below skip_below after at
+    least min_attempts attempts are skipped. Skipped levels still relax the
+    parameters, so the next level that is submitted includes their changes.
+    The last level is never skipped.
+
+    Attributes:
+        levels: sequence of RelaxationLevel, from strictest to loosest.
+        skip_below: minimum success rate for a level to be tried, or None to
+            try every level.
+        min_attempts: number of attempts before a level can be skipped.
+        stats_file: JSON file the success counts are loaded from and saved
+            to, or None.
+    """
+    def __init__(self, levels=DEFAULT_LADDER, skip_below=None,
+                 min_attempts=20, stats_file=None):
+        """Init RelaxationStrategy.
+
+        Args:
+            levels: sequence of RelaxationLevel, from strictest to loosest.
+            skip_below: minimum success rate for a level to be tried.
+            min_attempts: number of attempts before a level can be skipped.
+            stats_file: JSON file to load success counts from.
+        """
+        self.levels = tuple(levels)
+        self.skip_below = skip_below
+        self.min_attempts = min_attempts
+        self.stats_file = stats_file
+        self._counts = {}
+        self._lock = threading.Lock()
+        if stats_file and os.path.exists(stats_file):
+            with open(stats_file) as stats:
+                for entry in json.load(stats):
+                    key = (tuple(entry['traits']), entry['status'])
+                    self._counts[key] = [entry['attempts'], entry['successes']]
+
+    def record(self, traits, status, success):
+        """Record the outcome of a level.
+
+        Args:
+            traits: the gene's traits from gene_traits.
+            status: the status of the level.
+            success: True if specific primers were found.
+        """
+        with self._lock:
+            counts = self._counts.setdefault((tuple(traits), status), [0, 0])
+            counts[0] += 1
+            counts[1] += bool(success)
+
+    def success_rate(self, traits, status):
+        """Observed success rate of a level for genes with traits.
+
+        Returns:
+            A tuple of (success rate or None, number of attempts).
+        """
+        with self._lock:
+            attempts, successes = self._counts.get(
+                (tuple(traits), status), (0, 0))
+        if not attempts:
+            return None, 0
+        return successes / attempts, attempts
+
+    def _likely_to_fail(self, traits, status):
+        """True if the level should be skipped for genes with traits."""
+        if self.skip_below is None:
+            return False
+        rate, attempts = self.success_rate(traits, status)
+        return attempts >= self.min_attempts and rate < self.skip_below
+
+    def plan(self, blast_parameters, start, traits, count=1):
+        """Pick the next levels to submit.
+
+        Args:
+            blast_parameters: parameters of the last level that was run.
+            start: index in self.levels of the first level not yet run.
+            traits: the gene's traits from gene_traits.
+            count: maximum number of levels to pick.
+
+        Returns:
+            A list of (index, RelaxationLevel, parameters) tuples, in order
+            from strictest to loosest. Each level's parameters include the
+            changes made by all levels before it.
+        """
+        planned = []
+        for index in range(start, len(self.levels)):
+            level = self.levels[index]
+            relaxed = level.apply(blast_parameters)
+            last_level = index == len(self.levels) - 1
+            skip = relaxed == blast_parameters or (
+                not last_level and self._likely_to_fail(traits, level.status))
+            blast_parameters = relaxed
+            if skip:
+                continue
+            planned.append((index, level, relaxed))
+            if len(planned) == count:
+                break
+        return planned
+
+    def stats(self):
+        """Success counts per traits and status.
+
+        Returns:
+            A list of dicts with keys traits, status, attempts and successes.
+        """
+        with self._lock:
+            return [
+                {'traits': list(traits), 'status': status,
+                 'attempts': attempts, 'successes': successes}
+                for (traits, status), (attempts, successes)
+                in sorted(self._counts.items())]
+
+    def save(self, stats_file=None):
+        """Write the success counts to stats_file, or to self.stats_file."""
+        stats_file = stats_file or self.stats_file
+        with open(stats_file, 'w') as stats:
+            json.dump(self.stats(), stats, indent=1)
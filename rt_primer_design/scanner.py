@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import collections
+import html
+import re
+
+
+############
+# PROVIDES #
+############
+
+PageSummary = collections.namedtuple(
+    'PageSummary',
+    ['odd', 'info', 'warning', 'param_summary', 'expl', 'breadcrumb',
+     'job_key', 'user_seqloc'])
+PageSummary.__doc__ = """The parts of a primer-BLAST page needed to check its
+status.
+
+Attributes:
+    odd: text of the first element with class 'odd', or None
+    info: text of the first element with class 'info', or None
+    warning: text of the first element with class 'warning', or None
+    param_summary: text of the first element with class 'paramSummary', or
+        None
+    expl: text of the first element with id 'expl', or None
+    breadcrumb: text of the first element with id 'breadcrumb', or None
+    job_key: value of the first element named 'job_key', or None
+    user_seqloc: list of the values of the USER_SEQLOC checkboxes
+"""
+
+_CLASS_MARKERS = {
+    'odd': 'odd',
+    'info': 'info',
+    'warning': 'warning',
+    'paramSummary': 'param_summary'}
+_ID_MARKERS = {
+    'expl': 'expl',
+    'breadcrumb': 'breadcrumb'}
+
+# start tags with attributes, where quoted values may hold '>'
+_START_TAG = re.compile(
+    rb'''<([a-zA-Z][\w:-]*)(\s(?:"[^"]*"|'[^']*'|[^>"'])*)>''')
+_MARKER = re.compile(
+    rb'odd|info|warning|paramSummary|expl|breadcrumb|job_key|USER_SEQLOC')
+_ATTRIBUTE = re.compile(
+    rb'''([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+# comments, and elements whose content isn't html
+_IGNORED = re.compile(
+    rb'<!--.*?-->|<(script|style)\b[^>]*>.*?</\1\s*>',
+    re.DOTALL | re.IGNORECASE)
+_TAG = re.compile(rb'''<(/?)([a-zA-Z][\w:-]*)(?:"[^"]*"|'[^']*'|[^>"'])*>''')
+_VOID_ELEMENTS = frozenset([
+    b'area', b'base', b'br', b'col', b'embed', b'hr', b'img', b'input',
+    b'link', b'meta', b'param', b'source', b'track', b'wbr'])
+# elements whose start tag ends an open <p>
+_CLOSES_P = frozenset([
+    b'address', b'article', b'aside', b'blockquote', b'div', b'dl',
+    b'fieldset', b'footer', b'form', b'h1', b'h2', b'h3', b'h4', b'h5',
+    b'h6', b'header', b'hr', b'menu', b'nav', b'ol', b'p', b'pre',
+    b'section', b'table', b'ul'])
+_same_tag_patterns = {}
+
+
+class _Malformed(Exception):
+    """The page needs a full html parser."""
+
+
+def _attributes(attribute_text):
+    """Parse the attributes of a start tag into a dict of str."""
+    attributes = {}
+    for match in _ATTRIBUTE.finditer(attribute_text):
+        name, double, single, bare = match.groups()
+        value = next(x for x in (double, single, bare, b'') if x is not None)
+        attributes[name.decode().lower()] = html.unescape(
+            value.decode('utf-8', 'replace'))
+    return attributes
+
+
+def _element_text(content, tag, start):
+    """Return the text of the element with name tag that opens before start.
+
+    Nested elements with the same name are matched up with their end tags.
+
+    Raises:
+        _Malformed: if the element is never closed, or the tags inside it
+            aren't nested properly, so that a parser would end it somewhere
+            else.
+    """
+    if tag not in _same_tag_patterns:
+        _same_tag_patterns[tag] = re.compile(
+            rb'''<(/?)''' + re.escape(tag) +
+            rb'''\b(?:"[^"]*"|'[^']*'|[^>"'])*?(/?)>''', re.IGNORECASE)
+    depth = 1
+    end = None
+    for match in _same_tag_patterns[tag].finditer(content, start):
+        if match.group(1):
+            depth -= 1
+        elif not match.group(2):
+            depth += 1
+        if depth == 0:
+            end = match.start()
+            break
+    if end is None:
+        raise _Malformed()
+
+    open_tags = []
+    for match in _TAG.finditer(content, start, end):
+        name = match.group(2).lower()
+        if match.group(1):
+            if not open_tags or open_tags.pop() != name:
+                raise _Malformed()
+        elif tag.lower() == b'p' and name in _CLOSES_P:
+            raise _Malformed()
+        elif (name not in _VOID_ELEMENTS and
+              not match.group(0).endswith(b'/>')):
+            open_tags.append(name)
+    if open_tags:
+        raise _Malformed()
+    text = _TAG.sub(b'', content[start:end])
+    return html.unescape(text.decode('utf-8', 'replace'))
+
+
+def scan_page(content):
+    """Extract the status markers from a primer-BLAST page in one pass.
+
+    Instead of parsing the whole page, a regular expression picks out the
+    start tags whose attributes mention one of the markers, and only the text
+    of the first element carrying each marker is extracted. This is much
+    cheaper than building a BeautifulSoup tree. Comments, scripts and
+    styles are skipped, as a parser would. If an element with a marker
+    isn't closed, or the tags inside it aren't nested properly, e.g. a <p>
+    that is ended by the next block, the page is parsed with BeautifulSoup
+    instead, so that it gives the same answer as the full parser.
+
+    Args:
+        content: the page as bytes or str.
+
+    Returns:
+        A PageSummary.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    stripped = _IGNORED.sub(b'', content)
+    try:
+        return _scan(stripped)
+    except _Malformed:
+        return _soup_scan(content)
+
+
+def _scan(content):
+    """scan_page of a page without comments, scripts or styles.
+
+    Raises:
+        _Malformed: if the page needs a full parser.
+    """
+    found = {}
+    job_key = None
+    user_seqloc = []
+
+    for match in _START_TAG.finditer(content):
+        if not _MARKER.search(match.group(2)):
+            continue
+        tag = match.group(1)
+        attributes = _attributes(match.group(2))
+
+        markers = [_CLASS_MARKERS[x] for x in
+                   attributes.get('class', '').split()
+                   if x in _CLASS_MARKERS]
+        if attributes.get('id') in _ID_MARKERS:
+            markers.append(_ID_MARKERS[attributes['id']])
+        markers = [x for x in markers if x not in found]
+        if markers:
+            text = _element_text(content, tag, match.end())
+            for marker in markers:
+                found[marker] = text
+
+        name = attributes.get('name')
+        if name == 'job_key' and job_key is None:
+            job_key = attributes.get('value')
+        elif (name == 'USER_SEQLOC' and tag.lower() == b'input' and
+              attributes.get('type') == 'checkbox'):
+            user_seqloc.append(attributes.get('value'))
+
+    return PageSummary(
+        odd=found.get('odd'),
+        info=found.get('info'),
+        warning=found.get('warning'),
+        param_summary=found.get('param_summary'),
+        expl=found.get('expl'),
+        breadcrumb=found.get('breadcrumb'),
+        job_key=job_key,
+        user_seqloc=user_seqloc)
+
+
+def _soup_scan(content):
+    """scan_page with BeautifulSoup, for pages the scan can't handle."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'lxml')
+
+    def text(**kwargs):
+        element = soup.find(**kwargs)
+        return None if element is None else element.text
+
+    job_key = soup.find(attrs={'name': 'job_key'})
+    return PageSummary(
+        odd=text(class_='odd'),
+        info=text(class_='info'),
+        warning=text(class_='warning'),
+        param_summary=text(class_='paramSummary'),
+        expl=text(id='expl'),
+        breadcrumb=text(id='breadcrumb'),
+        job_key=None if job_key is None else job_key.get('value'),
+        user_seqloc=[
+            x.get('value') for x in soup.find_all(
+                name='input', type='checkbox',
+                attrs={'name': 'USER_SEQLOC'})])
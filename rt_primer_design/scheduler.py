@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import collections
+import random
+import threading
+import time
+
+
+############
+# PROVIDES #
+############
+
+class PollScheduler:
+    """Decide when to poll running BLAST jobs from observed completion times.
+
+    Completion times are recorded per status, i.e. per relaxation step. A job
+    is polled when it is expected to have finished, according to the chosen
+    quantile of the recorded completion times, but never sooner than
+    min_interval seconds after the last request for that job. With no history
+    for a status, jobs are polled every min_interval seconds.
+
+    Polling only tells us that a job finished somewhere between the last
+    poll that found it running and the poll that found it finished, so the
+    midpoint of that interval is recorded as the completion time. Recording
+    the time of the last poll instead would keep pushing the expected
+    completion time up.
+
+    Attributes:
+        min_interval: minimum number of seconds between requests for the same
+            job. NCBI usage guidelines state "Do not poll for any single RID
+            more often than once a minute".
+        quantile: quantile of the recorded completion times to aim for.
+        history: number of completion times kept per status.
+        jobs: number of finished jobs recorded.
+        polls: number of polls for the finished jobs.
+    """
+    def __init__(self, min_interval=60, quantile=0.5, history=200):
+        """Init PollScheduler.
+
+        Args:
+            min_interval: minimum number of seconds between polls of a job.
+            quantile: quantile of the completion times to aim for.
+            history: number of completion times kept per status.
+        """
+        self.min_interval = min_interval
+        self.quantile = quantile
+        self.history = history
+        self.jobs = 0
+        self.polls = 0
+        self._durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.history))
+        self._lock = threading.Lock()
+
+    def expected_duration(self, status):
+        """Expected completion time for a job with status, or None."""
+        with self._lock:
+            durations = sorted(self._durations.get(status, ()))
+        if not durations:
+            return None
+        index = min(len(durations) - 1, int(self.quantile * len(durations)))
+        return durations[index]
+
+    def next_delay(self, status, elapsed):
+        """Number of seconds to wait before polling a running job.
+
+        Args:
+            status: the status of the job, e.g. 'strict'.
+            elapsed: seconds since the job was submitted.
+
+        Returns:
+            The delay in seconds, at least min_interval.
+        """
+        expected = self.expected_duration(status)
+        if expected is None:
+            return self.min_interval
+        return max(self.min_interval, expected - elapsed)
+
+    def record(self, status, last_running, finished, polls):
+        """Record a finished job.
+
+        Args:
+            status: the status of the job, e.g. 'strict'.
+            last_running: seconds after submission that the job was last seen
+                running.
+            finished: seconds after submission that the job was first seen
+                finished.
+            polls: number of polls it took.
+        """
+        with self._lock:
+            self._durations[status].append((last_running + finished) / 2)
+            self.jobs += 1
+            self.polls += polls
+
+    def stats(self):
+        """Polling statistics.
+
+        Returns:
+            A dict with keys jobs, polls, polls_per_job and expected_duration,
+            which is a dict of the expected completion time per status.
+        """
+        with self._lock:
+            statuses = list(self._durations)
+            jobs, polls = self.jobs, self.polls
+        return {
+            'jobs': jobs,
+            'polls': polls,
+            'polls_per_job': polls / jobs if jobs else None,
+            'expected_duration': {
+                x: self.expected_duration(x) for x in statuses}}
+
+
+class RetryQueue:
+    """Back off and retry BLAST submissions that didn't return a job_key.
+
+    A failed submission waits in the queue for a backoff of backoff * 2 **
+    attempt seconds, capped at max_backoff and shortened by a random factor
+    of up to a half so that genes that failed together don't retry together.
+    After max_attempts retries the submission is given up.
+
+    Attributes:
+        max_attempts: number of times a submission is retried.
+        backoff: backoff before the first retry, in seconds.
+        max_backoff: maximum backoff, in seconds.
+        failures: number of failed submissions.
+        retries: number of retries scheduled.
+        given_up: number of submissions given up after max_attempts retries.
+        pending: number of submissions currently waiting to be retried.
+        backoff_seconds: total time spent backing off.
+    """
+    def __init__(self, max_attempts=5, backoff=60, max_backoff=600):
+        """Init RetryQueue.
+
+        Args:
+            max_attempts: number of times a submission is retried.
+            backoff: backoff before the first retry, in seconds.
+            max_backoff: maximum backoff, in seconds.
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.retries = 0
+        self.given_up = 0
+        self.pending = 0
+        self.backoff_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def schedule(self, attempt):
+        """Record a failed submission and decide whether to retry it.
+
+        Args:
+            attempt: number of times the submission has been retried so far.
+
+        Returns:
+            The backoff in seconds before the next attempt, or None if the
+            submission should be given up.
+        """
+        with self._lock:
+            self.failures += 1
+            if attempt >= self.max_attempts:
+                self.given_up += 1
+                return None
+            self.retries += 1
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1)
+
+    def wait(self, delay):
+        """Sleep for delay seconds as a queued submission."""
+        self._enter(delay)
+        try:
+            time.sleep(delay)
+        finally:
+            self._leave()
+
+    async def async_wait(self, delay):
+        """Async twin of wait."""
+        self._enter(delay)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._leave()
+
+    def _enter(self, delay):
+        with self._lock:
+            self.pending += 1
+            self.backoff_seconds += delay
+
+    def _leave(self):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self):
+        """Retry counters.
+
+        Returns:
+            A dict with keys failures, retries, given_up, pending and
+            backoff_seconds.
+        """
+        with self._lock:
+            return {
+                'failures': self.failures,
+                'retries': self.retries,
+                'given_up': self.given_up,
+                'pending': self.pending,
+                'backoff_seconds': self.backoff_seconds}
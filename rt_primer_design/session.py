@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import collections
+import email.utils
+import random
+import requests
+import threading
+import time
+
+
+############
+# PROVIDES #
+############
+
+RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
+
+class BlastSession:
+    """Pooled HTTP connections with timeouts and retries for the BLAST server.
+
+    Each thread gets its own requests.Session, so the executor threads used
+    by the asyncio engine each keep their connections to NCBI alive instead
+    of opening a new TCP and TLS connection for every submit and poll.
+    Responses are requested gzip-compressed.
+
+    Connection errors, timeouts and responses with a status in
+    RETRY_STATUS_CODES are retried up to retries times. Before retry n the
+    session waits a random time between 0 and backoff * 2 ** n seconds,
+    capped at max_backoff, or the time in the server's Retry-After header if
+    that is longer. Every attempt goes through the rate limiter.
+
+    Attributes:
+        retries: number of times a failed request is retried.
+        backoff: base of the backoff before retries, in seconds.
+        max_backoff: maximum backoff before a retry, in seconds.
+        timeout: (connect, read) timeout of each attempt in seconds, as for
+            requests.
+        pool_size: number of connections kept alive per thread.
+        requests: number of attempts made.
+        retried: number of attempts that were retried.
+        failed: number of requests that failed after all retries.
+        latency_seconds: total latency of the attempts made.
+    """
+    def __init__(self, retries=3, backoff=2.0, max_backoff=60.0,
+                 timeout=(10, 60), pool_size=10, history=1000):
+        """Init BlastSession.
+
+        Args:
+            retries: number of times a failed request is retried.
+            backoff: base of the backoff before retries, in seconds.
+            max_backoff: maximum backoff before a retry, in seconds.
+            timeout: (connect, read) timeout of each attempt in seconds.
+            pool_size: number of connections kept alive per thread.
+            history: number of request latencies kept for stats.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.latency_seconds = 0.0
+        self._latencies = collections.deque(maxlen=history)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _session(self):
+        """The requests.Session of the current thread."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            self._local.session = session
+        return session
+
+    def _attempt(self, url, params):
+        """Make one GET request.
+
+        Returns:
+            A tuple of (response or None, exception or None).
+        """
+        start = time.monotonic()
+        try:
+            response = self._session().get(
+                url, params=params, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            response, failure = None, error
+        else:
+            failure = None
+        latency = time.monotonic() - start
+        with self._lock:
+            self.requests += 1
+            self.latency_seconds += latency
+            self._latencies.append(latency)
+        return response, failure
+
+    def _retry_delay(self, attempt, response, failure):
+        """Seconds to wait before retrying, or None if the request is done.
+
+        Raises:
+            The exception of the last attempt, or requests.HTTPError, if the
+            request failed and there are no retries left.
+        """
+        if failure is None and response.status_code not in RETRY_STATUS_CODES:
+            return None
+        if attempt >= self.retries:
+            with self._lock:
+                self.failed += 1
+            if failure is not None:
+                raise failure
+            response.raise_for_status()
+        with self._lock:
+            self.retried += 1
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None and 'Retry-After' in response.headers:
+            delay = max(delay, _retry_after(response.headers['Retry-After']))
+        return delay
+
+    def get(self, url, params=None, rate_limiter=None, timings=None):
+        """GET url, retrying transient failures.
+
+        Args:
+            url: the URL.
+            params: dict of query parameters.
+            rate_limiter: a rate_limit.TokenBucket to wait for before each
+                attempt, or None.
+            timings: a dict with keys queued, backoff and requests to add
+                the seconds spent waiting for rate_limiter, the seconds spent
+                backing off, and the number of attempts to, or None.
+
+        Returns:
+            The requests.Response.
+
+        Raises:
+            requests.RequestException: if the request still fails after all
+                retries.
+        """
+        for attempt in range(self.retries + 1):
+            queued = 0.0
+            if rate_limiter is not None:
+                queued = rate_limiter.acquire()
+            response, failure = self._attempt(url, params)
+            delay = self._retry_delay(attempt, response, failure)
+            _add_timings(timings, queued, delay)
+            if delay is None:
+                return response
+            time.sleep(delay)
+
+    async def async_get(self, url, params=None, rate_limiter=None,
+                        timings=None):
+        """Async twin of get.
+
+        Each attempt runs in the default executor of the running event loop,
+        and the backoff doesn't block the loop.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            queued = 0.0
+            if rate_limiter is not None:
+                queued = await rate_limiter.async_acquire()
+            response, failure = await loop.run_in_executor(
+                None, self._attempt, url, params)
+            delay = self._retry_delay(attempt, response, failure)
+            _add_timings(timings, queued, delay)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """Counters and latencies of the requests made by this session.
+
+        Returns:
+            A dict with keys requests, retried, failed, latency_seconds,
+            and mean_latency, median_latency and max_latency in seconds over
+            the last history requests.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'requests': self.requests,
+                'retried': self.retried,
+                'failed': self.failed,
+                'latency_seconds': self.latency_seconds}
+        if latencies:
+            stats['mean_latency'] = sum(latencies) / len(latencies)
+            stats['median_latency'] = latencies[len(latencies) // 2]
+            stats['max_latency'] = latencies[-1]
+        else:
+            stats['mean_latency'] = None
+            stats['median_latency'] = None
+            stats['max_latency'] = None
+        return stats
+
+
+def _add_timings(timings, queued, backoff):
+    """Add one attempt to timings, if it isn't None."""
+    if timings is None:
+        return
+    timings['queued'] += queued
+    timings['backoff'] += backoff or 0.0
+    timings['requests'] += 1
+
+
+def _retry_after(value):
+    """Parse a Retry-After header into seconds."""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, retry_time - time.time())
+
+
+_default_session = None
+
+
+def get_session():
+    """Return the process-wide BlastSession, creating it if necessary."""
+    global _default_session
+    if _default_session is None:
+        _default_session = BlastSession()
+    return _default_session
+
+
+def set_session(session):
+    """Replace the process-wide BlastSession.
+
+    Args:
+        session: the BlastSession to use for all requests that aren't given
+            a session explicitly.
+    """
+    global _default_session
+    _default_session = session
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import os
+
+
+############
+# PROVIDES #
+############
+
+CSV_HEADER = 'ref_seq,status,F,TM_F,R,TM_R,product_size,intron_size'
+
+# with the column added by CsvSink(locally_verified=True)
+LOCALLY_VERIFIED_HEADER = CSV_HEADER + ',locally_verified'
+
+
+class CsvSink:
+    """Write results to disk as they finish.
+
+    Each result is appended to a CSV file as soon as it's written, and the
+    file is flushed, so the rows can be read while the run is still going.
+    If html_directory is given, the result page is also written there, with
+    the css links pointing at NCBI. If archive is given, the page is stored
+    in the archive instead of a file of its own, and the css links are only
+    rewritten when it's extracted.
+
+    Attributes:
+        csv_file: path to the CSV file. Rows are appended if it exists.
+        html_directory: directory to write the result pages to, or None.
+        archive: archive.HtmlArchive to store the result pages in, or None.
+        locally_verified: if True, rows end with a locally_verified column,
+            which tells primers accepted by a local kmer_index.KmerIndex
+            from ones NCBI found to be specific.
+        written: number of results written.
+    """
+    def __init__(self, csv_file, html_directory=None, header=True,
+                 archive=None, locally_verified=False):
+        """Init CsvSink.
+
+        Args:
+            csv_file: path to the CSV file, or an open file object.
+            html_directory: directory to write the result pages to. It is
+                created if it doesn't exist.
+            header: if True, write CSV_HEADER, or LOCALLY_VERIFIED_HEADER,
+                when the file is empty.
+            archive: an archive.HtmlArchive to store the result pages in.
+            locally_verified: if True, add a locally_verified column, e.g.
+                when a specificity_index is used.
+        """
+        if hasattr(csv_file, 'write'):
+            self.csv_file = getattr(csv_file, 'name', None)
+            self._file = csv_file
+            self._owns_file = False
+        else:
+            self.csv_file = csv_file
+            self._file = open(csv_file, 'a')
+            self._owns_file = True
+        self.html_directory = html_directory
+        self.archive = archive
+        self.locally_verified = locally_verified
+        if html_directory is not None:
+            os.makedirs(html_directory, exist_ok=True)
+        self.written = 0
+        if header and self._is_empty():
+            print(self.header(), file=self._file)
+            self._file.flush()
+
+    def header(self):
+        """The CSV header of the rows this sink writes."""
+        if self.locally_verified:
+            return LOCALLY_VERIFIED_HEADER
+        return CSV_HEADER
+
+    def _is_empty(self):
+        """True if nothing has been written to the CSV file yet."""
+        try:
+            return self._file.tell() == 0
+        except (AttributeError, OSError):
+            # e.g. stdout on a pipe
+            return False
+
+    def write(self, blast_result):
+        """Write a finished result.
+
+        Args:
+            blast_result: a PrimerBlastResult or records.PrimerBlastRecord.
+        """
+        print(blast_result.csv_line(self.locally_verified), file=self._file)
+        self._file.flush()
+        if self.archive is not None and blast_result.content is not None:
+            self.archive.put(blast_result.ref_seq, blast_result.status,
+                             blast_result.content)
+        if self.html_directory is not None and blast_result.html is not None:
+            blast_result.replace_css_links()
+            blast_result.print_file(self.html_directory)
+        self.written += 1
+
+    def close(self):
+        """Close the CSV file, if the sink opened it."""
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import math
+import numpy
+
+
+############
+# PROVIDES #
+############
+
+# primer-BLAST defaults for the parameters the screen uses
+DEFAULT_PARAMETERS = {
+    'PRIMER_MIN_SIZE': 15,
+    'PRIMER_MAX_SIZE': 25,
+    'PRIMER_MIN_TM': 57.0,
+    'PRIMER_MAX_TM': 63.0,
+    'PRIMER_MIN_GC': 20.0,
+    'PRIMER_MAX_GC': 80.0,
+    'GC_CLAMP': 0,
+    'SELF_ANY': 8.0,
+    'SELF_END': 3.0,
+    'PRIMER_PRODUCT_MIN': 70,
+    'PRIMER_PRODUCT_MAX': 1000,
+    'MONO_CATIONS': 50.0,
+    'DIVA_CATIONS': 1.5,
+    'CON_DNTPS': 0.6,
+    'CON_ANEAL_OLIGO': 50.0}
+
+# SantaLucia (1998) unified nearest-neighbour parameters, indexed by
+# 4 * first base + second base with A, C, G, T = 0, 1, 2, 3. dH is in
+# kcal/mol and dS in cal/K/mol.
+_NN = {
+    'AA': (-7.9, -22.2), 'AT': (-7.2, -20.4), 'TA': (-7.2, -21.3),
+    'CA': (-8.5, -22.7), 'GT': (-8.4, -22.4), 'CT': (-7.8, -21.0),
+    'GA': (-8.2, -22.2), 'CG': (-10.6, -27.2), 'GC': (-9.8, -24.4),
+    'GG': (-8.0, -19.9)}
+_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+_NN_DH = numpy.zeros(16)
+_NN_DS = numpy.zeros(16)
+for _first in 'ACGT':
+    for _second in 'ACGT':
+        _pair = _first + _second
+        if _pair not in _NN:
+            # the same stack read on the other strand
+            _pair = _COMPLEMENT[_second] + _COMPLEMENT[_first]
+        _index = 4 * 'ACGT'.index(_first) + 'ACGT'.index(_second)
+        _NN_DH[_index], _NN_DS[_index] = _NN[_pair]
+# initiation with a terminal G.C or A.T pair
+_INIT_GC = (0.1, -2.8)
+_INIT_AT = (2.3, 4.1)
+_R = 1.987
+
+_ENCODING = numpy.full(256, 4, dtype=numpy.uint8)
+for _index, _base in enumerate('ACGT'):
+    _ENCODING[ord(_base)] = _index
+    _ENCODING[ord(_base.lower())] = _index
+
+
+def encode(sequence):
+    """Encode a DNA sequence as a numpy.uint8 array with A, C, G, T = 0, 1,
+    2, 3 and anything else = 4."""
+    return _ENCODING[numpy.frombuffer(sequence.encode(), dtype=numpy.uint8)]
+
+
+def _number(blast_parameters, name):
+    """A numeric primer-BLAST parameter, or its default."""
+    value = blast_parameters.get(name)
+    if value in (None, ''):
+        return DEFAULT_PARAMETERS[name]
+    return float(value)
+
+
+def _windows(values, length):
+    """Sliding windows of length over a 1-D array, as a 2-D view."""
+    return numpy.lib.stride_tricks.sliding_window_view(values, length)
+
+
+def _window_sums(cumulative, length):
+    """Sums of every window of length, from a cumulative sum with a leading
+    zero."""
+    return cumulative[length:] - cumulative[:-length]
+
+
+def _longest_runs(windows):
+    """Longest runs of complementary bases between each window and itself.
+
+    For every antiparallel alignment of a window with itself, counts the
+    longest stretch of consecutive complementary base pairs.
+
+    Returns:
+        A tuple of arrays (any, end_3, end_5): the longest run anywhere, the
+        longest run that includes the last base of the window, and the
+        longest run that includes the first base.
+    """
+    count, length = windows.shape
+    complement = numpy.where(windows < 4, 3 - windows.astype(int), -1)
+    any_run = numpy.zeros(count, dtype=int)
+    end_3 = numpy.zeros(count, dtype=int)
+    end_5 = numpy.zeros(count, dtype=int)
+    for shift in range(2 * length - 1):
+        first = max(0, shift - length + 1)
+        last = min(length - 1, shift)
+        run = numpy.zeros(count, dtype=int)
+        for i in range(first, last + 1):
+            run = numpy.where(windows[:, i] == complement[:, shift - i],
+                              run + 1, 0)
+            numpy.maximum(any_run, run, out=any_run)
+            if i == length - 1:
+                numpy.maximum(end_3, run, out=end_3)
+        if first == 0:
+            # the run starting at the first base, read from the other side
+            run = numpy.zeros(count, dtype=int)
+            start = numpy.ones(count, dtype=bool)
+            for i in range(first, last + 1):
+                start &= windows[:, i] == complement[:, shift - i]
+                run += start
+            numpy.maximum(end_5, run, out=end_5)
+    return any_run, end_3, end_5
+
+
+class TemplateScreen:
+    """Candidate primer properties for one template, computed with numpy.
+
+    For every primer length, the melting temperature, GC content, GC clamp
+    and a lower bound on self-complementarity are computed for every
+    position on the template at once, for forward primers (the template
+    itself) and reverse primers (its reverse complement). The results are
+    kept, so that checking each relaxation level against the template only
+    filters arrays.
+
+    Melting temperatures use the SantaLucia (1998) nearest-neighbour
+    parameters with the SantaLucia salt correction, as Primer3 does, with
+    divalent cations converted to a monovalent equivalent. Self
+    complementarity is bounded by the longest run of complementary bases in
+    any alignment of the primer with itself, which can't be more than the
+    Primer3 alignment score.
+
+    Attributes:
+        sequence: the template sequence.
+    """
+    def __init__(self, sequence):
+        """Init TemplateScreen.
+
+        Args:
+            sequence: the template sequence as a str.
+        """
+        self.sequence = sequence
+        self._bases = encode(sequence)
+        bases = self._bases.astype(int)
+        self._valid = numpy.concatenate(
+            [[0], numpy.cumsum(self._bases == 4)])
+        gc = (self._bases == 1) | (self._bases == 2)
+        self._gc = numpy.concatenate([[0], numpy.cumsum(gc)])
+
+        # number of consecutive G/C ending at, and starting at, each base
+        positions = numpy.arange(len(bases))
+        last_other = numpy.maximum.accumulate(
+            numpy.where(gc, -1, positions)) if len(bases) else positions
+        self._gc_run_end = positions - last_other
+        next_other = numpy.minimum.accumulate(
+            numpy.where(gc, len(bases), positions)[::-1])[::-1] if len(
+                bases) else positions
+        self._gc_run_start = next_other - positions
+
+        # nearest-neighbour sums over each window
+        stacks = numpy.clip(4 * bases[:-1] + bases[1:], 0, 15)
+        stack_ok = (bases[:-1] < 4) & (bases[1:] < 4)
+        self._dh = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.where(stack_ok, _NN_DH[stacks], 0))])
+        self._ds = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.where(stack_ok, _NN_DS[stacks], 0))])
+        self._lengths = {}
+
+    def _candidates(self, length, conditions):
+        """Properties of every window of length.
+
+        Returns:
+            A dict of arrays indexed by window start: ok (no ambiguous
+            bases), tm, gc, clamp_F, clamp_R, self_any, self_end_F and
+            self_end_R.
+        """
+        key = (length, conditions)
+        if key in self._lengths:
+            return self._lengths[key]
+        mono, diva, dntps, oligo = conditions
+        count = len(self._bases) - length + 1
+        if count <= 0:
+            return None
+
+        dh = _window_sums(self._dh, length - 1)[:count]
+        ds = _window_sums(self._ds, length - 1)[:count]
+        for end in (self._bases[:count], self._bases[length - 1:]):
+            terminal_gc = (end == 1) | (end == 2)
+            dh = dh + numpy.where(terminal_gc, _INIT_GC[0], _INIT_AT[0])
+            ds = ds + numpy.where(terminal_gc, _INIT_GC[1], _INIT_AT[1])
+        sodium = (mono + 120 * math.sqrt(max(0.0, diva - dntps))) / 1000
+        ds = ds + 0.368 * (length - 1) * math.log(sodium)
+        tm = 1000 * dh / (ds + _R * math.log(oligo * 1e-9 / 4)) - 273.15
+
+        windows = _windows(self._bases, length)
+        self_any, end_3, end_5 = _longest_runs(windows)
+        candidates = {
+            'ok': _window_sums(self._valid, length) == 0,
+            'tm': tm,
+            'gc': 100 * _window_sums(self._gc, length) / length,
+            'clamp_F': numpy.minimum(
+                self._gc_run_end[length - 1:], length),
+            'clamp_R': numpy.minimum(self._gc_run_start[:count], length),
+            'self_any': self_any,
+            # the 3' end of a reverse primer is the start of its window
+            'self_end_F': end_3,
+            'self_end_R': end_5}
+        self._lengths[key] = candidates
+        return candidates
+
+    def feasible(self, blast_parameters, tm_tolerance=1.0):
+        """Check whether any primer pair could meet blast_parameters.
+
+        The check is conservative. Only the size, Tm, GC, GC clamp and
+        self-complementarity limits of each primer and the product size are
+        checked, the difference between the Tm of the primers isn't, and Tm
+        limits are widened by tm_tolerance. So a False answer means
+        primer-BLAST can't find primers either, but a True answer doesn't
+        mean that it will.
+
+        Args:
+            blast_parameters: dict of primer-BLAST parameters. Missing
+                parameters take the primer-BLAST defaults.
+            tm_tolerance: degrees by which to widen the Tm limits, to allow
+                for differences from Primer3's calculation.
+
+        Returns:
+            True if a primer pair may exist.
+        """
+        def get(name):
+            return _number(blast_parameters, name)
+
+        conditions = (get('MONO_CATIONS'), get('DIVA_CATIONS'),
+                      get('CON_DNTPS'), get('CON_ANEAL_OLIGO'))
+        starts = []
+        ends = []
+        for length in range(int(get('PRIMER_MIN_SIZE')),
+                            int(get('PRIMER_MAX_SIZE')) + 1):
+            candidates = self._candidates(length, conditions)
+            if candidates is None:
+                continue
+            shared = (
+                candidates['ok'] &
+                (candidates['tm'] >= get('PRIMER_MIN_TM') - tm_tolerance) &
+                (candidates['tm'] <= get('PRIMER_MAX_TM') + tm_tolerance) &
+                (candidates['gc'] >= get('PRIMER_MIN_GC')) &
+                (candidates['gc'] <= get('PRIMER_MAX_GC')) &
+                (candidates['self_any'] <= get('SELF_ANY')))
+            forward = (shared &
+                       (candidates['clamp_F'] >= get('GC_CLAMP')) &
+                       (candidates['self_end_F'] <= get('SELF_END')))
+            reverse = (shared &
+                       (candidates['clamp_R'] >= get('GC_CLAMP')) &
+                       (candidates['self_end_R'] <= get('SELF_END')))
+            starts.append(numpy.flatnonzero(forward))
+            ends.append(numpy.flatnonzero(reverse) + length)
+        if not starts:
+            return False
+        starts = numpy.concatenate(starts)
+        ends = numpy.sort(numpy.concatenate(ends))
+        if not len(starts) or not len(ends):
+            return False
+
+        # is there a reverse primer ending within the product size range of
+        # any forward primer?
+        low = numpy.searchsorted(
+            ends, starts + get('PRIMER_PRODUCT_MIN'), side='left')
+        high = numpy.searchsorted(
+            ends, starts + get('PRIMER_PRODUCT_MAX'), side='right')
+        return bool(numpy.any(high > low))
+
+
+def first_feasible_level(sequence, blast_parameters, levels,
+                         tm_tolerance=1.0):
+    """Find the first relaxation level at which primers may be found.
+
+    Args:
+        sequence: the template sequence, or a TemplateScreen.
+        blast_parameters: the strict parameters.
+        levels: sequence of relaxation.RelaxationLevel, from strictest to
+            loosest.
+        tm_tolerance: passed to TemplateScreen.feasible.
+
+    Returns:
+        A tuple of (index, parameters). index is -1 if blast_parameters are
+        feasible, the index in levels of the first feasible level, or None
+        if no level is feasible. parameters are the parameters of that
+        level, with the changes of all the levels before it.
+    """
+    screen = sequence
+    if not isinstance(screen, TemplateScreen):
+        screen = TemplateScreen(sequence)
+    if screen.feasible(blast_parameters, tm_tolerance):
+        return -1, blast_parameters
+    parameters = blast_parameters
+    for index, level in enumerate(levels):
+        parameters = level.apply(parameters)
+        if screen.feasible(parameters, tm_tolerance):
+            return index, parameters
+    return None, parameters
+
+
+def iter_fasta(path):
+    """Read the sequences of a FASTA file one at a time.
+
+    Args:
+        path: path to the FASTA file.
+
+    Yields:
+        Tuples of (name, sequence), where name is the first word of the
+        header.
+    """
+    name = None
+    chunks = []
+    with open(path) as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    yield name, ''.join(chunks)
+                words = line[1:].split()
+                name = words[0] if words else ''
+                chunks = []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        yield name, ''.join(chunks)
+
+
+def read_fasta(path):
+    """Read template sequences from a FASTA file.
+
+    Args:
+        path: path to the FASTA file.
+
+    Returns:
+        A dict of sequences keyed by the first word of each header, and also
+        by that word without its version, e.g. both 'NM_001.2' and 'NM_001'.
+    """
+    templates = {}
+    for name, sequence in iter_fasta(path):
+        templates[name] = sequence
+        templates.setdefault(name.split('.')[0], sequence)
+    return templates
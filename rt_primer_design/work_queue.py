@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+from rt_primer_design import archive
+from rt_primer_design import rate_limit
+from rt_primer_design.sinks import CSV_HEADER
+
+
+############
+# PROVIDES #
+############
+
+class WorkQueue:
+    """Queue of genes shared by workers on several machines.
+
+    The queue is a SQLite database, e.g. on a shared filesystem. Workers
+    claim genes on leases of lease_seconds, renew the leases of the genes
+    they are still working on, and store each finished gene's csv_line and
+    record in the same database. Every write holds the database lock for the
+    whole transaction (BEGIN IMMEDIATE), so no gene is claimed twice.
+
+    The database is opened with archive.connect, which explains what a
+    shared filesystem needs. A gene whose lease has expired, e.g. because
+    its worker died, is handed to the next worker that claims genes. If two
+    workers finish the same gene, the first result is kept.
+
+    The database also holds a token bucket, so that one request budget is
+    shared by every worker (see rate_limiter). Its clock is the wall clock
+    of each machine, so the machines' clocks should be kept in sync.
+
+    Attributes:
+        path: path to the SQLite database.
+        lease_seconds: length of a lease.
+        worker: name of this worker, by default host name and process ID.
+        taken_over: number of expired leases this object has taken over.
+    """
+    def __init__(self, path, lease_seconds=1800, worker=None):
+        """Init WorkQueue, creating the database if necessary.
+
+        Args:
+            path: path to the SQLite database.
+            lease_seconds: length of a lease. Leases are renewed while the
+                gene is running, so this is how long a gene is stuck if its
+                worker dies.
+            worker: name of this worker.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        if worker is None:
+            worker = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.worker = worker
+        self.taken_over = 0
+        self._lock = threading.Lock()
+        self._connection = archive.connect(path, isolation_level=None)
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS genes ('
+                'position INTEGER PRIMARY KEY, '
+                'ref_seq TEXT NOT NULL UNIQUE, '
+                'state TEXT NOT NULL, '
+                'worker TEXT, '
+                'lease_expires REAL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'status TEXT, '
+                'csv_line TEXT, '
+                'record TEXT, '
+                'finished REAL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS genes_state '
+                'ON genes (state, position)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS budget ('
+                'name TEXT PRIMARY KEY, '
+                'tokens REAL NOT NULL, '
+                'updated REAL NOT NULL)')
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Hold the database write lock for the duration of the block."""
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def add(self, ref_seq_list):
+        """Queue genes. Genes that are already queued are skipped.
+
+        Args:
+            ref_seq_list: iterable of RefSeq IDs.
+
+        Returns:
+            The number of genes added.
+        """
+        with self._transaction() as connection:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO genes (ref_seq, state) "
+                "VALUES (?, 'pending')",
+                ((x,) for x in ref_seq_list))
+            return connection.total_changes - before
+
+    def claim(self, count=1):
+        """Lease up to count genes that are pending or whose lease expired.
+
+        Returns:
+            A list of RefSeq IDs, in queue order.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT ref_seq, state FROM genes "
+                "WHERE state = 'pending' OR "
+                "(state = 'leased' AND lease_expires < ?) "
+                "ORDER BY position LIMIT ?",
+                (now, count)).fetchall()
+            connection.executemany(
+                "UPDATE genes SET state = 'leased', worker = ?, "
+                "lease_expires = ?, attempts = attempts + 1 "
+                "WHERE ref_seq = ?",
+                ((self.worker, now + self.lease_seconds, ref_seq)
+                 for ref_seq, state in rows))
+        self.taken_over += sum(state == 'leased' for ref_seq, state in rows)
+        return [ref_seq for ref_seq, state in rows]
+
+    def renew(self):
+        """Extend the leases of every gene this worker holds.
+
+        Returns:
+            The number of leases renewed.
+        """
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE genes SET lease_expires = ? "
+                "WHERE state = 'leased' AND worker = ?",
+                (time.time() + self.lease_seconds, self.worker)).rowcount
+
+    def complete(self, blast_result):
+        """Store the result of a gene and mark it done.
+
+        Args:
+            blast_result: a PrimerBlastResult or records.PrimerBlastRecord.
+
+        Returns:
+            True if the result was stored, False if the gene was already
+            done by another worker.
+        """
+        record = blast_result.to_record()
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE genes SET state = 'done', worker = ?, status = ?, "
+                "csv_line = ?, record = ?, finished = ? "
+                "WHERE ref_seq = ? AND state != 'done'",
+                (self.worker, blast_result.status, blast_result.csv_line(),
+                 json.dumps(record), time.time(),
+                 blast_result.ref_seq)).rowcount > 0
+
+    # so that a WorkQueue can be the sink of iter_primer_blast
+    write = complete
+
+    async def async_write(self, blast_result):
+        """complete, in the default executor so that waiting for the
+        database lock doesn't stall the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.complete, blast_result)
+
+    def release(self, ref_seq_list=None):
+        """Hand genes leased by this worker back to the queue.
+
+        Args:
+            ref_seq_list: the genes to release. By default, every gene this
+                worker holds.
+
+        Returns:
+            The number of genes released.
+        """
+        query = ("UPDATE genes SET state = 'pending', worker = NULL, "
+                 "lease_expires = NULL "
+                 "WHERE state = 'leased' AND worker = ?")
+        with self._transaction() as connection:
+            if ref_seq_list is None:
+                return connection.execute(query, (self.worker,)).rowcount
+            changes = 0
+            for ref_seq in ref_seq_list:
+                changes += connection.execute(
+                    query + ' AND ref_seq = ?',
+                    (self.worker, ref_seq)).rowcount
+            return changes
+
+    def requeue(self, statuses=('submission_failed', 'failed')):
+        """Queue finished genes with one of statuses again.
+
+        Returns:
+            The number of genes queued again.
+        """
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE genes SET state = 'pending', worker = NULL, "
+                "lease_expires = NULL, status = NULL, csv_line = NULL, "
+                "record = NULL, finished = NULL "
+                "WHERE state = 'done' AND status IN (%s)" %
+                ', '.join('?' * len(statuses)),
+                tuple(statuses)).rowcount
+
+    def next_expiry(self):
+        """Seconds until the next lease of another worker expires, or None
+        if no other worker holds a lease."""
+        with self._lock:
+            expires = self._connection.execute(
+                "SELECT MIN(lease_expires) FROM genes "
+                "WHERE state = 'leased' AND worker != ?",
+                (self.worker,)).fetchone()[0]
+        if expires is None:
+            return None
+        return max(0.0, expires - time.time())
+
+    def records(self):
+        """The records of the finished genes, in queue order.
+
+        Yields:
+            Dicts from PrimerBlastResult.to_record, which
+            PrimerBlastResult.from_record turns back into results.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT record FROM genes WHERE state = 'done' "
+                "ORDER BY position").fetchall()
+        for row, in rows:
+            yield json.loads(row)
+
+    def write_csv(self, csv_file, header=True):
+        """Write the csv_line of every finished gene, in queue order.
+
+        Args:
+            csv_file: path to the CSV file, which is overwritten.
+            header: if True, start with sinks.CSV_HEADER.
+
+        Returns:
+            The number of rows written.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT csv_line FROM genes WHERE state = 'done' "
+                "ORDER BY position").fetchall()
+        with open(csv_file, 'w') as csv:
+            if header:
+                print(CSV_HEADER, file=csv)
+            for row, in rows:
+                print(row, file=csv)
+        return len(rows)
+
+    def _take_tokens(self, name, rate, burst, cost, now):
+        """Refill the shared bucket name, take cost tokens and return the
+        tokens left, which are negative if the caller has to wait."""
+        with self._transaction() as connection:
+            saved = connection.execute(
+                'SELECT tokens, updated FROM budget WHERE name = ?',
+                (name,)).fetchone()
+            tokens, updated = saved if saved else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate) - cost
+            connection.execute(
+                'INSERT OR REPLACE INTO budget VALUES (?, ?, ?)',
+                (name, tokens, now))
+        return tokens
+
+    def rate_limiter(self, rate=1 / 3, burst=1, name='ncbi'):
+        """A rate_limit.TokenBucket whose state is kept in the queue, so
+        that every worker of the queue shares one request budget.
+
+        Args:
+            rate: requests per second allowed across all workers.
+            burst: maximum number of tokens in the bucket.
+            name: name of the budget, for queues that talk to more than
+                one service.
+        """
+        return QueueTokenBucket(self, rate, burst, name)
+
+    def stats(self):
+        """Progress of the queue.
+
+        Returns:
+            A dict with keys pending, leased, expired, done and taken_over
+            (by this object).
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT state, lease_expires < ?, COUNT(*) FROM genes "
+                "GROUP BY state, lease_expires < ?", (now, now)).fetchall()
+        stats = {'pending': 0, 'leased': 0, 'expired': 0, 'done': 0,
+                 'taken_over': self.taken_over}
+        for state, expired, count in rows:
+            if state == 'leased' and expired:
+                stats['expired'] += count
+            else:
+                stats[state] += count
+        return stats
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+class QueueTokenBucket(rate_limit.TokenBucket):
+    """TokenBucket whose state is kept in a WorkQueue database.
+
+    Like a TokenBucket with a state_file, but the state is in the queue's
+    SQLite database, so it is shared by workers on every machine that can
+    open the queue, not only by processes on one host.
+    """
+    def __init__(self, work_queue, rate=1 / 3, burst=1, name='ncbi'):
+        """Init QueueTokenBucket.
+
+        Args:
+            work_queue: the WorkQueue to keep the state in.
+            rate: tokens added per second.
+            burst: maximum number of tokens in the bucket.
+            name: name of the budget in the queue.
+        """
+        super().__init__(rate, burst)
+        self.work_queue = work_queue
+        self.name = name
+
+    def _clock(self):
+        return time.time()
+
+    def _shared(self):
+        return True
+
+    def _update(self, cost):
+        tokens = self.work_queue._take_tokens(
+            self.name, self.rate, self.burst, cost, self._clock())
+        return max(0.0, -tokens / self.rate)
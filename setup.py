@@ -15,9 +15,14 @@ setup(
     packages=find_packages(),
     install_requires=[
         'beautifulsoup4>=4.5.1',
-        'joblib>=0.9.4',
         'lxml>=3.7.1',
         'requests>=2.12.4',
         'tompytools>=0.0.3'],
+    extras_require={
+        'thermo': ['numpy>=1.20'],
+        'test': ['pytest', 'numpy>=1.20']},
+    entry_points={
+        'console_scripts': [
+            'rt-primer-design = rt_primer_design.cli:main']},
     zip_safe=False
 )
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import datetime
+import sys
+import types
+import pytest
+
+# tompytools isn't on PyPI for every Python version, and the engine only
+# uses it to print messages, so the tests don't need the real thing
+try:
+    import tompytools
+except ImportError:
+    tompytools = types.ModuleType('tompytools')
+    tompytools.generate_message = lambda message: print(
+        '[ %s ]: %s' % (datetime.datetime.now().isoformat(), message))
+    sys.modules['tompytools'] = tompytools
+
+from rt_primer_design import mock_server
+from rt_primer_design import rate_limit
+from rt_primer_design import scheduler
+from rt_primer_design import session
+
+
+############
+# PROVIDES #
+############
+
+# the strict parameters the mock server's default scenario relaxes from
+STARTING_PARAMETERS = {
+    'SPAN_INTRON': 'on', 'GC_CLAMP': '2', 'LOW_COMPLEXITY_FILTER': 'on'}
+
+
+@pytest.fixture
+def server():
+    """A MockPrimerBlastServer whose jobs finish at once."""
+    with mock_server.MockPrimerBlastServer(seed=1) as mock:
+        yield mock
+
+
+@pytest.fixture
+def fast(server):
+    """Keyword arguments that point a run at server, with the NCBI limits
+    and backoffs shortened so that a run takes a fraction of a second."""
+    return {
+        'backend': server.backend(),
+        'rate_limiter': rate_limit.TokenBucket(rate=1000, burst=100),
+        'session': session.BlastSession(backoff=0.01, max_backoff=0.05),
+        'retry_queue': scheduler.RetryQueue(
+            max_attempts=2, backoff=0.01, max_backoff=0.05),
+        'wait_seconds': 0.01}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import sqlite3
+from rt_primer_design import archive
+
+
+############
+# PROVIDES #
+############
+
+PAGE = (b'<html><head><link rel="stylesheet" href="css/primer-blast.css">'
+        b'</head><body>primers</body></html>')
+
+
+def test_pages_are_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'pages.db')
+    writer = archive.HtmlArchive(path)
+    reader = archive.HtmlArchive(path)
+    writer.put('NM_000001.1', 'strict', PAGE)
+    assert reader.get('NM_000001.1', 'strict') == PAGE
+    assert reader.get('NM_000001.1', 'relaxed') is None
+    writer.close()
+    reader.close()
+
+
+def test_rollback_journal(tmp_path):
+    path = str(tmp_path / 'pages.db')
+    archive.HtmlArchive(path).close()
+    connection = sqlite3.connect(path)
+    mode, = connection.execute('PRAGMA journal_mode').fetchone()
+    connection.close()
+    assert mode == 'delete'
+
+
+def test_connect_leaves_wal(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.close()
+    connection = archive.connect(path, isolation_level=None)
+    mode, = connection.execute('PRAGMA journal_mode').fetchone()
+    connection.close()
+    assert mode == 'delete'
+
+
+def test_extract_rewrites_css_links(tmp_path):
+    html_archive = archive.HtmlArchive(str(tmp_path / 'pages.db'))
+    html_archive.put('NM_000001.1', 'strict', PAGE)
+    page = html_archive.extract('NM_000001.1')
+    assert archive.CSS_BASE_URL + 'css/primer-blast.css' in page
+    html_archive.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import time
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import cache
+from rt_primer_design import primer_blast
+
+
+############
+# PROVIDES #
+############
+
+RECORD = {'ref_seq': 'NM_000001.1', 'status': 'strict', 'F': 'ACGT',
+          'html': '<html>page</html>'}
+
+
+def test_hit_and_miss(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache.db'))
+    assert result_cache.get('NM_000001.1', {'GC_CLAMP': 2}, 'strict') is None
+    result_cache.put('NM_000001.1', {'GC_CLAMP': 2}, 'strict', RECORD)
+    # parameters are compared in canonical form
+    assert result_cache.get(
+        'NM_000001.1', {'GC_CLAMP': '2'}, 'strict') == RECORD
+    assert result_cache.get(
+        'NM_000001.1', {'GC_CLAMP': '1'}, 'strict') is None
+    assert result_cache.get(
+        'NM_000001.1', {'GC_CLAMP': '2'}, 'GC_content') is None
+    stats = result_cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 3)
+    result_cache.close()
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache.db'), ttl=0.05)
+    result_cache.put('NM_000001.1', {}, 'strict', RECORD)
+    assert result_cache.get('NM_000001.1', {}, 'strict') == RECORD
+    time.sleep(0.1)
+    assert result_cache.get('NM_000001.1', {}, 'strict') is None
+    stats = result_cache.stats()
+    assert (stats['entries'], stats['expired']) == (0, 1)
+    result_cache.close()
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    result_cache = cache.ResultCache(
+        str(tmp_path / 'cache.db'), max_entries=2)
+    for ref_seq in ('A', 'B'):
+        result_cache.put(ref_seq, {}, 'strict', RECORD)
+    time.sleep(0.01)
+    result_cache.get('A', {}, 'strict')
+    result_cache.put('C', {}, 'strict', RECORD)
+    assert result_cache.get('B', {}, 'strict') is None
+    assert result_cache.get('A', {}, 'strict') is not None
+    assert result_cache.stats()['evictions'] == 1
+    result_cache.close()
+
+
+def test_cached_run_makes_no_requests(tmp_path, server, fast):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache.db'))
+    genes = ['NM_%09d.1' % x for x in range(4)]
+    first = primer_blast.multiple_primer_blast(
+        genes, STARTING_PARAMETERS, cache=result_cache, **fast)
+    requests = server.stats()['requests']
+    second = primer_blast.multiple_primer_blast(
+        genes, STARTING_PARAMETERS, cache=result_cache, **fast)
+    assert server.stats()['requests'] == requests
+    assert [x.csv_line() for x in second] == [x.csv_line() for x in first]
+    assert all(x.content for x in second)
+    result_cache.close()
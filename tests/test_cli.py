@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import os
+import subprocess
+import sys
+import pytest
+from rt_primer_design import cli
+from rt_primer_design import sinks
+
+
+############
+# PROVIDES #
+############
+
+FAST = ['--rate', '1000', '--wait-seconds', '0.01']
+
+
+def _start(server, *arguments):
+    """Start the command line on server, with stdin and stdout as pipes."""
+    return subprocess.Popen(
+        # through conftest, for its tompytools stand-in
+        [sys.executable, '-c',
+         'import sys, conftest\n'
+         'from rt_primer_design import cli\n'
+         'sys.exit(cli.main())',
+         '--blast-url', server.url, '--set', 'GC_CLAMP=2'] + FAST +
+        list(arguments),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, text=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+
+
+def test_read_ids():
+    lines = ['# panel\n', '\n', 'NM_000001.1 GAPDH\n', 'NM_000002.1,ACTB\n']
+    assert list(cli.read_ids(lines)) == ['NM_000001.1', 'NM_000002.1']
+
+
+@pytest.mark.parametrize('arguments', [
+    ['--speculation', '-1'],
+    ['--n-jobs', '0'],
+    ['--rate', '-1'],
+    ['--rate', 'nan'],
+    ['--wait-seconds', 'inf'],
+    ['--set', 'GC_CLAMP']])
+def test_bad_numbers_are_rejected(arguments, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.parse_arguments(arguments)
+    assert exit_info.value.code == 2
+
+
+def test_rows_stream_while_input_is_open(server):
+    process = _start(server)
+    try:
+        assert process.stdout.readline().strip() == sinks.CSV_HEADER
+        for ref_seq in ('NM_000001.1', 'NM_000002.1'):
+            process.stdin.write(ref_seq + '\n')
+            process.stdin.flush()
+            # the row comes before the next ID is written
+            assert process.stdout.readline().startswith(ref_seq + ',')
+        process.stdin.close()
+        assert process.stdout.read() == ''
+        assert process.wait(timeout=30) == 0
+    finally:
+        process.kill()
+        process.wait()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+from rt_primer_design import concurrency
+from rt_primer_design import rate_limit
+from rt_primer_design import scheduler
+from rt_primer_design import session
+
+
+############
+# PROVIDES #
+############
+
+def _update(controller, poll_scheduler, now):
+    return controller.update(
+        session.BlastSession(), rate_limit.TokenBucket(rate=1 / 3),
+        poll_scheduler, now=now)
+
+
+def test_rate_cap_follows_running_times():
+    controller = concurrency.AdaptiveConcurrency(initial=10)
+    poll_scheduler = scheduler.PollScheduler(min_interval=60)
+    _update(controller, poll_scheduler, 0)
+    # without history, jobs are polled every minute
+    assert controller.limit == 20
+    for status, duration in (('strict', 300), ('GC_content', 600)):
+        poll_scheduler.record(status, duration, duration, 1)
+    _update(controller, poll_scheduler, 10)
+    assert controller.stats()['poll_interval'] == 450
+    assert controller.limit == 150
+
+
+def test_rate_cap_parameter():
+    controller = concurrency.AdaptiveConcurrency(initial=10, rate_cap=4)
+    assert _update(
+        controller, scheduler.PollScheduler(min_interval=60), 0) == 4
+    assert controller.limit == 4
+
+
+def test_window_grows_while_full():
+    async def run():
+        controller = concurrency.AdaptiveConcurrency(
+            initial=2, interval=10)
+        poll_scheduler = scheduler.PollScheduler(min_interval=60)
+        await controller.acquire()
+        await controller.acquire()
+        assert controller.locked()
+        _update(controller, poll_scheduler, 100)
+        assert controller.window == 3
+        assert not controller.locked()
+        # at most one increase per interval
+        await controller.acquire()
+        _update(controller, poll_scheduler, 105)
+        assert controller.window == 3
+    asyncio.run(run())
+
+
+def test_async_update_reads_the_shared_backlog(tmp_path):
+    async def run():
+        controller = concurrency.AdaptiveConcurrency(initial=2, interval=0)
+        poll_scheduler = scheduler.PollScheduler(min_interval=60)
+        rate_limiter = rate_limit.TokenBucket(
+            rate=1, state_file=str(tmp_path / 'bucket.json'))
+        for _ in range(100):
+            rate_limiter.reserve()
+        await controller.acquire()
+        await controller.acquire()
+        # the queue for tokens is longer than the poll interval, so the
+        # window isn't raised even though it's full
+        window = await controller.async_update(
+            session.BlastSession(), rate_limiter, poll_scheduler)
+        assert (window, controller.reason) == (2, 'rate_limit')
+        assert controller.update(
+            session.BlastSession(), rate_limiter, poll_scheduler,
+            backlog=0) == 3
+    asyncio.run(run())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import json
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import journal
+from rt_primer_design import primer_blast
+
+
+############
+# PROVIDES #
+############
+
+REF_SEQ = 'NM_000001.1'
+
+
+def _run(journal_path, fast):
+    run_journal = journal.Journal(journal_path)
+    try:
+        return primer_blast.run_primer_blast(
+            REF_SEQ, STARTING_PARAMETERS, 'strict', journal=run_journal,
+            **fast)
+    finally:
+        run_journal.close()
+
+
+def _events(journal_path):
+    with open(journal_path) as journal_file:
+        return [json.loads(x)['event'] for x in journal_file]
+
+
+def test_finished_step_is_not_rerun(tmp_path, server, fast):
+    journal_path = str(tmp_path / 'run.journal')
+    first = _run(journal_path, fast)
+    requests = server.stats()['requests']
+    second = _run(journal_path, fast)
+    assert server.stats()['requests'] == requests
+    assert second.job_key == first.job_key
+    assert second.to_record() == first.to_record()
+
+
+def test_submitted_job_is_resumed(tmp_path, server, fast):
+    journal_path = str(tmp_path / 'run.journal')
+    submitted = primer_blast.PrimerBlastResult(
+        REF_SEQ, 'strict', STARTING_PARAMETERS,
+        rate_limiter=fast['rate_limiter'], session=fast['session'],
+        backend=fast['backend'])
+    crashed = journal.Journal(journal_path)
+    crashed.record_submitted(
+        REF_SEQ, STARTING_PARAMETERS, 'strict', submitted)
+    crashed.close()
+
+    blast_result = _run(journal_path, fast)
+    assert server.stats()['submissions'] == 1
+    assert blast_result.job_key == submitted.job_key
+    assert _events(journal_path) == ['submitted', 'finished']
+
+
+def test_expired_job_key_is_resubmitted(tmp_path, server, fast):
+    journal_path = str(tmp_path / 'run.journal')
+    expired = primer_blast.PrimerBlastResult(
+        REF_SEQ, 'strict', STARTING_PARAMETERS, backend=fast['backend'],
+        submit=False)
+    expired.job_key = 'EXPIRED'
+    crashed = journal.Journal(journal_path)
+    crashed.record_submitted(REF_SEQ, STARTING_PARAMETERS, 'strict', expired)
+    crashed.close()
+
+    blast_result = _run(journal_path, fast)
+    assert server.stats()['submissions'] == 1
+    assert blast_result.job_key not in (None, 'EXPIRED')
+    assert _events(journal_path) == [
+        'submitted', 'dropped', 'submitted', 'finished']
+    resumed = journal.Journal(journal_path)
+    assert resumed.step(
+        REF_SEQ, STARTING_PARAMETERS, 'strict')['event'] == 'finished'
+    resumed.close()
+
+
+def test_page_without_markers_is_not_a_job(fast):
+    blast_result = primer_blast.PrimerBlastResult(
+        REF_SEQ, 'strict', STARTING_PARAMETERS, backend=fast['backend'],
+        submit=False)
+    blast_result._set_page(
+        b'<html><body><p>Job not found.</p></body></html>')
+    assert not blast_result.job_found()
+    blast_result._set_page(
+        b'<html><body><div id="breadcrumb">Job id=ABC</div>'
+        b'</body></html>')
+    assert blast_result.job_found()
+
+
+def test_gene_is_rerun_with_new_parameters(tmp_path, server, fast):
+    journal_path = str(tmp_path / 'run.journal')
+    new_parameters = dict(STARTING_PARAMETERS, PRIMER_PRODUCT_MAX='500')
+    run_journal = journal.Journal(journal_path)
+    try:
+        first = primer_blast.iterate_primer_blast(
+            REF_SEQ, STARTING_PARAMETERS, journal=run_journal, **fast)
+        submissions = server.stats()['submissions']
+        rerun = primer_blast.iterate_primer_blast(
+            REF_SEQ, new_parameters, journal=run_journal, **fast)
+        assert server.stats()['submissions'] > submissions
+        assert rerun.job_key != first.job_key
+        assert rerun.blast_parameters['PRIMER_PRODUCT_MAX'] == '500'
+    finally:
+        run_journal.close()
+
+    # both genes are replayed, each under its own parameters
+    resumed = journal.Journal(journal_path)
+    submissions = server.stats()['submissions']
+    try:
+        for parameters, expected in ((STARTING_PARAMETERS, first),
+                                     (new_parameters, rerun)):
+            blast_result = primer_blast.iterate_primer_blast(
+                REF_SEQ, parameters, journal=resumed, **fast)
+            assert blast_result.to_record() == expected.to_record()
+    finally:
+        resumed.close()
+    assert server.stats()['submissions'] == submissions
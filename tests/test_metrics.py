@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import json
+import re
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import concurrency
+from rt_primer_design import metrics
+from rt_primer_design import primer_blast
+
+
+############
+# PROVIDES #
+############
+
+GENES = ['NM_%09d.1' % x for x in range(3)]
+
+_SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+
+def _samples(text):
+    """The samples of a Prometheus text snapshot, as a dict of value by
+    (name, labels)."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, labels, value = _SAMPLE.match(line).groups()
+        labels = tuple(sorted(re.findall(r'(\w+)="([^"]*)"', labels or '')))
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+def test_trace_of_a_run(tmp_path, server, fast):
+    jsonl_file = str(tmp_path / 'trace.jsonl')
+    tracer = metrics.Tracer(jsonl_file, profile=True)
+    controller = concurrency.AdaptiveConcurrency(initial=2)
+    blast_results = primer_blast.multiple_primer_blast(
+        GENES, STARTING_PARAMETERS, n_jobs=2, tracer=tracer,
+        concurrency=controller, verbose=False, **fast)
+    tracer.close()
+    with open(jsonl_file) as trace_file:
+        entries = [json.loads(x) for x in trace_file]
+    steps = [x for x in entries if x['event'] == 'step']
+    genes = [x for x in entries if x['event'] == 'gene']
+
+    # every gene and step of the run, with the server's requests booked to
+    # the steps that made them
+    assert sorted(x['ref_seq'] for x in genes) == GENES
+    assert sorted(x['status'] for x in genes) == sorted(
+        x.status for x in blast_results)
+    stats = tracer.stats()
+    assert stats['genes'] == len(GENES)
+    assert stats['events']['submissions'] == server.stats()['submissions']
+    assert stats['events']['polls'] == server.stats()['polls']
+    assert stats['events']['requests'] == server.stats()['requests']
+    assert sum(x['steps'] for x in genes) == len(steps)
+    assert stats['gauges']['concurrency_window'] == controller.window
+
+    samples = _samples(tracer.prometheus_text())
+    prefix = 'rt_primer_design_'
+    for blast_result in blast_results:
+        assert samples[(prefix + 'genes_total', (
+            ('status', blast_result.status),))] >= 1
+    assert sum(y for (x, _), y in samples.items()
+               if x == prefix + 'genes_total') == len(GENES)
+    assert sum(y for (x, _), y in samples.items()
+               if x == prefix + 'steps_total') == len(steps)
+    assert samples[(prefix + 'step_events_total', (
+        ('event', 'submissions'), ('status', 'strict')))] == len(GENES)
+    assert samples[(prefix + 'gene_seconds_total', ())] == (
+        stats['gene_seconds'])
+    assert samples[(prefix + 'concurrency_window', ())] == controller.window
+    assert {x[1] for x in tracer.phase_seconds} == {
+        'submit', 'queue', 'backoff', 'sleep', 'poll', 'parse',
+        'similar_templates'} == set(metrics.PHASES)
+    assert all(x >= 0 for x in stats['phase_seconds'].values())
+
+    # only the parse phase is profiled
+    functions = {x[2] for x in tracer.profile_stats().stats}
+    assert 'parse_primer_pairs' in functions
+    assert 'poll' not in functions and 'submit' not in functions
+    tracer.dump_profile(str(tmp_path / 'parse.prof'))
+    assert (tmp_path / 'parse.prof').stat().st_size > 0
+
+
+def test_prometheus_snapshot(tmp_path):
+    tracer = metrics.Tracer()
+    step_trace = tracer.step('NM_1', 'strict')
+    step_trace.phases['poll'] += 2.5
+    step_trace.count('polls', 3)
+    step_trace.finish('primers')
+    tracer.record_gene('NM_1', 'strict', 4.0, 1)
+    tracer.set_gauge('genes_in_flight', 7, 'Genes holding a gene slot.')
+    assert tracer.profile_stats() is None
+
+    path = str(tmp_path / 'metrics.prom')
+    tracer.write_prometheus(path, prefix='test')
+    with open(path) as prometheus_file:
+        text = prometheus_file.read()
+    assert '# TYPE test_steps_total counter' in text
+    assert '# TYPE test_genes_in_flight gauge' in text
+    assert _samples(text) == {
+        ('test_phase_seconds_total', (('phase', 'poll'),
+                                      ('status', 'strict'))): 2.5,
+        ('test_step_events_total', (('event', 'polls'),
+                                    ('status', 'strict'))): 3,
+        ('test_steps_total', (('outcome', 'primers'),
+                              ('status', 'strict'))): 1,
+        ('test_genes_total', (('status', 'strict'),)): 1,
+        ('test_gene_seconds_total', ()): 4.0,
+        ('test_genes_in_flight', ()): 7}
+    assert metrics._escape_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import json
+import os
+import subprocess
+import sys
+import requests
+import tompytools
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import mock_server
+from rt_primer_design import primer_blast
+from rt_primer_design import scanner
+
+
+############
+# PROVIDES #
+############
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a recorded results page, with its job_key replaced by the marker
+RECORDED_SUCCESS = (
+    b'<html><body><div id="breadcrumb">Primer-BLAST: Job id=@JOB_KEY@'
+    b'</div><input type="hidden" name="job_key" value="@JOB_KEY@">'
+    b'<div class="paramSummary">Specificity of primers: primers are '
+    b'specific</div><div class="prPairInfo"><h2>Primer pair 1</h2>'
+    b'<table class="prPairDtl">'
+    b'<tr><th>Forward primer</th><td>TTGCCGAGACCAAGATCAAGC</td>'
+    b'<td>Plus</td><td>21</td><td>412</td><td>432</td><td>60.10</td>'
+    b'<td>52.38</td><td>4.00</td><td>0.00</td></tr>'
+    b'<tr><th>Reverse primer</th><td>CCCAGTCACGACGTTGTAAAACG</td>'
+    b'<td>Minus</td><td>23</td><td>611</td><td>589</td><td>62.40</td>'
+    b'<td>52.17</td><td>6.00</td><td>2.00</td></tr>'
+    b'<tr><th>Product length</th><td>200</td></tr>'
+    b'<tr><th>Total intron size</th><td>1327</td></tr>'
+    b'</table></div></body></html>')
+
+RECORDED_SIMILAR = (
+    b'<html><body><div id="breadcrumb">Job id=@JOB_KEY@</div>'
+    b'<div id="expl">Your PCR template is highly similar to the following '
+    b'sequence(s) <b>recorded</b> @USER_SEQLOC@</div></body></html>')
+
+
+def _record_pages(directory):
+    with open(os.path.join(str(directory), 'success.html'), 'wb') as page:
+        page.write(RECORDED_SUCCESS)
+    with open(os.path.join(str(directory), 'similar_templates.html'),
+              'wb') as page:
+        page.write(RECORDED_SIMILAR)
+
+
+def _submit(server, ref_seq):
+    """Submit a query for ref_seq and return its job_key and running
+    page."""
+    response = requests.get(server.url, {'INPUT_SEQUENCE': ref_seq})
+    assert response.status_code == 200
+    return scanner.scan_page(response.content).job_key, response.content
+
+
+def _poll(server, job_key):
+    return requests.get(server.url, {'job_key': job_key}).content
+
+
+def _success(ref_seq, blast_parameters):
+    return 'success'
+
+
+def test_recorded_pages_are_served(tmp_path, fast):
+    _record_pages(tmp_path)
+    pages = mock_server.load_pages(str(tmp_path), padding=100)
+    synthetic = mock_server.synthetic_pages(padding=100)
+    assert sorted(pages) == sorted(synthetic)
+    assert pages['success'] == RECORDED_SUCCESS
+    assert pages['similar_templates'] == RECORDED_SIMILAR
+    for kind in ('running', 'no_primers', 'off_targets', 'no_intron'):
+        assert pages[kind] == synthetic[kind]
+
+    with mock_server.MockPrimerBlastServer(
+            pages=pages, scenario=_success) as server:
+        job_key, page = _submit(server, 'NM_000001.1')
+        assert page == synthetic['running'].replace(
+            mock_server.JOB_KEY_MARKER, job_key.encode())
+        assert _poll(server, job_key) == RECORDED_SUCCESS.replace(
+            mock_server.JOB_KEY_MARKER, job_key.encode())
+
+        fast['backend'] = server.backend()
+        blast_result = primer_blast.run_primer_blast(
+            'NM_000002.1', STARTING_PARAMETERS, 'strict', **fast)
+        assert (blast_result.F, blast_result.TM_F) == (
+            'TTGCCGAGACCAAGATCAAGC', '60.10')
+        assert not blast_result.off_targets
+
+        server.scenario = lambda *args: 'similar_templates'
+        job_key, _ = _submit(server, 'NM_000003.1')
+        page = _poll(server, job_key)
+        assert b'<b>recorded</b>' in page
+        assert b'value="NM_000003_2.1"' in page
+
+
+def test_benchmark_script_runs(tmp_path):
+    _record_pages(tmp_path)
+    env = dict(os.environ)
+    # the client runs in its own process, which needs tompytools too
+    if getattr(tompytools, '__file__', None) is None:
+        stub = tmp_path / 'stub'
+        stub.mkdir()
+        (stub / 'tompytools.py').write_text(
+            'def generate_message(message):\n    print(message)\n')
+        env['PYTHONPATH'] = str(stub)
+    completed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'benchmarks',
+                                      'benchmark_multiple.py'),
+         '--genes', '5', '10', '--n-jobs', '5', '--rate', '1000',
+         '--wait-seconds', '0.01', '--latency', '0', '--error-rate', '0',
+         '--job-seconds', '0', '--padding', '0', '--pages', str(tmp_path)],
+        stdout=subprocess.PIPE, env=env, check=True, timeout=120)
+    lines = [json.loads(x) for x in completed.stdout.decode().splitlines()]
+    assert [x['genes'] for x in lines] == [5, 10]
+    for line in lines:
+        assert sum(line['statuses'].values()) == line['genes']
+        assert line['submissions_per_gene'] >= 1
+        assert line['requests_per_gene'] >= 2 * line['submissions_per_gene']
+        assert line['genes_per_hour'] > 0
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import random
+import pytest
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import records
+
+numpy = pytest.importorskip('numpy')
+from rt_primer_design import multiplex  # noqa: E402
+
+
+############
+# PROVIDES #
+############
+
+GENES = ['NM_%09d.1' % x for x in range(2)]
+
+# the first pair of every mock results page, whose primers are
+# complementary to each other and to themselves
+FIRST_PAIR = ('ACGTACGTACGTACGTACGT', 'CGTACGTACGTACGTACGTA')
+
+_COMPLEMENT = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+
+def _end_run(primer_1, primer_2, window):
+    """end_complementarity of two primers, one alignment at a time."""
+    best = 0
+    for start in range(len(primer_2)):
+        run = 0
+        while (run < window and run < len(primer_1) and
+               start + run < len(primer_2) and
+               _COMPLEMENT.get(primer_1[-1 - run]) == primer_2[start + run]):
+            run += 1
+        best = max(best, run)
+    return best
+
+
+def _success(ref_seq, blast_parameters):
+    return 'success'
+
+
+def _panel_results(fast):
+    return [primer_blast.iterate_primer_blast(
+        ref_seq, STARTING_PARAMETERS, **fast) for ref_seq in GENES]
+
+
+def test_complementary_pair_is_detected():
+    primer = 'GATTACAGGCTTACCAGTCA'
+    reverse_complement = ''.join(_COMPLEMENT[x] for x in reversed(primer))
+    scores = multiplex.end_complementarity(
+        [primer, 'AAAAAAAAAAAAAAAAAAAA'], [reverse_complement, primer])
+    assert scores.dtype == numpy.int8
+    assert scores[0, 0] == 7
+    assert scores[1].tolist() == [1, 2]
+
+    randomness = random.Random(1)
+    primers = [''.join(randomness.choice('ACGT') for _ in range(
+        randomness.randint(15, 25))) for _ in range(20)]
+    for window in (4, 7, 12):
+        scores = multiplex.end_complementarity(
+            primers, window=window, block_size=3)
+        assert scores.tolist() == [
+            [_end_run(x, y, window) for y in primers] for x in primers]
+
+
+def test_alternate_pair_is_swapped_in(server, fast):
+    server.scenario = _success
+    panel = multiplex.MultiplexPanel(_panel_results(fast))
+    report = panel.check()
+    assert not report.compatible
+    assert {(x.ref_seq_1, x.ref_seq_2) for x in report.conflicts} == {
+        tuple(GENES)}
+    assert max(x.score for x in report.conflicts) == 7
+    assert report.offenders == GENES[:1]
+
+    assert panel.swap_alternates(report) == []
+    first, second = panel.blast_results
+    assert (first.F, first.R) == (
+        first.primer_pairs[1].F, first.primer_pairs[1].R)
+    assert (second.F, second.R) == FIRST_PAIR
+    assert panel.check().compatible
+
+
+def test_rerun_is_adopted(server, fast):
+    server.scenario = _success
+    designed = primer_blast.iterate_primer_blast(
+        GENES[0], STARTING_PARAMETERS, **fast)
+    # no alternates on the page, so the gene has to be designed again
+    stuck = records.PrimerBlastRecord(
+        GENES[1], 'strict', F=FIRST_PAIR[0], R=FIRST_PAIR[1],
+        TM_F='60.01', TM_R='59.01')
+    panel = multiplex.MultiplexPanel([stuck, designed])
+    report = panel.check()
+    assert report.offenders == GENES[1:]
+    assert panel.swap_alternates(report) == GENES[1:]
+
+    parameters = panel.rerun_parameters(STARTING_PARAMETERS, num_return=20)
+    assert parameters['PRIMER_NUM_RETURN'] == '20'
+    assert float(parameters['PRIMER_MIN_TM']) < panel.tm_median
+    assert float(parameters['PRIMER_MAX_TM']) > panel.tm_median
+    rerun = primer_blast.iterate_primer_blast(GENES[1], parameters, **fast)
+    assert panel.adopt(rerun)
+    assert panel.blast_results[0] is rerun
+    assert (rerun.F, rerun.R) != FIRST_PAIR
+    assert panel.check().compatible
+
+
+def test_resolve_multiplex_reruns_offenders(server, fast):
+    server.scenario = _success
+    designed = primer_blast.iterate_primer_blast(
+        GENES[0], STARTING_PARAMETERS, **fast)
+    stuck = records.PrimerBlastRecord(
+        GENES[1], 'strict', F=FIRST_PAIR[0], R=FIRST_PAIR[1],
+        TM_F='60.01', TM_R='59.01')
+    submissions = server.stats()['submissions']
+    blast_results, report = primer_blast.resolve_multiplex(
+        [stuck, designed], STARTING_PARAMETERS, num_return=20, **fast)
+    assert report.compatible
+    assert server.stats()['submissions'] > submissions
+    rerun, kept = blast_results
+    assert kept is designed
+    assert rerun.blast_parameters['PRIMER_NUM_RETURN'] == '20'
+    assert (rerun.F, rerun.R) != FIRST_PAIR
+
+    # without new queries the offender is left as it was
+    blast_results, report = primer_blast.resolve_multiplex(
+        [stuck, designed], STARTING_PARAMETERS, max_rounds=0, **fast)
+    assert not report.compatible
+    assert blast_results[0] is stuck
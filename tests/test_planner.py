@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+from rt_primer_design import planner
+
+
+############
+# PROVIDES #
+############
+
+PARAMETERS = {'GC_CLAMP': '2'}
+
+
+class _Result:
+    """Stands in for a PrimerBlastResult."""
+    def __init__(self, ref_seq):
+        self.ref_seq = ref_seq
+
+    def to_record(self):
+        return {'ref_seq': self.ref_seq}
+
+
+def _from_record(record):
+    return _Result(record['ref_seq'])
+
+
+def test_record_is_dropped_after_last_duplicate():
+    async def run():
+        batch_planner = planner.BatchPlanner(_from_record)
+        batch_planner.plan(['A', 'B', 'A', 'A'], PARAMETERS)
+        assert batch_planner.claim('A', PARAMETERS)
+        assert batch_planner.claim('B', PARAMETERS)
+        batch_planner.resolve('A', PARAMETERS, _Result('A'))
+        batch_planner.resolve('B', PARAMETERS, _Result('B'))
+        # B has no duplicates, so its record isn't kept
+        assert list(batch_planner._finished) == [
+            batch_planner._key('A', PARAMETERS)]
+        for remaining in (1, 0):
+            assert not batch_planner.claim('A', PARAMETERS)
+            shared = await batch_planner.shared_result('A', PARAMETERS)
+            assert shared.ref_seq == 'A'
+            assert len(batch_planner._finished) == remaining
+        assert batch_planner.stats()['duplicates'] == 2
+    asyncio.run(run())
+
+
+def test_duplicates_wait_for_running_gene():
+    async def run():
+        batch_planner = planner.BatchPlanner(_from_record)
+        assert batch_planner.claim('A', PARAMETERS)
+        assert not batch_planner.claim('A', PARAMETERS)
+        waiting = asyncio.ensure_future(
+            batch_planner.shared_result('A', PARAMETERS))
+        await asyncio.sleep(0)
+        result = _Result('A')
+        batch_planner.resolve('A', PARAMETERS, result)
+        assert await waiting is result
+        assert not batch_planner._finished
+        # unplanned, so a gene that turns up after it's done is run again
+        assert batch_planner.claim('A', PARAMETERS)
+    asyncio.run(run())
+
+
+def test_failure_reaches_duplicates():
+    async def run():
+        batch_planner = planner.BatchPlanner(_from_record)
+        assert batch_planner.claim('A', PARAMETERS)
+        assert not batch_planner.claim('A', PARAMETERS)
+        waiting = asyncio.ensure_future(
+            batch_planner.shared_result('A', PARAMETERS))
+        await asyncio.sleep(0)
+        batch_planner.fail('A', PARAMETERS, asyncio.CancelledError())
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert batch_planner.claim('A', PARAMETERS)
+    asyncio.run(run())
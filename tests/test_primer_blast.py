@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import collections
+import io
+import json
+import pytest
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import journal
+from rt_primer_design import mock_server
+from rt_primer_design import primer_blast
+from rt_primer_design import records
+from rt_primer_design import sinks
+
+
+############
+# PROVIDES #
+############
+
+GENES = ['NM_%09d.1' % x for x in range(8)]
+BROKEN = GENES[3]
+
+
+def _broken_scenario(ref_seq, blast_parameters):
+    """default_scenario, except that the server hangs up on BROKEN."""
+    if ref_seq == BROKEN:
+        raise RuntimeError('server error')
+    return mock_server.default_scenario(ref_seq, blast_parameters)
+
+
+def test_iter_yields_every_gene(server, fast):
+    output = io.StringIO()
+    results = list(primer_blast.iter_primer_blast(
+        iter(GENES), STARTING_PARAMETERS, n_jobs=3,
+        sink=sinks.CsvSink(output, header=False), **fast))
+    assert sorted(x.ref_seq for x in results) == GENES
+    assert all(not x.running for x in results)
+    assert len(output.getvalue().splitlines()) == len(GENES)
+
+
+def test_wrappers_run_inside_an_event_loop(server, fast):
+    async def notebook_cell():
+        # as in Jupyter, where asyncio.run raises RuntimeError
+        blast_records = primer_blast.multiple_primer_blast(
+            GENES[:2], STARTING_PARAMETERS, n_jobs=2, **fast)
+        results = list(primer_blast.iter_primer_blast(
+            GENES[2:4], STARTING_PARAMETERS, n_jobs=2, **fast))
+        return blast_records, results
+    blast_records, results = asyncio.run(notebook_cell())
+    assert [x.ref_seq for x in blast_records] == GENES[:2]
+    assert sorted(x.ref_seq for x in results) == GENES[2:4]
+
+
+def test_misspelt_option_fails_the_run(server, fast):
+    with pytest.raises(TypeError):
+        primer_blast.multiple_primer_blast(
+            GENES[:2], STARTING_PARAMETERS, jounral=None, **fast)
+    assert server.stats()['submissions'] == 0
+
+
+def test_failed_gene_doesnt_stop_the_run(server, fast):
+    server.scenario = _broken_scenario
+    output = io.StringIO()
+    results = primer_blast.multiple_primer_blast(
+        GENES, STARTING_PARAMETERS, n_jobs=3,
+        sink=sinks.CsvSink(output, header=False), **fast)
+    assert [x.ref_seq for x in results] == GENES
+    statuses = {x.ref_seq: x.status for x in results}
+    assert statuses.pop(BROKEN) == 'failed'
+    assert 'failed' not in statuses.values()
+    assert '%s,failed,,,,,,' % BROKEN in output.getvalue().splitlines()
+
+
+class _SecondPairIsSpecific:
+    """Stands in for a kmer_index.KmerIndex in which only the second pair
+    has no off-target products."""
+    def specific_pairs(self, pairs, intended):
+        return pairs[1:2]
+
+
+def test_locally_verified_primers_are_marked(server, fast):
+    server.scenario = lambda ref_seq, blast_parameters: 'off_targets'
+    blast_result = primer_blast.run_primer_blast(
+        GENES[0], STARTING_PARAMETERS, 'strict',
+        specificity_index=_SecondPairIsSpecific(), **fast)
+    assert blast_result.status == 'strict'
+    assert not blast_result.off_targets
+    assert blast_result.locally_verified
+    assert blast_result.F == blast_result.primer_pairs[1].F
+    assert blast_result.csv_line().count(',') == 7
+    record = records.PrimerBlastRecord.from_result(blast_result)
+    output = io.StringIO()
+    sink = sinks.CsvSink(output, locally_verified=True)
+    sink.write(blast_result)
+    sink.write(record)
+    assert output.getvalue().splitlines() == [
+        sinks.LOCALLY_VERIFIED_HEADER, blast_result.csv_line() + ',True',
+        record.csv_line() + ',True']
+
+    unchecked = primer_blast.run_primer_blast(
+        GENES[1], STARTING_PARAMETERS, 'strict', **fast)
+    assert unchecked.off_targets
+    assert not unchecked.locally_verified
+    assert unchecked.csv_line(locally_verified=True).endswith(',False')
+
+
+def test_duplicate_genes_run_once(server, fast):
+    primer_blast.multiple_primer_blast(
+        GENES[:2], STARTING_PARAMETERS, n_jobs=2, **fast)
+    submissions = server.stats()['submissions']
+    results = primer_blast.multiple_primer_blast(
+        GENES[:2] * 3, STARTING_PARAMETERS, n_jobs=2, **fast)
+    assert [x.ref_seq for x in results] == GENES[:2] * 3
+    assert [x.status for x in results[2:]] == [
+        x.status for x in results[:2]] * 2
+    assert server.stats()['submissions'] == 2 * submissions
+
+
+def test_speculation_keeps_the_strictest_step(tmp_path, server, fast):
+    def scenario(ref_seq, blast_parameters):
+        # strict finds off-target primers and GC1 finds specific ones at
+        # once, and the looser steps run until they are cancelled
+        gc_clamp = blast_parameters['GC_CLAMP']
+        server.job_seconds = 0.0 if gc_clamp in ('2', '1') else 60.0
+        return 'off_targets' if gc_clamp == '2' else 'success'
+    server.scenario = scenario
+
+    sequential = primer_blast.iterate_primer_blast(
+        GENES[0], STARTING_PARAMETERS, **fast)
+    assert sequential.status == 'GC1'
+    assert server.stats()['submissions'] == 2
+
+    journal_path = str(tmp_path / 'run.journal')
+    run_journal = journal.Journal(journal_path)
+    try:
+        blast_result = primer_blast.iterate_primer_blast(
+            GENES[1], STARTING_PARAMETERS, speculation=2,
+            journal=run_journal, **fast)
+    finally:
+        run_journal.close()
+    assert blast_result.status == 'GC1'
+    assert (blast_result.F, blast_result.R) == (sequential.F, sequential.R)
+    # strict, then GC1 with GC0 and GC_content
+    assert server.stats()['submissions'] == 2 + 4
+
+    with open(journal_path) as journal_file:
+        entries = [json.loads(x) for x in journal_file]
+    assert collections.Counter(x['event'] for x in entries) == {
+        'submitted': 4, 'finished': 2, 'cancelled': 2, 'gene_done': 1}
+    assert sorted(x['status'] for x in entries
+                  if x['event'] == 'cancelled') == ['GC0', 'GC_content']
+    # a resumed run doesn't poll the abandoned jobs
+    resumed = journal.Journal(journal_path)
+    resumed.close()
+    assert sorted(x[2] for x in resumed.steps) == ['GC1', 'strict']
+    assert all(x['event'] == 'finished' for x in resumed.steps.values())
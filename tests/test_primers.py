@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+from bs4 import BeautifulSoup
+import pytest
+import re
+from rt_primer_design import mock_server
+from rt_primer_design import primer_blast
+from rt_primer_design import primers
+
+
+############
+# PROVIDES #
+############
+
+_HEADER = (
+    b"<tr><th></th><th>Sequence (5'-&gt;3')</th><th>Template strand</th>"
+    b"<th>Length</th><th>Start</th><th>Stop</th><th>Tm</th><th>GC%</th>"
+    b"<th>Self complementarity</th><th>Self 3' complementarity</th></tr>")
+
+
+def _pair(rank, rows):
+    return b'\n'.join(
+        [b'<div class="prPairInfo" id="pair_%d">' % rank,
+         b'<h2>Primer pair %d</h2>' % rank,
+         b'<table class="prPairDtl">', _HEADER] + rows +
+        [b'</table></div>'])
+
+
+# laid out like the primer pairs of a primer-BLAST results page, one row per
+# line, with an exon junction row and Tm values that end in 0
+NCBI_LIKE_PAGE = b'\n'.join([
+    b'<html><body>',
+    b'<div id="breadcrumb">Primer-BLAST: Job id=JSID_01</div>',
+    b'<div class="paramSummary">Specificity of primers: primers are '
+    b'specific</div>',
+    _pair(1, [
+        b'<tr><th>Forward primer</th><td>TTGCCGAGACCAAGATCAAGC</td>'
+        b'<td>Plus</td><td>21</td><td>412</td><td>432</td><td>60.10</td>'
+        b'<td>52.38</td><td>4.00</td><td>0.00</td></tr>',
+        b'<tr><th>Reverse primer</th><td>CCCAGTCACGACGTTGTAAAACG</td>'
+        b'<td>Minus</td><td>23</td><td>611</td><td>589</td><td>62.40</td>'
+        b'<td>52.17</td><td>6.00</td><td>2.00</td></tr>',
+        b'<tr><th>Product length</th><td>200</td></tr>',
+        b'<tr><th>Exon junction</th><td>420/421 (forward primer) on '
+        b'template</td></tr>',
+        b'<tr><th>Total intron size</th><td>1327</td></tr>']),
+    _pair(2, [
+        b'<tr><th>Forward primer</th><td>AGCGGATAACAATTTCACACAGGA</td>'
+        b'<td>Plus</td><td>24</td><td>98</td><td>121</td><td>60.81</td>'
+        b'<td>41.67</td><td>3.00</td><td>1.00</td></tr>',
+        b'<tr><th>Reverse primer</th><td>GTAAAACGACGGCCAGT</td>'
+        b'<td>Minus</td><td>17</td><td>301</td><td>285</td><td>59.00</td>'
+        b'<td>52.94</td><td>5.00</td><td>3.00</td></tr>',
+        b'<tr><th>Product length</th><td>204</td></tr>',
+        b'<tr><th>Total intron size</th><td>96</td></tr>']),
+    b'</body></html>'])
+
+
+def _bs4_fields(content):
+    """The primer attributes as PrimerBlastResult.parse_primers set them
+    with BeautifulSoup, before primers.parse_primer_pairs."""
+    primer_table = BeautifulSoup(content, 'lxml').find(
+        class_='prPairInfo').table.text
+    searches = {
+        'F': r'Forward primer\s*\d*\s*([ACTG]+)',
+        'R': r'Reverse primer\s*\d*\s*([ACTG]+)',
+        'product_size': r'Product length(\d*)',
+        'intron_size': r'Total intron size(\d*)',
+        'TM_F': r'Forward primer.*?(\d\d\.\d\d)',
+        'TM_R': r'Reverse primer.*?(\d\d\.\d\d)'}
+    return {field: re.search(search, primer_table).group(1)
+            for field, search in searches.items()}
+
+
+def _pages():
+    return {
+        'synthetic': mock_server.synthetic_pages()['success'],
+        'ncbi_like': NCBI_LIKE_PAGE}
+
+
+@pytest.mark.parametrize('name', sorted(_pages()))
+def test_legacy_fields_match_beautifulsoup(name):
+    content = _pages()[name]
+    pairs = primers.parse_primer_pairs(content)
+    assert primers.legacy_fields(pairs[0]) == _bs4_fields(content)
+    assert primers.parse_primer_pairs(content.decode()) == pairs
+
+
+def test_parse_primer_pairs():
+    first, second = primers.parse_primer_pairs(NCBI_LIKE_PAGE)
+    assert first == primers.PrimerPair(
+        rank=1, F='TTGCCGAGACCAAGATCAAGC', R='CCCAGTCACGACGTTGTAAAACG',
+        TM_F=60.1, TM_R=62.4, GC_F=52.38, GC_R=52.17, length_F=21,
+        length_R=23, start_F=412, stop_F=432, start_R=611, stop_R=589,
+        self_any_F=4.0, self_any_R=6.0, self_end_F=0.0, self_end_R=2.0,
+        product_size=200, intron_size=1327)
+    assert (second.rank, second.F, second.TM_R, second.intron_size) == (
+        2, 'AGCGGATAACAATTTCACACAGGA', 59.0, 96)
+    # '%.2f' keeps the trailing zeros the page shows
+    assert primers.legacy_fields(first)['TM_F'] == '60.10'
+    assert primers.legacy_fields(second)['TM_R'] == '59.00'
+    assert primers.from_records(primers.to_records([first, second])) == [
+        first, second]
+
+
+def test_missing_values_are_empty():
+    pair = primers.parse_primer_pairs(NCBI_LIKE_PAGE)[0]._replace(
+        TM_F=None, intron_size=None)
+    fields = primers.legacy_fields(pair)
+    assert fields['TM_F'] == '' and fields['intron_size'] == ''
+    assert primers.parse_primer_pairs(b'<html><body></body></html>') == []
+
+
+def test_result_uses_legacy_fields(fast):
+    blast_result = primer_blast.PrimerBlastResult(
+        'NM_000001.1', 'strict', {}, backend=fast['backend'], submit=False)
+    blast_result._set_page(NCBI_LIKE_PAGE)
+    blast_result.parse_primers()
+    for field, value in _bs4_fields(NCBI_LIKE_PAGE).items():
+        assert getattr(blast_result, field) == value
+    blast_result.use_primer_pair(blast_result.primer_pairs[1])
+    assert (blast_result.F, blast_result.TM_F, blast_result.product_size) == (
+        'AGCGGATAACAATTTCACACAGGA', '60.81', '204')
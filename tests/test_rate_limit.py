@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import asyncio
+import threading
+import pytest
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import rate_limit
+
+
+############
+# PROVIDES #
+############
+
+class _Frozen(rate_limit.TokenBucket):
+    """TokenBucket whose clock only moves when told to."""
+    now = 0.0
+
+    def _clock(self):
+        return self.now
+
+
+def test_reservations_are_spaced_by_rate():
+    bucket = _Frozen(rate=1 / 3, burst=1)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(3)
+    assert bucket.reserve() == pytest.approx(6)
+    assert bucket.backlog() == pytest.approx(6)
+    bucket.now = 9
+    assert bucket.backlog() == 0
+    assert bucket.stats()['max_queued_seconds'] == pytest.approx(6)
+
+
+def test_burst_is_served_at_once():
+    bucket = _Frozen(rate=1, burst=3)
+    assert [bucket.reserve() for x in range(3)] == [0, 0, 0]
+    assert bucket.reserve() == pytest.approx(1)
+
+
+def test_state_file_is_shared(tmp_path):
+    state_file = str(tmp_path / 'bucket.json')
+    buckets = [rate_limit.TokenBucket(rate=1, state_file=state_file)
+               for x in range(2)]
+    assert buckets[0].reserve() == 0
+    assert buckets[1].reserve() > 0.5
+
+
+class _Threads(rate_limit.TokenBucket):
+    """TokenBucket that remembers the threads its backlog was read in."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = []
+
+    def backlog(self):
+        self.threads.append(threading.current_thread())
+        return super().backlog()
+
+
+def test_shared_backlog_is_read_off_the_event_loop(tmp_path):
+    async def run(bucket):
+        return await bucket.async_backlog()
+
+    shared = _Threads(rate=1, state_file=str(tmp_path / 'bucket.json'))
+    shared.reserve()
+    shared.reserve()
+    assert asyncio.run(run(shared)) == pytest.approx(1, abs=0.1)
+    assert shared.threads[0] is not threading.current_thread()
+
+    local = _Threads(rate=1)
+    assert asyncio.run(run(local)) == 0
+    assert local.threads == [threading.current_thread()]
+
+
+def test_every_request_takes_a_token(server, fast):
+    primer_blast.multiple_primer_blast(
+        ['NM_%09d.1' % x for x in range(3)], STARTING_PARAMETERS, **fast)
+    assert fast['rate_limiter'].stats()['requests'] == (
+        server.stats()['requests'])
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import gc
+import os
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import records
+
+
+############
+# PROVIDES #
+############
+
+GENES = ['NM_%09d.1' % x for x in range(4)]
+
+
+def test_pages_spill_to_temporary_directory(server, fast):
+    blast_records = primer_blast.multiple_primer_blast(
+        GENES, STARTING_PARAMETERS, n_jobs=2, **fast)
+    page_store = blast_records[0]._page_store
+    assert isinstance(page_store, records.SpillDirectory)
+    path = page_store.path
+    assert len(os.listdir(path)) == len(GENES)
+    assert all(x.content for x in blast_records)
+    del blast_records, page_store
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_pages_spill_to_given_directory(tmp_path, server, fast):
+    blast_records = primer_blast.multiple_primer_blast(
+        GENES, STARTING_PARAMETERS, n_jobs=2,
+        spill_directory=str(tmp_path), **fast)
+    assert blast_records[0]._page_store.path == str(tmp_path)
+    assert len(os.listdir(str(tmp_path))) == len(GENES)
+
+
+def test_pages_in_memory_on_request(server, fast):
+    blast_records = primer_blast.multiple_primer_blast(
+        GENES, STARTING_PARAMETERS, n_jobs=2,
+        page_store=records.MemoryPageStore(), **fast)
+    assert all(x.content for x in blast_records)
+    assert isinstance(
+        blast_records[0]._page_store, records.MemoryPageStore)
+
+
+def test_str_is_the_page(server, fast):
+    blast_result = primer_blast.iterate_primer_blast(
+        GENES[0], STARTING_PARAMETERS, **fast)
+    record = records.PrimerBlastRecord.from_result(
+        blast_result, records.MemoryPageStore())
+    assert str(blast_result) == str(blast_result.html)
+    assert str(record) == str(blast_result)
+    assert 'prPairInfo' in str(record)
+
+
+def test_spill_directory_keeps_pages_inside(tmp_path):
+    page_store = records.SpillDirectory(str(tmp_path / 'pages'))
+    for ref_seq in ('../../escaped', 'NM_1/2', os.sep + 'absolute',
+                    'a\\b'):
+        page_store.put(ref_seq, 'strict', ref_seq.encode())
+        assert page_store.get(ref_seq, 'strict') == ref_seq.encode()
+    page_store.put('NM_1', '../status', b'status')
+    assert page_store.get('NM_1', '../status') == b'status'
+    assert sorted(os.listdir(str(tmp_path))) == ['pages']
+    assert len(os.listdir(page_store.path)) == 5
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import relaxation
+
+
+############
+# PROVIDES #
+############
+
+def _no_intron_then_off_targets(ref_seq, blast_parameters):
+    """A gene without a junction whose primers aren't specific until the
+    GC content is relaxed."""
+    if 'SPAN_INTRON' in blast_parameters:
+        return 'no_intron'
+    if blast_parameters.get('PRIMER_MIN_GC') != '35':
+        return 'off_targets'
+    return 'success'
+
+
+def test_no_intron_trait_survives_rerun(server, fast):
+    server.scenario = _no_intron_then_off_targets
+    strategy = relaxation.RelaxationStrategy()
+    blast_result = primer_blast.iterate_primer_blast(
+        'NM_000001.1', STARTING_PARAMETERS, strategy=strategy, **fast)
+    assert not blast_result.off_targets
+    assert 'SPAN_INTRON' not in blast_result.blast_parameters
+    traits = {tuple(x['traits']) for x in strategy.stats()}
+    assert traits == {('no_intron', 'off_targets')}
+
+
+def test_gene_traits_of_rerun():
+    class Result:
+        no_intron = False
+        off_targets = True
+    strict = Result()
+    strict.no_intron = True
+    assert relaxation.gene_traits(Result()) == ('off_targets',)
+    assert relaxation.gene_traits(Result(), strict) == (
+        'no_intron', 'off_targets')
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+from bs4 import BeautifulSoup
+import pytest
+from rt_primer_design import mock_server
+from rt_primer_design import scanner
+
+
+############
+# PROVIDES #
+############
+
+# laid out like a primer-BLAST page, with the parts a regular expression can
+# trip over: scripts and styles that mention the markers, comments,
+# attribute values with '>' and upper-case tags
+NCBI_LIKE_PAGE = b'''<!DOCTYPE html>
+<html><head><title>Primer-BLAST results</title>
+<script type="text/javascript">
+  var row = '<tr class="odd"><td>Running</td></tr>';
+  if (a > b) { document.write('<p class="info">no</p>'); }
+</script>
+<style>.info > p { color: red; } .odd { }</style>
+</head><body>
+<!-- <div id="breadcrumb">commented out</div> -->
+<div id="breadcrumb" title="Home > Primer-BLAST">Primer-BLAST:
+Job id=JSID_01</div>
+<FORM action="primertool.cgi" method="post">
+<INPUT type="hidden" name="job_key" value="JSID_01">
+<div id="expl" data-note="a > b">Your PCR template is highly similar to the
+following sequence(s)
+<input type="checkbox" name="USER_SEQLOC" value="NM_1.1" checked>
+<input type="checkbox" name="USER_SEQLOC" value="NM_2.1"/>
+<input type="hidden" name="USER_SEQLOC" value="hidden">
+</div></FORM>
+<div class="paramSummary">Specificity of primers: primers are
+<b>specific</b> &amp; checked</div>
+<table><tr class="odd"><td>Finished</td></tr></table>
+<p class="info warning">Exon-exon junction cannot be found</p>
+</body></html>'''
+
+EDGE_CASES = {
+    'unclosed_p': (
+        b'<html><body><div id="breadcrumb">Job id=X</div>'
+        b'<p class="info">Exon-exon junction cannot be found'
+        b'<p>Some other text</p><div class="odd">Running</div>'
+        b'</body></html>'),
+    'p_ended_by_block': (
+        b'<html><body><div><p class="info">No primers were found'
+        b'<table><tr class="odd"><td>x</td></tr></table></div>'
+        b'</body></html>'),
+    'unclosed_at_end': (
+        b'<html><body><div class="warning">No primers found'),
+    'quoted_gt': (
+        b'<html><body><div title="a > b" class="info">junction cannot be '
+        b'found</div><p class=\'odd\' data-x=\'>\'>Running</p>'
+        b'</body></html>'),
+    'script': (
+        b'<html><head><script>var s = "<div class=\\"info\\">fake</div>";'
+        b'</script></head><body><div class="info">real</div>'
+        b'<SCRIPT type="text/javascript">document.write('
+        b'\'<input name="job_key" value="fake">\');</SCRIPT>'
+        b'<input name="job_key" value="real"></body></html>'),
+    'misnested': (
+        b'<html><body><div class="odd"><b>Running</div> done</b>'
+        b'</body></html>'),
+    'nested_same_tag': (
+        b'<html><body><div class="paramSummary">outer <div>inner</div> '
+        b'may not be specific</div></body></html>'),
+    'entities': (
+        b'<html><body><div class="warning">5 &lt; 6 &amp; &#65;</div>'
+        b'</body></html>'),
+}
+
+
+def _bs4_summary(content):
+    """The markers as PrimerBlastResult found them with BeautifulSoup,
+    before the scanner."""
+    page = BeautifulSoup(content, 'lxml')
+
+    def text(**kwargs):
+        element = page.find(**kwargs)
+        return None if element is None else element.text
+
+    job_key = page.find(attrs={'name': 'job_key'})
+    return scanner.PageSummary(
+        odd=text(class_='odd'),
+        info=text(class_='info'),
+        warning=text(class_='warning'),
+        param_summary=text(class_='paramSummary'),
+        expl=text(id='expl'),
+        breadcrumb=text(id='breadcrumb'),
+        job_key=None if job_key is None else job_key['value'],
+        user_seqloc=[x['value'] for x in page.find_all(
+            name='input', type='checkbox', attrs={'name': 'USER_SEQLOC'})])
+
+
+def _pages():
+    pages = {'synthetic_' + kind: page.replace(
+        mock_server.JOB_KEY_MARKER, b'JSID_01')
+        for kind, page in mock_server.synthetic_pages().items()}
+    pages['ncbi_like'] = NCBI_LIKE_PAGE
+    pages.update(EDGE_CASES)
+    return pages
+
+
+@pytest.mark.parametrize('name', sorted(_pages()))
+def test_scan_matches_beautifulsoup(name):
+    content = _pages()[name]
+    assert scanner.scan_page(content) == _bs4_summary(content)
+    assert scanner.scan_page(content.decode()) == _bs4_summary(content)
+
+
+def test_well_formed_pages_are_not_parsed(monkeypatch):
+    def soup_scan(content):
+        raise AssertionError('fell back to BeautifulSoup')
+    monkeypatch.setattr(scanner, '_soup_scan', soup_scan)
+    for name, content in _pages().items():
+        if name not in ('unclosed_p', 'p_ended_by_block', 'unclosed_at_end',
+                        'misnested'):
+            scanner.scan_page(content)
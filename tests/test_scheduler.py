@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import scheduler
+
+
+############
+# PROVIDES #
+############
+
+def test_retry_backoff_doubles_up_to_max():
+    retry_queue = scheduler.RetryQueue(
+        max_attempts=6, backoff=10, max_backoff=60)
+    for attempt, ceiling in enumerate((10, 20, 40, 60, 60, 60)):
+        delay = retry_queue.schedule(attempt)
+        assert ceiling / 2 <= delay <= ceiling
+    assert retry_queue.schedule(6) is None
+    stats = retry_queue.stats()
+    assert stats['failures'] == 7
+    assert stats['retries'] == 6
+    assert stats['given_up'] == 1
+
+
+def test_submissions_without_job_key_are_given_up(server, fast):
+    # a busy server that answers submissions without a job_key
+    server.pages = dict(
+        server.pages, running=b'<html><body>Server busy</body></html>')
+    genes = ['NM_%09d.1' % x for x in range(3)]
+    results = primer_blast.multiple_primer_blast(
+        genes, STARTING_PARAMETERS, n_jobs=3, **fast)
+    assert [x.status for x in results] == ['submission_failed'] * 3
+    retry_queue = fast['retry_queue']
+    attempts = retry_queue.max_attempts + 1
+    assert server.stats()['submissions'] == 3 * attempts
+    assert retry_queue.stats()['given_up'] == 3
+    assert retry_queue.stats()['pending'] == 0
+
+
+def test_poll_scheduler_waits_for_expected_duration():
+    poll_scheduler = scheduler.PollScheduler(min_interval=60)
+    assert poll_scheduler.next_delay('strict', 0) == 60
+    for finished in (300, 320, 340):
+        poll_scheduler.record('strict', finished - 60, finished + 60, 3)
+    assert poll_scheduler.expected_duration('strict') == 320
+    assert poll_scheduler.next_delay('strict', 100) == 220
+    assert poll_scheduler.next_delay('strict', 300) == 60
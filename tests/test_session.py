@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import email.utils
+import random
+import threading
+import time
+import pytest
+import requests
+from rt_primer_design import session as blast_session
+
+
+############
+# PROVIDES #
+############
+
+def _response(status_code, **headers):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    return response
+
+
+def test_retry_after_parsing():
+    assert blast_session._retry_after('7') == 7.0
+    assert blast_session._retry_after('1.5') == 1.5
+    assert blast_session._retry_after('-3') == 0.0
+    assert blast_session._retry_after('soon') == 0.0
+    later = email.utils.formatdate(time.time() + 120, usegmt=True)
+    assert 115 < blast_session._retry_after(later) <= 120
+    earlier = email.utils.formatdate(time.time() - 120, usegmt=True)
+    assert blast_session._retry_after(earlier) == 0.0
+
+
+def test_retry_after_is_respected():
+    session = blast_session.BlastSession(backoff=0.01, max_backoff=0.05)
+    delay = session._retry_delay(0, _response(503, **{'Retry-After': '7'}),
+                                 None)
+    assert delay == 7.0
+    # a shorter Retry-After doesn't cut the backoff
+    session = blast_session.BlastSession(backoff=10, max_backoff=10)
+    random.seed(1)
+    delays = [session._retry_delay(0, _response(429, **{'Retry-After': '0'}),
+                                   None) for _ in range(20)]
+    assert max(delays) > 0
+
+
+def test_backoff_is_jittered_and_capped():
+    session = blast_session.BlastSession(
+        retries=10, backoff=1.0, max_backoff=5.0)
+    random.seed(1)
+    for attempt in range(6):
+        delays = [session._retry_delay(attempt, _response(503), None)
+                  for _ in range(200)]
+        cap = min(5.0, 2 ** attempt)
+        assert all(0 <= x <= cap for x in delays)
+        # spread over the whole range, so that clients don't retry in step
+        assert min(delays) < 0.1 * cap and max(delays) > 0.9 * cap
+    assert session.retried == 6 * 200
+
+
+def test_only_transient_failures_are_retried():
+    session = blast_session.BlastSession(retries=1, backoff=0.01)
+    assert session._retry_delay(0, _response(200), None) is None
+    # e.g. an unknown job_key, which the caller checks for on the page
+    assert session._retry_delay(0, _response(404), None) is None
+    assert session._retry_delay(0, _response(502), None) is not None
+    with pytest.raises(requests.HTTPError):
+        session._retry_delay(1, _response(502), None)
+    with pytest.raises(requests.ConnectionError):
+        session._retry_delay(1, None, requests.ConnectionError('reset'))
+    assert session.failed == 2
+
+
+def test_sessions_are_per_thread():
+    session = blast_session.BlastSession(pool_size=4)
+    sessions = []
+
+    def remember():
+        sessions.append(session._session())
+        sessions.append(session._session())
+
+    threads = [threading.Thread(target=remember) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(x) for x in sessions}) == 3
+    for first, second in zip(sessions[::2], sessions[1::2]):
+        assert first is second
+    adapter = sessions[0].get_adapter('https://www.ncbi.nlm.nih.gov')
+    assert adapter._pool_maxsize == 4
+    assert 'gzip' in sessions[0].headers['Accept-Encoding']
+
+
+def test_unknown_job_key_is_returned(server):
+    session = blast_session.BlastSession(backoff=0.01, max_backoff=0.05)
+    response = session.get(server.url, {'job_key': 'EXPIRED'})
+    assert response.status_code == 404
+    assert session.stats()['retried'] == 0
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import pytest
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+
+numpy = pytest.importorskip('numpy')
+from rt_primer_design import thermo  # noqa: E402
+
+
+############
+# PROVIDES #
+############
+
+CONDITIONS = (50.0, 1.5, 0.6, 50.0)
+
+# primer3.calc_tm(oligo, mv_conc=50, dv_conc=1.5, dntp_conc=0.6,
+# dna_conc=50) from primer3-py 2.3.1
+PRIMER3_TM = {
+    'GATTACAGGCTTACCAGTCA': 54.477,
+    'AGCGGATAACAATTTCACACAGGA': 60.806,
+    'GTAAAACGACGGCCAGT': 54.695,
+    'TTGCCGAGACCAAGATCAAGC': 60.946,
+    'CCCAGTCACGACGTTGTAAAACG': 62.401,
+    'GCGCGGCCGCGGCG': 68.594}
+
+# Primer3 corrects self-complementary oligos for symmetry and the screen
+# doesn't, which is what the default tm_tolerance allows for
+PRIMER3_SYMMETRIC_TM = {
+    'ACGTACGTACGTACGTACGT': 59.597,
+    'ATATATATATATATATATAT': 30.792}
+
+
+def _tm(oligo):
+    screen = thermo.TemplateScreen(oligo)
+    return screen._candidates(len(oligo), CONDITIONS)['tm'][0]
+
+
+def _only_primer(oligo, **limits):
+    """Parameters under which oligo is the only possible primer pair of a
+    template of just oligo, whatever its Tm."""
+    parameters = {
+        'PRIMER_MIN_SIZE': len(oligo), 'PRIMER_MAX_SIZE': len(oligo),
+        'PRIMER_PRODUCT_MIN': len(oligo), 'PRIMER_PRODUCT_MAX': len(oligo),
+        'PRIMER_MIN_GC': 0, 'PRIMER_MAX_GC': 100, 'SELF_ANY': 100,
+        'SELF_END': 100, 'PRIMER_MIN_TM': 0, 'PRIMER_MAX_TM': 100}
+    parameters.update(limits)
+    return parameters
+
+
+def test_tm_matches_primer3():
+    for oligo, tm in PRIMER3_TM.items():
+        assert _tm(oligo) == pytest.approx(tm, abs=0.01), oligo
+    for oligo, tm in PRIMER3_SYMMETRIC_TM.items():
+        assert abs(_tm(oligo) - tm) < 1.0, oligo
+
+
+def test_feasible_at_tm_tolerance_boundary():
+    oligo = 'TTGCCGAGACCAAGATCAAGC'
+    screen = thermo.TemplateScreen(oligo)
+    tm = _tm(oligo)
+    assert screen.feasible(_only_primer(oligo))
+    assert screen.feasible(_only_primer(oligo, PRIMER_MIN_TM=tm),
+                           tm_tolerance=0)
+    assert screen.feasible(_only_primer(oligo, PRIMER_MAX_TM=tm),
+                           tm_tolerance=0)
+    assert not screen.feasible(_only_primer(oligo, PRIMER_MIN_TM=tm + 0.01),
+                               tm_tolerance=0)
+    assert screen.feasible(_only_primer(oligo, PRIMER_MIN_TM=tm + 0.99))
+    assert not screen.feasible(_only_primer(oligo, PRIMER_MIN_TM=tm + 1.01))
+    assert screen.feasible(_only_primer(oligo, PRIMER_MAX_TM=tm - 0.99))
+    assert not screen.feasible(_only_primer(oligo, PRIMER_MAX_TM=tm - 1.01))
+    # one base short of the product
+    assert not screen.feasible(_only_primer(
+        oligo, PRIMER_PRODUCT_MIN=len(oligo) + 1,
+        PRIMER_PRODUCT_MAX=len(oligo) + 1))
+
+
+def test_infeasible_gene_is_not_submitted(server, fast):
+    ref_seq = 'NM_000001.1'
+    blast_result = primer_blast.iterate_primer_blast(
+        ref_seq, STARTING_PARAMETERS, templates={ref_seq: 'A' * 300},
+        **fast)
+    assert blast_result.status == 'prescreen_infeasible'
+    assert server.stats()['submissions'] == 0
+
+    blast_result = primer_blast.iterate_primer_blast(
+        ref_seq, STARTING_PARAMETERS, templates={}, **fast)
+    assert blast_result.status != 'prescreen_infeasible'
+    assert server.stats()['submissions'] > 0
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+################
+# DEPENDENCIES #
+################
+
+import time
+from conftest import STARTING_PARAMETERS
+from rt_primer_design import primer_blast
+from rt_primer_design import work_queue
+
+
+############
+# PROVIDES #
+############
+
+GENES = ['NM_%09d.1' % x for x in range(6)]
+
+
+def test_claim_leases_each_gene_once(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    first = work_queue.WorkQueue(path, worker='first')
+    second = work_queue.WorkQueue(path, worker='second')
+    assert first.add(GENES) == len(GENES)
+    assert first.add(GENES[:2]) == 0
+    claimed = first.claim(4) + second.claim(4)
+    assert sorted(claimed) == sorted(GENES)
+    assert first.claim() == []
+    assert first.stats()['leased'] == len(GENES)
+    first.close()
+    second.close()
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    dead = work_queue.WorkQueue(path, lease_seconds=0.05, worker='dead')
+    alive = work_queue.WorkQueue(path, lease_seconds=60, worker='alive')
+    dead.add(GENES[:1])
+    assert dead.claim() == GENES[:1]
+    assert alive.claim() == []
+    assert 0 < alive.next_expiry() <= 0.05
+    time.sleep(0.1)
+    assert alive.stats()['expired'] == 1
+    assert alive.claim() == GENES[:1]
+    assert alive.taken_over == 1
+    # the dead worker's lease is gone, so it can't renew or release it
+    assert dead.renew() == 0
+    assert dead.release() == 0
+    assert alive.next_expiry() is None
+    dead.close()
+    alive.close()
+
+
+def test_release_hands_genes_back(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path / 'queue.db'))
+    queue.add(GENES)
+    queue.claim(3)
+    assert queue.release() == 3
+    assert queue.stats()['pending'] == len(GENES)
+
+
+def test_queue_rate_limiter_is_shared(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    buckets = [work_queue.WorkQueue(path).rate_limiter(rate=1, burst=1)
+               for x in range(2)]
+    assert buckets[0].reserve() == 0
+    # the second worker's bucket sees the token the first one took
+    assert buckets[1].reserve() > 0.5
+
+
+def test_run_worker_finishes_queue(tmp_path, fast):
+    path = str(tmp_path / 'queue.db')
+    queue = work_queue.WorkQueue(path, lease_seconds=5)
+    queue.add(GENES)
+    finished = primer_blast.run_worker(
+        queue, STARTING_PARAMETERS, n_jobs=3, **fast)
+    assert finished == len(GENES)
+    assert queue.stats()['done'] == len(GENES)
+    assert queue.stats()['leased'] == 0
+    records = list(queue.records())
+    assert [x['ref_seq'] for x in records] == GENES
+    assert queue.write_csv(str(tmp_path / 'panel.csv')) == len(GENES)